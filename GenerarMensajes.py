@@ -1,97 +1,48 @@
 import logging
+import threading
+import time
 import tkinter as tk
 from tkinter import ttk, messagebox
-import datetime as dt
 from datetime import datetime, date, timezone
+from functools import partial
 
 try:
     from tkcalendar import DateEntry
 except Exception:  # pragma: no cover - tkcalendar opcional
     DateEntry = None  # type: ignore
 
+from campanias_programadas import POLITICA_ENVIAR, POLITICA_OMITIR, get_programador_campanias
+from catalogo_plantillas import get_catalogo_plantillas
+from diario_campanias import FASE_CREACION, FASE_ENVIO, ORIGEN_GENERAR, DiarioCampania
+from directorio_tokens import get_directorio_tokens
+from escritor_lotes import MAX_OPS_LOTE, EscritorLotes
 from GestionUsuarios import on_mensajes_generados
-from notificaciones_push import enviar_push_por_mensaje
+from indice_dias_libres import get_indice_dias_libres
+from notificaciones_push import PodaTokens, enviar_push_masivo
+from push_service import get_push_service
+from resolutor_nombres import get_resolutor_nombres
+from thread_utils import run_bg
 from utils_mensajes import build_mensaje_id
 
 
 logger = logging.getLogger(__name__)
 
 
-def start_of_day_local_to_utc(d: date):
-    local_tz = dt.datetime.now().astimezone().tzinfo
-    local = dt.datetime(d.year, d.month, d.day, tzinfo=local_tz)
-    return local.astimezone(timezone.utc)
-
-
-def end_of_day_local_to_utc(d: date):
-    local_tz = dt.datetime.now().astimezone().tzinfo
-    local = dt.datetime(d.year, d.month, d.day, 23, 59, 59, 999000, tzinfo=local_tz)
-    return local.astimezone(timezone.utc)
-
-
-def _timestamp_to_local_date(value):
-    if value is None:
-        return None
-    if hasattr(value, "to_datetime"):
-        try:
-            value = value.to_datetime()
-        except Exception:
-            return None
-    if isinstance(value, dt.datetime):
-        if value.tzinfo is None:
-            value = value.replace(tzinfo=dt.datetime.now().astimezone().tzinfo)
-        return value.astimezone().date()
-    if isinstance(value, date):
-        return value
-    return None
-
-
-def _is_ok(v: str | None) -> bool:
-    return (v or "").strip().lower() == "ok"
-
-
 def _resolver_nombres(db, uids: list[str]) -> dict[str, str]:
-    """Devuelve {uid: Nombre} usando UsuariosAutorizados."""
-    out: dict[str, str] = {}
-    for uid in uids:
-        try:
-            doc = db.collection("UsuariosAutorizados").document(uid).get()
-            data = doc.to_dict() or {}
-            out[uid] = data.get("Nombre") or uid
-        except Exception:
-            out[uid] = uid
-    return out
+    """Devuelve {uid: Nombre} usando UsuariosAutorizados (el uid si no hay nombre)."""
+    nombres = get_resolutor_nombres(db).resolver(uids)
+    return {uid: nombres.get(uid) or uid for uid in uids}
 
 
 def _prechequeo_dias_libres(db, fecha_msg: date, uids_sel: list[str]) -> tuple[set[str], list[str]]:
     if not uids_sel:
         return set(), []
 
-    inicio = start_of_day_local_to_utc(fecha_msg)
-    fin = end_of_day_local_to_utc(fecha_msg)
-
     try:
-        peticiones = list(
-            db.collection("Peticiones")
-            .where("Fecha", ">=", inicio)
-            .where("Fecha", "<=", fin)
-            .stream()
-        )
+        conflict_uids = get_indice_dias_libres(db).libres_en(fecha_msg, uids_sel)
     except Exception:
-        peticiones = []
-
-    uids_sel_set = set(uids_sel)
-    conflict_uids: set[str] = set()
-
-    for peticion in peticiones:
-        data = peticion.to_dict() or {}
-        if not _is_ok(data.get("Admitido")):
-            continue
-        uid = data.get("uid") or data.get("Uid")
-        fecha = _timestamp_to_local_date(data.get("Fecha"))
-        if not uid or uid not in uids_sel_set or fecha != fecha_msg:
-            continue
-        conflict_uids.add(uid)
+        logger.exception("No se pudieron comprobar los días libres del %s", fecha_msg)
+        conflict_uids = set()
 
     nombres_map = _resolver_nombres(db, list(conflict_uids))
     nombres_conf = sorted(nombres_map.get(uid, uid) for uid in conflict_uids)
@@ -146,6 +97,244 @@ def _dialogo_conflictos(root, fecha_msg: date, nombres_conf: list[str]) -> bool:
     top.wait_window()
     return respuesta["send"]
 
+
+TAM_TROZO_CAMPANIA = 100  # usuarios por tarea del pool de envío
+TAM_TROZO_CREACION = MAX_OPS_LOTE  # documentos de Mensajes por WriteBatch de creación
+TAM_CONSULTA_EXISTENTES = 300
+
+
+def _crear_trozo(db, filas: list[tuple[str, str, dict]], diario: DiarioCampania | None = None) -> dict:
+    """Crea un trozo de docs de Mensajes (uid, doc_id, payload) en un WriteBatch con reintentos."""
+    with EscritorLotes(db, tam_lote=MAX_OPS_LOTE, intervalo=None, nombre="crear_mensajes") as escritor:
+        for _uid, doc_id, payload in filas:
+            escritor.set(db.collection("Mensajes").document(doc_id), payload)
+    no_creados = {str(path).rsplit("/", 1)[-1] for path, _ in escritor.fallos}
+    creados = [(uid, doc_id) for uid, doc_id, _ in filas if doc_id not in no_creados]
+    if diario is not None:
+        diario.marcar(FASE_CREACION, [uid for uid, _ in creados])
+    return {
+        "procesados": len(filas),
+        "creados": [doc_id for _, doc_id in creados],
+        "errores": [f"{path}: {err}" for path, err in escritor.fallos],
+    }
+
+
+def _mensajes_existentes(db, ids: list[str]) -> set[str]:
+    """Ids de Mensajes que ya existen (para reanudar sin duplicar ni pisar)."""
+    existentes: set[str] = set()
+    col = db.collection("Mensajes")
+    for i in range(0, len(ids), TAM_CONSULTA_EXISTENTES):
+        refs = [col.document(doc_id) for doc_id in ids[i:i + TAM_CONSULTA_EXISTENTES]]
+        for snap in db.get_all(refs, field_paths=["uid"]):
+            if getattr(snap, "exists", False):
+                existentes.add(snap.id)
+    return existentes
+
+
+def _procesar_trozo(
+    db,
+    filas: list[tuple[str, str, dict, dict]],
+    escritor: EscritorLotes,
+    poda: PodaTokens,
+    diario: DiarioCampania | None = None,
+) -> dict:
+    """Envía los push de un trozo de mensajes ya creados: (uid, doc_id, payload, usuario)."""
+    directorio = get_directorio_tokens(db).obtener_varios(uid for uid, _, _, _ in filas)
+    items = [
+        (doc_id, payload, directorio.get(uid) or data_u or {})
+        for uid, doc_id, payload, data_u in filas
+    ]
+    uids = [uid for uid, _, _, _ in filas]
+
+    resultados = enviar_push_masivo(
+        db, items, actualizar_estado=True, escritor=escritor, poda=poda
+    )
+
+    enviados = fallidos = dedupe = 0
+    for doc_id, resultado in resultados.items():
+        env = int(resultado.get("enviados", 0))
+        fall = int(resultado.get("fallidos", 0))
+        if env == 0 and fall == 0:
+            dedupe += 1
+        enviados += env
+        fallidos += fall
+        logger.info("Push %s -> enviados=%s fallidos=%s", doc_id, env, fall)
+    if diario is not None:
+        diario.marcar(FASE_ENVIO, uids)
+
+    return {
+        "procesados": len(items),
+        "enviados": enviados,
+        "fallidos": fallidos,
+        "dedupe": dedupe,
+        "uids": uids,
+    }
+
+
+def enviar_campania(
+    db,
+    usuarios: list[tuple[str, dict]],
+    *,
+    tipo: str,
+    mensaje: str,
+    cuerpo: str,
+    dia_str: str,
+    hora_str: str,
+    on_progreso=None,
+    cancelar=None,
+    pausa=None,
+    ahora_utc: datetime | None = None,
+    reanudar: bool = False,
+    diario: DiarioCampania | None = None,
+) -> dict:
+    """Campaña en dos fases: crea todos los docs de Mensajes por lotes y luego envía sus push.
+
+    Los ids se derivan de `ahora_utc` (instante fijo de la campaña), así que repetir la
+    campaña con el mismo instante y `reanudar=True` no crea duplicados: los docs que ya
+    existen no se reescriben y sus push ya enviados los filtra el registro de notificados.
+    El progreso lleva `fase` = "creacion" o "envio".
+
+    Con `diario`, cada trozo completado se anota en el diario local de la campaña y
+    los uids ya anotados se saltan sin volver a leerlos; la campaña sólo se da por
+    terminada en el diario si no se cancela.
+    """
+    ahora_utc = ahora_utc or datetime.now(timezone.utc)
+    datos = {"tipo": tipo, "mensaje": mensaje, "cuerpo": cuerpo, "dia": dia_str, "hora": hora_str}
+    filas: list[tuple[str, str, dict, dict]] = []
+    for uid, data_u in usuarios:
+        payload = {
+            "uid": uid,
+            "telefono": data_u.get("Telefono") or data_u.get("telefono") or "",
+            "estado": "Pendiente",
+            "motivo": "Pendiente",
+            **datos,
+            "fechaHora": ahora_utc,
+            "pushEstado": None,
+            "pushEnviados": 0,
+            "pushFallidos": 0,
+            "pushError": None,
+        }
+        filas.append((uid, build_mensaje_id(uid, ahora_utc), payload, data_u))
+
+    resumen = {
+        "creados": 0,
+        "existentes": 0,
+        "enviados": 0,
+        "fallidos": 0,
+        "dedupe": 0,
+        "tokens_podados": 0,
+        "uids": [],
+        "errores": [],
+        "creacion": {},
+    }
+    servicio = get_push_service()
+
+    def _con_fase(fase: str):
+        if on_progreso is None:
+            return None
+        return lambda p: on_progreso({**p, "fase": fase})
+
+    # --- Fase 1: creación masiva de los docs de Mensajes ---
+    existentes = {doc_id for uid, doc_id, _, _ in filas if diario is not None and diario.hecho(FASE_CREACION, uid)}
+    if reanudar:
+        existentes |= _mensajes_existentes(db, [f[1] for f in filas if f[1] not in existentes])
+    a_crear = [(uid, doc_id, payload) for uid, doc_id, payload, _ in filas if doc_id not in existentes]
+    t0 = time.monotonic()
+    resultados_creacion = servicio.ejecutar_campania(
+        [
+            partial(_crear_trozo, db, a_crear[i:i + TAM_TROZO_CREACION], diario)
+            for i in range(0, len(a_crear), TAM_TROZO_CREACION)
+        ],
+        total=len(a_crear),
+        on_progreso=_con_fase("creacion"),
+        cancelar=cancelar,
+        pausa=pausa,
+    )
+    listos = set(existentes)
+    for res in resultados_creacion:
+        if isinstance(res, Exception):
+            resumen["errores"].append(str(res))
+        elif isinstance(res, dict):
+            listos.update(res["creados"])
+            resumen["creados"] += len(res["creados"])
+            resumen["errores"].extend(res["errores"])
+    segundos = time.monotonic() - t0
+    resumen["existentes"] = len(existentes)
+    resumen["creacion"] = {
+        "segundos": segundos,
+        "por_segundo": resumen["creados"] / segundos if segundos > 0 else 0.0,
+        "lotes": len(resultados_creacion),
+    }
+    logger.info(
+        "Campaña: %s mensajes creados (%s ya existían) en %.1f s (%.1f docs/s, %s lotes)",
+        resumen["creados"],
+        len(existentes),
+        segundos,
+        resumen["creacion"]["por_segundo"],
+        resumen["creacion"]["lotes"],
+    )
+    if cancelar is not None and cancelar.is_set():
+        return resumen
+
+    # --- Fase 2: push sobre los mensajes creados ---
+    filas_envio = [
+        f for f in filas
+        if f[1] in listos and not (diario is not None and diario.hecho(FASE_ENVIO, f[0]))
+    ]
+    trozos = [
+        filas_envio[i:i + TAM_TROZO_CAMPANIA] for i in range(0, len(filas_envio), TAM_TROZO_CAMPANIA)
+    ]
+    # Los estados push de toda la campaña se confirman juntos por tamaño y por tiempo,
+    # y los tokens no registrados se podan en una sola pasada al final.
+    poda = PodaTokens()
+    with EscritorLotes(db, nombre="estado_push_campania") as escritor:
+        resultados = servicio.ejecutar_campania(
+            [partial(_procesar_trozo, db, trozo, escritor, poda, diario) for trozo in trozos],
+            total=len(filas_envio),
+            on_progreso=_con_fase("envio"),
+            cancelar=cancelar,
+            pausa=pausa,
+        )
+        resumen["tokens_podados"] = poda.aplicar(db, escritor)
+
+    for path, err in escritor.fallos:
+        resumen["errores"].append(f"{path}: {err}")
+    for res in resultados:
+        if isinstance(res, Exception):
+            resumen["errores"].append(str(res))
+            continue
+        if not isinstance(res, dict):
+            continue
+        resumen["enviados"] += res["enviados"]
+        resumen["fallidos"] += res["fallidos"]
+        resumen["dedupe"] += res["dedupe"]
+        resumen["uids"].extend(res["uids"])
+    if diario is not None and not (cancelar is not None and cancelar.is_set()):
+        diario.terminar(resumen)
+    return resumen
+
+
+def _destinatarios_diario(usuarios: list[tuple[str, dict]]) -> list[tuple[str, dict]]:
+    """Lo mínimo de cada destinatario que se guarda en el diario para poder reanudar."""
+    return [
+        (uid, {"Telefono": data_u.get("Telefono") or data_u.get("telefono") or ""})
+        for uid, data_u in usuarios
+    ]
+
+
+def reanudar_campania(db, diario: DiarioCampania, **kwargs) -> dict:
+    """Continúa una campaña de GenerarMensajes desde su diario (mismos ids y parámetros)."""
+    return enviar_campania(
+        db,
+        diario.usuarios,
+        ahora_utc=diario.ahora_utc,
+        reanudar=True,
+        diario=diario,
+        **diario.parametros,
+        **kwargs,
+    )
+
+
 ventana_generar = None
 
 
@@ -218,17 +407,68 @@ def abrir_generar_mensajes(db, preset=None):
 
     txt_cuerpo.bind("<KeyRelease>", limitar_cuerpo)
 
+    # --- Programación (opcional): hora de envío, reparto y qué hacer si vence ---
+    var_programar = tk.BooleanVar(value=False)
+    ttk.Checkbutton(frm, text="Programar envío", variable=var_programar).grid(
+        row=6, column=0, columnspan=2, sticky="w", **pad
+    )
+    frm_programa = ttk.Frame(frm)
+    frm_programa.columnconfigure(1, weight=1)
+    ttk.Label(frm_programa, text="Enviar el:").grid(row=0, column=0, sticky="w")
+    if DateEntry:
+        envio_entry = DateEntry(frm_programa, date_pattern="yyyy-mm-dd")
+    else:
+        envio_entry = ttk.Entry(frm_programa)
+        envio_entry.insert(0, datetime.now().strftime("%Y-%m-%d"))
+    envio_entry.grid(row=0, column=1, sticky="ew", padx=(6, 0))
+    frm_envio_hora = ttk.Frame(frm_programa)
+    sp_envio_hora = ttk.Spinbox(frm_envio_hora, from_=0, to=23, width=3, state="readonly", wrap=True, format="%02.0f")
+    ttk.Label(frm_envio_hora, text=":").grid(row=0, column=1, padx=2)
+    sp_envio_min = ttk.Spinbox(frm_envio_hora, from_=0, to=59, width=3, state="readonly", wrap=True, format="%02.0f")
+    sp_envio_hora.grid(row=0, column=0)
+    sp_envio_min.grid(row=0, column=2)
+    sp_envio_hora.set("06")
+    sp_envio_min.set("00")
+    frm_envio_hora.grid(row=0, column=2, sticky="w", padx=(6, 0))
+    ttk.Label(frm_programa, text="Repartir en (min):").grid(row=1, column=0, sticky="w", pady=(4, 0))
+    sp_ventana = ttk.Spinbox(frm_programa, from_=0, to=120, width=5)
+    sp_ventana.set("0")
+    sp_ventana.grid(row=1, column=1, sticky="w", padx=(6, 0), pady=(4, 0))
+    ttk.Label(frm_programa, text="Si vence con la app cerrada:").grid(row=2, column=0, sticky="w", pady=(4, 0))
+    politicas = {"Enviar al abrir": POLITICA_ENVIAR, "No enviar": POLITICA_OMITIR}
+    cmb_politica = ttk.Combobox(frm_programa, state="readonly", values=list(politicas))
+    cmb_politica.set("Enviar al abrir")
+    cmb_politica.grid(row=2, column=1, columnspan=2, sticky="ew", padx=(6, 0), pady=(4, 0))
+
+    def _alternar_programacion() -> None:
+        if var_programar.get():
+            frm_programa.grid(row=7, column=0, columnspan=2, sticky="ew", **pad)
+            btn_guardar.config(text="Programar")
+        else:
+            frm_programa.grid_remove()
+            btn_guardar.config(text="Guardar")
+
     # --- Botón guardar ---
     btn_guardar = ttk.Button(frm, text="Guardar")
-    btn_guardar.grid(row=6, column=0, columnspan=2, pady=10)
-
-    # --- Carga de datos Firestore ---
+    btn_guardar.grid(row=8, column=0, columnspan=2, pady=10)
+    var_programar.trace_add("write", lambda *_: _alternar_programacion())
+
+    # --- Progreso de la campaña (visible mientras se envía) ---
+    frm_progreso = ttk.Frame(frm)
+    frm_progreso.columnconfigure(0, weight=1)
+    barra = ttk.Progressbar(frm_progreso, mode="determinate", maximum=1)
+    barra.grid(row=0, column=0, columnspan=2, sticky="ew")
+    lbl_progreso = ttk.Label(frm_progreso, text="")
+    lbl_progreso.grid(row=1, column=0, columnspan=2, sticky="w", pady=(4, 0))
+    btn_pausa = ttk.Button(frm_progreso, text="Pausar")
+    btn_pausa.grid(row=2, column=0, sticky="w", pady=(6, 0))
+    btn_cancelar = ttk.Button(frm_progreso, text="Cancelar")
+    btn_cancelar.grid(row=2, column=1, sticky="e", pady=(6, 0))
+
+    # --- Plantillas (catálogo en memoria, sin lecturas por selección) ---
     def cargar_tipos():
         try:
-            doc = db.collection("PlantillasTipoMensaje").document("TipoMensaje").get()
-            if doc.exists:
-                tipos = [s.strip() for s in doc.to_dict().get("Tipo", "").split(",") if s.strip()]
-                cmb_tipo["values"] = tipos
+            cmb_tipo["values"] = get_catalogo_plantillas(db).tipos()
         except Exception as e:
             messagebox.showerror("Error", f"No se pudieron cargar los tipos: {e}")
 
@@ -239,10 +479,7 @@ def abrir_generar_mensajes(db, preset=None):
             cmb_mensaje.set("")
             return
         try:
-            doc = db.collection("PlantillasMensaje").document(tipo).get()
-            mensajes = []
-            if doc.exists:
-                mensajes = [s.strip() for s in doc.to_dict().get("Mensaje", "").split(",") if s.strip()]
+            mensajes = get_catalogo_plantillas(db).mensajes(tipo)
             cmb_mensaje["values"] = mensajes
             cmb_mensaje.set(mensajes[0] if mensajes else "")
         except Exception as e:
@@ -251,61 +488,177 @@ def abrir_generar_mensajes(db, preset=None):
     cmb_tipo.bind("<<ComboboxSelected>>", cargar_mensajes_por_tipo)
 
     # --- Guardar ---
-    def guardar():
-        tipo = cmb_tipo.get().strip()
-        mensaje = cmb_mensaje.get().strip()
-        cuerpo = txt_cuerpo.get("1.0", "end-1c").strip()
-        if not tipo or not mensaje:
-            messagebox.showerror("Error", "Debe seleccionar tipo y mensaje")
-            return
-        if len(cuerpo) > 200:
-            messagebox.showerror("Error", "El cuerpo supera 200 caracteres")
-            return
-
+    # El Tk sólo valida, muestra el diálogo de conflictos y pinta el progreso; la
+    # lectura de usuarios, el prechequeo y la campaña corren en hilos de fondo.
+    campania = {
+        "activa": False,
+        "cancelar": threading.Event(),
+        "pausa": threading.Event(),
+        "programacion": None,
+    }
+
+    def _en_ui(fn, *args) -> None:
         try:
-            if DateEntry and isinstance(date_entry, DateEntry):
-                dia = date_entry.get_date()
-            else:
-                dia = datetime.strptime(date_entry.get().strip(), "%Y-%m-%d").date()
-        except Exception:
-            messagebox.showerror("Error", "Fecha inválida")
+            ventana_generar.after(0, lambda: fn(*args))
+        except Exception:  # ventana cerrada
+            logger.debug("Ventana de generar mensajes cerrada; se descarta actualización")
+
+    def _fin_campania() -> None:
+        campania["activa"] = False
+        frm_progreso.grid_remove()
+        btn_guardar.config(state="normal")
+
+    def _mostrar_progreso(p: dict) -> None:
+        total = max(1, int(p.get("total") or 0))
+        hechos = int(p.get("procesados") or 0)
+        barra.config(maximum=total, value=hechos)
+        ritmo = float(p.get("por_segundo") or 0.0)
+        if p.get("pausado"):
+            eta = "en pausa"
+        elif ritmo > 0:
+            restante = int((total - hechos) / ritmo)
+            eta = f"ETA {restante // 60:02d}:{restante % 60:02d}"
+        else:
+            eta = "ETA --:--"
+        if p.get("fase") == "creacion":
+            texto = f"Creando mensajes {hechos}/{total} · {ritmo:.1f} docs/s · {eta}"
+        else:
+            texto = (
+                f"{hechos}/{total} · enviados {p.get('enviados', 0)} · "
+                f"fallidos {p.get('fallidos', 0)} · duplicados {p.get('dedupe', 0)} · "
+                f"{ritmo:.1f}/s · {eta}"
+            )
+        lbl_progreso.config(text=texto)
+
+    def _alternar_pausa() -> None:
+        if campania["pausa"].is_set():
+            campania["pausa"].clear()
+            btn_pausa.config(text="Pausar")
+        else:
+            campania["pausa"].set()
+            btn_pausa.config(text="Reanudar")
+
+    def _cancelar_campania() -> None:
+        if not campania["activa"]:
             return
-        try:
-            h = int(sp_hora.get())
-            m = int(sp_min.get())
-        except ValueError:
-            messagebox.showerror("Error", "Hora inválida")
+        if messagebox.askyesno(
+            "Cancelar",
+            "¿Cancelar la campaña? Los mensajes ya enviados no se deshacen.",
+            parent=ventana_generar,
+        ):
+            campania["cancelar"].set()
+            campania["pausa"].clear()
+            btn_cancelar.config(state="disabled")
+            btn_pausa.config(state="disabled")
+            lbl_progreso.config(text="Cancelando… esperando a los envíos en curso")
+
+    btn_pausa.config(command=_alternar_pausa)
+    btn_cancelar.config(command=_cancelar_campania)
+
+    def _mostrar_resumen(resumen_envio: dict) -> None:
+        _fin_campania()
+        if resumen_envio["errores"] and not (resumen_envio["creados"] or resumen_envio["existentes"]):
+            messagebox.showerror(
+                "Error", f"No se pudieron crear los mensajes: {resumen_envio['errores'][0]}"
+            )
             return
 
-        btn_guardar.config(state="disabled")
-        ventana_generar.update_idletasks()
-        uids_afectados: list[str] = []
+        count = resumen_envio["creados"]
+        total_enviados = resumen_envio["enviados"]
+        total_fallidos = resumen_envio["fallidos"]
+        total_dedupe = resumen_envio["dedupe"]
 
+        resumen = f"Mensajes creados para {count} usuarios"
+        if resumen_envio.get("cancelado"):
+            resumen = f"Campaña cancelada (puede continuarse con «Reanudar campaña»). {resumen}"
+        if resumen_envio["errores"]:
+            resumen += f" ({len(resumen_envio['errores'])} errores, ver log)"
+        if resumen_envio["tokens_podados"]:
+            resumen += f". Tokens no registrados eliminados: {resumen_envio['tokens_podados']}"
+        if total_enviados > 0 and total_fallidos == 0:
+            messagebox.showinfo(
+                "Mensaje",
+                f"{resumen}. Notificaciones enviadas: {total_enviados}.",
+            )
+        elif total_enviados > 0:
+            messagebox.showwarning(
+                "Mensaje",
+                f"{resumen}. Notificaciones: {total_enviados} enviadas, {total_fallidos} fallidas.",
+            )
+        elif total_dedupe > 0:
+            messagebox.showinfo(
+                "Mensaje",
+                f"{resumen}. No se enviaron notificaciones nuevas (ya enviadas).",
+            )
+        else:
+            messagebox.showwarning(
+                "Mensaje",
+                f"{resumen}. No se pudo enviar ninguna notificación.",
+            )
+        ventana_generar.destroy()
+
+    def _error_campania(texto: str) -> None:
+        _fin_campania()
+        messagebox.showerror("Error", texto)
+
+    def _fase_envio(usuarios_filtrados: list, datos: dict) -> None:
         try:
-            usuarios_stream = db.collection("UsuariosAutorizados").where("Mensaje", "==", True).stream()
-            usuarios_list = []
-            uids_seleccionados: list[str] = []
-            for doc_user in usuarios_stream:
-                data_u = doc_user.to_dict() or {}
-                uid = doc_user.id
-                usuarios_list.append((uid, data_u))
-                uids_seleccionados.append(uid)
+            ahora_utc = datetime.now(timezone.utc)
+            diario = DiarioCampania.crear(
+                ORIGEN_GENERAR, datos, ahora_utc, _destinatarios_diario(usuarios_filtrados)
+            )
+            resumen_envio = enviar_campania(
+                db,
+                usuarios_filtrados,
+                on_progreso=lambda p: _en_ui(_mostrar_progreso, p),
+                cancelar=campania["cancelar"],
+                pausa=campania["pausa"],
+                ahora_utc=ahora_utc,
+                diario=diario,
+                **datos,
+            )
         except Exception as e:
-            messagebox.showerror("Error", f"No se pudieron obtener los usuarios seleccionados: {e}")
-            btn_guardar.config(state="normal")
+            logger.exception("Error en la campaña de mensajes")
+            _en_ui(_error_campania, f"No se pudieron crear los mensajes: {e}")
             return
+        resumen_envio["cancelado"] = campania["cancelar"].is_set()
+        if resumen_envio["uids"]:
+            on_mensajes_generados(resumen_envio["uids"], db)
+        _en_ui(_mostrar_resumen, resumen_envio)
 
-        conflictos, nombres_conf = _prechequeo_dias_libres(db, dia, uids_seleccionados)
+    def _programar_envio(usuarios_filtrados: list, datos: dict, programacion: dict) -> None:
+        try:
+            programada = get_programador_campanias(db).programar(
+                datos, _destinatarios_diario(usuarios_filtrados), **programacion
+            )
+        except Exception as e:
+            logger.exception("Error programando la campaña")
+            _error_campania(f"No se pudo programar la campaña: {e}")
+            return
+        _fin_campania()
+        envio = programada.envio_utc.astimezone().strftime("%d-%m-%Y %H:%M")
+        reparto = f", repartida en {programada.ventana / 60:.0f} min" if programada.tramos > 1 else ""
+        messagebox.showinfo(
+            "Campaña programada",
+            f"Mensajes para {len(usuarios_filtrados)} usuarios programados para el {envio}{reparto}.\n"
+            "La aplicación debe estar abierta a esa hora.",
+        )
+        ventana_generar.destroy()
 
+    def _tras_lectura(dia: date, datos: dict, usuarios_list: list, conflictos: set, nombres_conf: list) -> None:
+        if campania["cancelar"].is_set():
+            _fin_campania()
+            return
+        uids_seleccionados = [uid for uid, _ in usuarios_list]
         if conflictos:
             seguir = _dialogo_conflictos(ventana_generar, dia, nombres_conf)
             if not seguir:
-                btn_guardar.config(state="normal")
+                _fin_campania()
                 return
             uids_permitidos = [uid for uid in uids_seleccionados if uid not in conflictos]
             if not uids_permitidos:
                 messagebox.showinfo("Sin envíos", "Todos los usuarios seleccionados tienen día libre para esa fecha.")
-                btn_guardar.config(state="normal")
+                _fin_campania()
                 return
         else:
             uids_permitidos = uids_seleccionados
@@ -315,100 +668,112 @@ def abrir_generar_mensajes(db, preset=None):
 
         if not usuarios_filtrados:
             messagebox.showinfo("Sin usuarios", "No hay usuarios seleccionados para enviar mensajes.")
-            btn_guardar.config(state="normal")
+            _fin_campania()
+            return
+
+        if campania["programacion"] is not None:
+            _programar_envio(usuarios_filtrados, datos, campania["programacion"])
             return
 
-        total_enviados = 0
-        total_fallidos = 0
-        total_dedupe = 0
+        _mostrar_progreso({"total": len(usuarios_filtrados)})
+        btn_pausa.config(state="normal", text="Pausar")
+        btn_cancelar.config(state="normal")
+        run_bg(_fase_envio, usuarios_filtrados, datos, _thread_name="campania_mensajes")
 
+    def _fase_lectura(dia: date, datos: dict) -> None:
         try:
-            count = 0
-            ahora_utc = datetime.now(timezone.utc)
-            dia_str = dia.strftime("%Y-%m-%d")
-            hora_str = f"{h:02d}:{m:02d}"
-
-            for uid, data_u in usuarios_filtrados:
-                telefono = data_u.get("Telefono") or data_u.get("telefono") or ""
-                doc_id = build_mensaje_id(uid, ahora_utc)
-                payload = {
-                    "uid": uid,
-                    "telefono": telefono,
-                    "estado": "Pendiente",
-                    "motivo": "Pendiente",
-                    "tipo": tipo,
-                    "mensaje": mensaje,
-                    "cuerpo": cuerpo,
-                    "dia": dia_str,
-                    "hora": hora_str,
-                    "fechaHora": ahora_utc,
-                    "pushEstado": None,
-                    "pushEnviados": 0,
-                    "pushFallidos": 0,
-                    "pushError": None,
-                }
-                doc_ref = db.collection("Mensajes").document(doc_id)
-                doc_ref.set(payload)
-
-                try:
-                    user_snap = db.collection("UsuariosAutorizados").document(uid).get()
-                    user_data = user_snap.to_dict() if getattr(user_snap, "exists", False) else data_u
-                except Exception:
-                    logger.exception("No se pudo obtener usuario %s para notificación", uid)
-                    user_data = data_u
-
-                resultado = enviar_push_por_mensaje(
-                    db,
-                    doc_id,
-                    payload,
-                    user_data or {},
-                    actualizar_estado=True,
-                )
-                env = int(resultado.get("enviados", 0))
-                fall = int(resultado.get("fallidos", 0))
-                if env == 0 and fall == 0:
-                    total_dedupe += 1
-                total_enviados += env
-                total_fallidos += fall
-                logger.info(
-                    "Push %s -> enviados=%s fallidos=%s", doc_id, env, fall
-                )
-
-                count += 1
-                uids_afectados.append(uid)
-                ventana_generar.update_idletasks()
+            usuarios_stream = db.collection("UsuariosAutorizados").where("Mensaje", "==", True).stream()
+            usuarios_list = [(doc_user.id, doc_user.to_dict() or {}) for doc_user in usuarios_stream]
         except Exception as e:
-            messagebox.showerror("Error", f"No se pudieron crear los mensajes: {e}")
-            btn_guardar.config(state="normal")
+            _en_ui(_error_campania, f"No se pudieron obtener los usuarios seleccionados: {e}")
             return
+        conflictos, nombres_conf = _prechequeo_dias_libres(db, dia, [uid for uid, _ in usuarios_list])
+        _en_ui(_tras_lectura, dia, datos, usuarios_list, conflictos, nombres_conf)
 
-        on_mensajes_generados(uids_afectados, db)
+    def guardar():
+        if campania["activa"]:
+            return
+        tipo = cmb_tipo.get().strip()
+        mensaje = cmb_mensaje.get().strip()
+        cuerpo = txt_cuerpo.get("1.0", "end-1c").strip()
+        if not tipo or not mensaje:
+            messagebox.showerror("Error", "Debe seleccionar tipo y mensaje")
+            return
+        if len(cuerpo) > 200:
+            messagebox.showerror("Error", "El cuerpo supera 200 caracteres")
+            return
 
-        resumen = f"Mensajes creados para {count} usuarios"
-        if total_enviados > 0 and total_fallidos == 0:
-            messagebox.showinfo(
-                "Mensaje",
-                f"{resumen}. Notificaciones enviadas: {total_enviados}.",
-            )
-        elif total_enviados > 0:
-            messagebox.showwarning(
-                "Mensaje",
-                f"{resumen}. Notificaciones: {total_enviados} enviadas, {total_fallidos} fallidas.",
-            )
-        elif total_dedupe > 0:
-            messagebox.showinfo(
-                "Mensaje",
-                f"{resumen}. No se enviaron notificaciones nuevas (ya enviadas).",
-            )
-        else:
-            messagebox.showwarning(
-                "Mensaje",
-                f"{resumen}. No se pudo enviar ninguna notificación.",
-            )
-        ventana_generar.destroy()
+        try:
+            if DateEntry and isinstance(date_entry, DateEntry):
+                dia = date_entry.get_date()
+            else:
+                dia = datetime.strptime(date_entry.get().strip(), "%Y-%m-%d").date()
+        except Exception:
+            messagebox.showerror("Error", "Fecha inválida")
+            return
+        try:
+            h = int(sp_hora.get())
+            m = int(sp_min.get())
+        except ValueError:
+            messagebox.showerror("Error", "Hora inválida")
+            return
+
+        programacion = None
+        if var_programar.get():
+            try:
+                if DateEntry and isinstance(envio_entry, DateEntry):
+                    dia_envio = envio_entry.get_date()
+                else:
+                    dia_envio = datetime.strptime(envio_entry.get().strip(), "%Y-%m-%d").date()
+                envio_local = datetime(
+                    dia_envio.year, dia_envio.month, dia_envio.day, int(sp_envio_hora.get()), int(sp_envio_min.get())
+                ).astimezone()
+            except Exception:
+                messagebox.showerror("Error", "Fecha u hora de envío inválida")
+                return
+            if envio_local <= datetime.now().astimezone():
+                messagebox.showerror("Error", "La hora de envío programada ya ha pasado")
+                return
+            try:
+                ventana_min = max(0, int(sp_ventana.get() or 0))
+            except ValueError:
+                messagebox.showerror("Error", "Minutos de reparto inválidos")
+                return
+            programacion = {
+                "envio_utc": envio_local.astimezone(timezone.utc),
+                "ventana": ventana_min * 60.0,
+                "politica": politicas.get(cmb_politica.get(), POLITICA_ENVIAR),
+            }
+
+        datos = {
+            "tipo": tipo,
+            "mensaje": mensaje,
+            "cuerpo": cuerpo,
+            "dia_str": dia.strftime("%Y-%m-%d"),
+            "hora_str": f"{h:02d}:{m:02d}",
+        }
+        campania["programacion"] = programacion
+        campania["activa"] = True
+        campania["cancelar"].clear()
+        campania["pausa"].clear()
+        btn_guardar.config(state="disabled")
+        barra.config(maximum=1, value=0)
+        lbl_progreso.config(text="Leyendo usuarios…")
+        btn_pausa.config(state="disabled")
+        btn_cancelar.config(state="disabled")
+        frm_progreso.grid(row=9, column=0, columnspan=2, sticky="ew", **pad)
+        run_bg(_fase_lectura, dia, datos, _thread_name="campania_lectura")
 
     btn_guardar.config(command=guardar)
 
+    def _al_cerrar():
+        if campania["activa"]:
+            _cancelar_campania()
+            return
+        ventana_generar.destroy()
+
+    ventana_generar.protocol("WM_DELETE_WINDOW", _al_cerrar)
+
     def aplicar_preset(preset):
         if not preset:
             return
@@ -13,6 +13,8 @@ except Exception:  # tkcalendar no disponible
 
 from firebase_admin import firestore
 
+from resolutor_nombres import get_resolutor_nombres
+
 # Gestión de reenvíos de mensajes
 def reset_all_usuarios_mensaje(db: firestore.Client) -> None:
     """Establece Mensaje=False a todos los documentos de UsuariosAutorizados."""
@@ -42,8 +44,6 @@ def set_usuarios_mensaje_true(db: firestore.Client, uid_set: Set[str]) -> None:
     if n % 450 != 0:
         batch.commit()
 
-nombre_cache: Dict[str, str] = {}
-
 # Ventana principal de gestión de mensajes (singleton)
 ventana_mensajes = None
 
@@ -72,19 +72,7 @@ def formatea_fecha(valor) -> str:
 
 
 def fetch_nombre(uid: str, db: firestore.Client) -> str:
-    if not uid:
-        return "Falta"
-    if uid in nombre_cache:
-        return nombre_cache[uid]
-    nombre = "Falta"
-    try:
-        doc = db.collection("UsuariosAutorizados").document(uid).get()
-        if doc.exists:
-            nombre = doc.to_dict().get("Nombre") or "Falta"
-    except Exception as e:
-        print(f"❌ Error obteniendo nombre para {uid}: {e}")
-    nombre_cache[uid] = nombre
-    return nombre
+    return get_resolutor_nombres(db).nombre(uid, "Falta")
 
 
 def abrir_gestion_mensajes(db: firestore.Client) -> None:
@@ -332,6 +320,10 @@ def abrir_gestion_mensajes(db: firestore.Client) -> None:
             q = db.collection("Mensajes").where("dia", "==", dia_str)
             q = q.order_by("fechaHora", direction=firestore.Query.DESCENDING)
             docs = list(q.stream())
+            # Todos los nombres del día en unas pocas lecturas get_all.
+            nombres = get_resolutor_nombres(db).resolver(
+                (doc.to_dict() or {}).get("uid") for doc in docs
+            )
             datos = []
             row_by_doc = {}
             mensajes_unicos = set()
@@ -346,7 +338,7 @@ def abrir_gestion_mensajes(db: firestore.Client) -> None:
                 motivo = item.get("motivo")
                 if not motivo:
                     motivo = estado_msg or ""
-                nombre = fetch_nombre(uid, db)
+                nombre = nombres.get(uid) or "Falta"
                 row = {
                     "doc_id": doc.id,
                     "tipo": item.get("tipo", ""),
@@ -8,7 +8,8 @@ from typing import Any, Dict, List, Optional
 
 from firebase_admin import firestore
 
-from thread_utils import run_bg
+from directorio_tokens import get_directorio_tokens
+from push_service import get_push_service
 from ui_safety import error, info
 
 _main_module = sys.modules.get("main")
@@ -18,7 +19,6 @@ if _main_module is None:
         candidate is None
         or not hasattr(candidate, "_is_valid_fcm_token")
         or not hasattr(candidate, "enviar_fcm")
-        or not hasattr(candidate, "get_doc_safe")
         or not hasattr(candidate, "obtener_token_oauth")
     ):
         _main_module = importlib.import_module("main")
@@ -27,7 +27,6 @@ if _main_module is None:
 
 _is_valid_fcm_token = getattr(_main_module, "_is_valid_fcm_token")
 enviar_fcm = getattr(_main_module, "enviar_fcm")
-get_doc_safe = getattr(_main_module, "get_doc_safe")
 obtener_token_oauth = getattr(_main_module, "obtener_token_oauth")
 
 try:
@@ -354,23 +353,22 @@ class GestionPeticionesUI:
             return
 
         rows: List[Dict[str, Any]] = []
-        for doc in snapshot:
-            data = doc.to_dict() or {}
+        docs = [(doc.id, doc.to_dict() or {}) for doc in snapshot]
+        try:
+            usuarios = get_directorio_tokens(self.db).obtener_varios(
+                data.get("uid") for _, data in docs
+            )
+        except Exception as err:
+            print(f"❌ Error obteniendo usuarios: {err}")
+            usuarios = {}
+        for doc_id, data in docs:
             uid = data.get("uid") or ""
-            nombre = "Falta"
-            token = None
-            try:
-                if uid:
-                    user_doc = self.db.collection("UsuariosAutorizados").document(uid).get()
-                    if user_doc.exists:
-                        user_data = user_doc.to_dict() or {}
-                        nombre = user_data.get("Nombre") or "Falta"
-                        token = user_data.get("fcmToken")
-            except Exception as err:
-                print(f"❌ Error obteniendo usuario {uid}: {err}")
+            user_data = usuarios.get(str(uid)) or {}
+            nombre = user_data.get("Nombre") or "Falta"
+            token = user_data.get("fcmToken")
 
             row = {
-                "doc_id": doc.id,
+                "doc_id": doc_id,
                 "uid": uid,
                 "fcmToken": token,
                 "Nombre": nombre or "Falta",
@@ -509,8 +507,7 @@ class GestionPeticionesUI:
                 try:
                     _actualizar_peticion(self.db, peticion_id, decision)
 
-                    usuario_doc = self.db.collection("UsuariosAutorizados").document(uid)
-                    usuario = get_doc_safe(usuario_doc) or {}
+                    usuario = get_directorio_tokens(self.db).obtener(uid) or {}
                     token = usuario.get("fcmToken")
                     if not _is_valid_fcm_token(token):
                         info(
@@ -542,7 +539,7 @@ class GestionPeticionesUI:
                     logger.exception("Fallo al responder petición")
                     error(parent, "Error", f"No se pudo completar la operación: {exc}")
 
-            run_bg(worker, _thread_name=f"responder_peticion_{peticion_id}")
+            get_push_service().submit(worker)
 
         detalle = (
             f"Solicitante: {nombre}\n"
@@ -13,45 +13,13 @@ from typing import Optional, Union, Dict, Iterable, Tuple, List, Any, Set
 from collections import defaultdict
 from concurrent.futures import ThreadPoolExecutor
 import time
+from indice_dias_libres import get_indice_dias_libres
+from resolutor_nombres import get_resolutor_nombres
 
 
 DATE_RE = re.compile(r"(\d{1,2})[/-](\d{1,2})[/-](\d{2,4})")
 
 
-def start_of_day_local_to_utc(d: date):
-    local_tz = dt.datetime.now().astimezone().tzinfo
-    local = dt.datetime(d.year, d.month, d.day, tzinfo=local_tz)
-    return local.astimezone(timezone.utc)
-
-
-def end_of_day_local_to_utc(d: date):
-    local_tz = dt.datetime.now().astimezone().tzinfo
-    local = dt.datetime(d.year, d.month, d.day, 23, 59, 59, 999000, tzinfo=local_tz)
-    return local.astimezone(timezone.utc)
-
-
-def _timestamp_to_local_date(value):
-    if value is None:
-        return None
-    # Firestore Timestamp → datetime
-    if hasattr(value, "to_datetime"):
-        try:
-            value = value.to_datetime()
-        except Exception:
-            return None
-    if isinstance(value, dt.datetime):
-        if value.tzinfo is None:
-            value = value.replace(tzinfo=dt.datetime.now().astimezone().tzinfo)
-        return value.astimezone().date()
-    if isinstance(value, date):
-        return value
-    return None
-
-
-def _is_ok(v: str | None) -> bool:
-    return (v or "").strip().lower() == "ok"
-
-
 def parse_baja_texto_largo(raw: str) -> date | None:
     """Devuelve la **última** fecha válida encontrada en el texto (dd/mm/yy|yyyy o dd-mm-yy|yyyy)."""
     if not raw:
@@ -1345,25 +1313,8 @@ def abrir_gestion_usuarios(db):
         hoy = dt.datetime.now().date()
         rango_fin = hoy + timedelta(days=5)
 
-        peticiones_cursor = list(
-            db.collection("Peticiones")
-            .where("Fecha", ">=", start_of_day_local_to_utc(hoy))
-            .where("Fecha", "<=", end_of_day_local_to_utc(rango_fin))
-            .stream()
-        )
-
         upcoming_by_uid.clear()
-        for pet_doc in peticiones_cursor:
-            d = pet_doc.to_dict() or {}
-            if not _is_ok(d.get("Admitido")):
-                continue
-            uid_pet = d.get("uid") or d.get("Uid")
-            f = _timestamp_to_local_date(d.get("Fecha"))
-            if uid_pet and f and hoy <= f <= rango_fin:
-                upcoming_by_uid[uid_pet].append(f)
-
-        for fechas in upcoming_by_uid.values():
-            fechas.sort()
+        upcoming_by_uid.update(get_indice_dias_libres(db).proximos(hoy, rango_fin))
 
         print(
             f"🔎 Peticiones OK próximos 5 días: {sum(len(v) for v in upcoming_by_uid.values())} en {len(upcoming_by_uid)} usuarios"
@@ -1602,6 +1553,7 @@ def abrir_gestion_usuarios(db):
         try:
             # Eliminar de Firestore
             db.collection("UsuariosAutorizados").document(uid).delete()
+            get_resolutor_nombres(db).invalidar(uid)
             print(f"✅ Documento {uid} eliminado de Firestore.")
 
             # Eliminar de Firebase Auth si existe
@@ -1652,6 +1604,7 @@ def abrir_gestion_usuarios(db):
 
             try:
                 db.collection("UsuariosAutorizados").document(uid).update(datos)
+                get_resolutor_nombres(db).invalidar(uid)
             except Exception as e:
                 print(f"⚠️ Error guardando {uid}: {e}")
 
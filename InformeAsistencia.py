@@ -37,6 +37,7 @@ else:  # pragma: no cover - pyodbc ausente
 from firebase_admin import firestore
 from google.api_core.exceptions import FailedPrecondition
 
+from catalogo_plantillas import get_catalogo_plantillas
 from thread_utils import run_bg
 
 logger = logging.getLogger(__name__)
@@ -854,28 +855,15 @@ def _actualizar_treeviews() -> None:
 
 
 def cargar_tipos_produccion(db: firestore.Client) -> List[str]:
-    candidatos = [
-        ("PlantillasMensaje", "Producción"),
-        ("PlantillasMensaje", "Produccion"),
-    ]
-
+    catalogo = get_catalogo_plantillas(db)
     mensajes: List[str] = []
-    for coleccion, documento in candidatos:
+    for documento in ("Producción", "Produccion"):
         try:
-            doc = db.collection(coleccion).document(documento).get()
+            mensajes = catalogo.mensajes(documento)
         except Exception:
             continue
-        if doc.exists:
-            datos = doc.to_dict() or {}
-            texto = datos.get("Mensaje") or ""
-            if isinstance(texto, str) and texto.strip():
-                mensajes.extend(texto.split(","))
-                break
-            # fallback: si el doc contiene subdocumento "Producción"
-            produccion = datos.get("Producción")
-            if isinstance(produccion, dict) and isinstance(produccion.get("Mensaje"), str):
-                mensajes.extend(produccion["Mensaje"].split(","))
-                break
+        if mensajes:
+            break
 
     if not mensajes:
         rutas_extra = [
@@ -0,0 +1,348 @@
+"""Benchmark offline del envío push contra los sustitutos de `fake_fcm`.
+
+Escenarios:
+- `por_mensaje`: `notificaciones_push.enviar_push_por_mensaje`, un mensaje por llamada.
+- `http_v1`: `cliente_fcm.enviar_mensaje`, el núcleo HTTP de `main.enviar_fcm`
+  (main.py arranca la interfaz al importarse), contra `ServidorFCMFalso`.
+- `campania`: `GenerarMensajes.enviar_campania` completo (creación + push por lotes).
+
+Firestore se sustituye por un cliente en memoria que cuenta lecturas y escrituras.
+En `campania` la latencia es el tiempo, desde el inicio, hasta que termina el push de
+cada mensaje (incluye la fase de creación masiva).
+
+Uso: python bench_push.py --usuarios 100,1000,10000 --latencia-ms 20
+"""
+
+import argparse
+import logging
+import os
+import statistics
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+import directorio_tokens
+import push_service
+from fake_fcm import PREFIJO_MUERTO, BackendSendEachFalso, ServidorFCMFalso, SimuladorFCM
+
+logger = logging.getLogger(__name__)
+
+TAMANOS = (100, 1000, 10000)
+ESCENARIOS = ("por_mensaje", "http_v1", "campania")
+
+
+# --- Firestore en memoria ---
+class _SnapFalso:
+    def __init__(self, ref: "_DocFalso", datos: Optional[dict]) -> None:
+        self.reference = ref
+        self.id = ref.id
+        self.exists = datos is not None
+        self._datos = datos
+
+    def to_dict(self) -> Optional[dict]:
+        return dict(self._datos) if self._datos is not None else None
+
+
+class _DocFalso:
+    def __init__(self, db: "FirestoreFalso", coleccion: str, doc_id: str) -> None:
+        self._db = db
+        self.id = doc_id
+        self.path = f"{coleccion}/{doc_id}"
+
+    def get(self, *args, **kwargs) -> _SnapFalso:
+        self._db.contar(lecturas=1)
+        return _SnapFalso(self, self._db.leer(self.path))
+
+    def set(self, datos: dict, merge: bool = False) -> None:
+        self._db.escribir(self.path, datos, merge)
+
+    def create(self, datos: dict) -> None:
+        self._db.escribir(self.path, datos, False)
+
+    def update(self, datos: dict) -> None:
+        self._db.escribir(self.path, datos, True)
+
+    def delete(self) -> None:
+        self._db.borrar(self.path)
+
+
+class _ColeccionFalsa:
+    def __init__(self, db: "FirestoreFalso", nombre: str) -> None:
+        self._db = db
+        self.id = nombre
+
+    def document(self, doc_id: str) -> _DocFalso:
+        return _DocFalso(self._db, self.id, str(doc_id))
+
+    def stream(self):
+        prefijo = f"{self.id}/"
+        for path in self._db.rutas(prefijo):
+            yield self.document(path[len(prefijo):]).get()
+
+    def on_snapshot(self, callback):
+        """Entrega una única instantánea inicial; el benchmark no modifica usuarios."""
+        callback(list(self.stream()), [], None)
+        return _WatchFalso()
+
+
+class _WatchFalso:
+    def unsubscribe(self) -> None:
+        pass
+
+
+class _BatchFalso:
+    def __init__(self, db: "FirestoreFalso") -> None:
+        self._db = db
+        self._ops: list[Callable[[], None]] = []
+
+    def set(self, ref: _DocFalso, datos: dict, merge: bool = False) -> None:
+        self._ops.append(lambda: ref.set(datos, merge))
+
+    def create(self, ref: _DocFalso, datos: dict) -> None:
+        self._ops.append(lambda: ref.create(datos))
+
+    def update(self, ref: _DocFalso, datos: dict) -> None:
+        self._ops.append(lambda: ref.update(datos))
+
+    def delete(self, ref: _DocFalso) -> None:
+        self._ops.append(ref.delete)
+
+    def commit(self, timeout: Optional[float] = None) -> list:
+        self._db.contar(commits=1)
+        for op in self._ops:
+            op()
+        return []
+
+
+class FirestoreFalso:
+    """Subconjunto de `firestore.Client` usado por el camino de envío."""
+
+    def __init__(self) -> None:
+        self._datos: dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self.lecturas = 0
+        self.escrituras = 0
+        self.commits = 0
+
+    def contar(self, lecturas: int = 0, escrituras: int = 0, commits: int = 0) -> None:
+        with self._lock:
+            self.lecturas += lecturas
+            self.escrituras += escrituras
+            self.commits += commits
+
+    def leer(self, path: str) -> Optional[dict]:
+        with self._lock:
+            datos = self._datos.get(path)
+            return dict(datos) if datos is not None else None
+
+    def escribir(self, path: str, datos: dict, merge: bool) -> None:
+        with self._lock:
+            self.escrituras += 1
+            if merge and path in self._datos:
+                self._datos[path].update(datos)
+            else:
+                self._datos[path] = dict(datos)
+
+    def borrar(self, path: str) -> None:
+        with self._lock:
+            self.escrituras += 1
+            self._datos.pop(path, None)
+
+    def rutas(self, prefijo: str) -> list[str]:
+        with self._lock:
+            return [p for p in self._datos if p.startswith(prefijo) and "/" not in p[len(prefijo):]]
+
+    def sembrar(self, path: str, datos: dict) -> None:
+        with self._lock:
+            self._datos[path] = dict(datos)
+
+    def reiniciar_contadores(self) -> None:
+        with self._lock:
+            self.lecturas = self.escrituras = self.commits = 0
+
+    def collection(self, nombre: str) -> _ColeccionFalsa:
+        return _ColeccionFalsa(self, nombre)
+
+    def batch(self) -> _BatchFalso:
+        return _BatchFalso(self)
+
+    def get_all(self, refs, field_paths=None, **kwargs):
+        for ref in refs:
+            yield ref.get()
+
+
+# --- población ---
+def _usuarios(n: int, tasa_muertos: float, prefijo: str) -> list[tuple[str, dict]]:
+    muertos_cada = int(1 / tasa_muertos) if tasa_muertos > 0 else 0
+    usuarios = []
+    for i in range(n):
+        muerto = muertos_cada and i % muertos_cada == 0
+        token = f"{PREFIJO_MUERTO if muerto else 'tok'}-{prefijo}-{i}"
+        usuarios.append((f"{prefijo}-u{i}", {
+            "Nombre": f"Usuario {i}",
+            "Telefono": f"600{i:06d}",
+            "Mensaje": True,
+            "fcmToken": [token],
+        }))
+    return usuarios
+
+
+def _sembrar(db: FirestoreFalso, usuarios: list[tuple[str, dict]]) -> None:
+    for uid, datos in usuarios:
+        db.sembrar(f"UsuariosAutorizados/{uid}", datos)
+    # El directorio de tokens se carga al arrancar la aplicación, fuera de la medida.
+    directorio_tokens._directorio = None
+    directorio_tokens.get_directorio_tokens(db)
+
+
+def _percentil(valores: list[float], p: float) -> float:
+    if not valores:
+        return 0.0
+    if len(valores) == 1:
+        return valores[0]
+    return statistics.quantiles(valores, n=100, method="inclusive")[int(p) - 1]
+
+
+def _medir(fn: Callable[[int], None], n: int, concurrencia: int) -> tuple[float, list[float]]:
+    latencias: list[float] = [0.0] * n
+
+    def _uno(i: int) -> None:
+        t0 = time.perf_counter()
+        try:
+            fn(i)
+        finally:
+            latencias[i] = time.perf_counter() - t0
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrencia, thread_name_prefix="bench") as pool:
+        list(pool.map(_uno, range(n)))
+    return time.perf_counter() - inicio, latencias
+
+
+# --- escenarios ---
+def escenario_por_mensaje(db: FirestoreFalso, n: int, args) -> tuple[float, list[float]]:
+    from notificaciones_push import enviar_push_por_mensaje
+
+    usuarios = _usuarios(n, args.tasa_muertos, f"pm{n}")
+    _sembrar(db, usuarios)
+    db.reiniciar_contadores()
+
+    def _enviar(i: int) -> None:
+        uid, datos_u = usuarios[i]
+        mensaje_id = f"bench-pm-{n}-{i}"
+        mensaje = {"uid": uid, "mensaje": "Bench", "cuerpo": "Bench", "tipo": "Bench"}
+        db.sembrar(f"Mensajes/{mensaje_id}", mensaje)
+        enviar_push_por_mensaje(db, mensaje_id, mensaje, datos_u, force=True)
+
+    return _medir(_enviar, n, args.concurrencia)
+
+
+def escenario_http_v1(db: FirestoreFalso, n: int, args, url: str) -> tuple[float, list[float]]:
+    from cliente_fcm import enviar_mensaje
+
+    usuarios = _usuarios(n, args.tasa_muertos, f"http{n}")
+    db.reiniciar_contadores()
+    destino = url.format(project_id="bench")
+
+    def _enviar(i: int) -> None:
+        _uid, datos_u = usuarios[i]
+        payload = {"message": {
+            "token": datos_u["fcmToken"][0],
+            "notification": {"title": "Bench", "body": "Bench"},
+        }}
+        enviar_mensaje(destino, "token-falso", payload)
+
+    return _medir(_enviar, n, args.concurrencia)
+
+
+def escenario_campania(db: FirestoreFalso, n: int, args) -> tuple[float, list[float]]:
+    from GenerarMensajes import enviar_campania
+
+    usuarios = _usuarios(n, args.tasa_muertos, f"cp{n}")
+    _sembrar(db, usuarios)
+    db.reiniciar_contadores()
+    latencias: list[float] = []
+    inicio = time.perf_counter()
+
+    def _progreso(p: dict) -> None:
+        if p.get("fase") != "envio":
+            return
+        nuevos = int(p.get("procesados", 0)) - len(latencias)
+        latencias.extend([time.perf_counter() - inicio] * max(0, nuevos))
+
+    enviar_campania(
+        db,
+        usuarios,
+        tipo="Bench",
+        mensaje="Bench",
+        cuerpo="Bench",
+        dia_str="",
+        hora_str="",
+        on_progreso=_progreso,
+    )
+    return time.perf_counter() - inicio, latencias
+
+
+def _informe(escenario: str, n: int, duracion: float, latencias: list[float], db: FirestoreFalso, sim: SimuladorFCM) -> None:
+    ms = sorted(v * 1000 for v in latencias)
+    print(
+        f"{escenario:<12} {n:>6} {n / duracion if duracion else 0:>10.1f} "
+        f"{_percentil(ms, 50):>9.1f} {_percentil(ms, 95):>9.1f} "
+        f"{db.escrituras / n if n else 0:>8.2f} {db.lecturas / n if n else 0:>8.2f} "
+        f"{sim.estadisticas()['peticiones']:>8}"
+    )
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--usuarios", default=",".join(str(t) for t in TAMANOS))
+    ap.add_argument("--escenarios", default=",".join(ESCENARIOS))
+    ap.add_argument("--latencia-ms", type=float, default=20.0)
+    ap.add_argument("--tasa-error", type=float, default=0.0, help="fracción de errores transitorios")
+    ap.add_argument("--tasa-unregistered", type=float, default=0.0)
+    ap.add_argument("--tasa-muertos", type=float, default=0.01, help="fracción de usuarios con token muerto")
+    ap.add_argument("--concurrencia", type=int, default=push_service.MAX_WORKERS)
+    ap.add_argument("--mensajes-por-segundo", type=float, default=push_service.MENSAJES_POR_SEGUNDO)
+    ap.add_argument("--semilla", type=int, default=1234)
+    args = ap.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    # Los ficheros locales (dedupe, bandeja de reintentos) van a un directorio temporal.
+    os.chdir(tempfile.mkdtemp(prefix="bench_push_"))
+    # Servicio push propio con la tasa pedida; el resto del código lo obtiene con get_push_service().
+    push_service._servicio = push_service.PushService(
+        max_workers=args.concurrencia,
+        mensajes_por_segundo=args.mensajes_por_segundo,
+        rafaga=max(push_service.RAFAGA, args.mensajes_por_segundo),
+    )
+
+    tamanos = [int(t) for t in args.usuarios.split(",") if t.strip()]
+    escenarios = [e.strip() for e in args.escenarios.split(",") if e.strip()]
+    print(
+        f"latencia={args.latencia_ms} ms, errores={args.tasa_error}, "
+        f"unregistered={args.tasa_unregistered}, muertos={args.tasa_muertos}, "
+        f"concurrencia={args.concurrencia}, limite={args.mensajes_por_segundo} msg/s"
+    )
+    print(f"{'escenario':<12} {'n':>6} {'msg/s':>10} {'p50 ms':>9} {'p95 ms':>9} {'escr/msg':>8} {'lect/msg':>8} {'peticiones':>8}")
+    for escenario in escenarios:
+        for n in tamanos:
+            sim = SimuladorFCM(args.latencia_ms, args.tasa_error, args.tasa_unregistered, args.semilla)
+            db = FirestoreFalso()
+            if escenario == "http_v1":
+                with ServidorFCMFalso(sim) as servidor:
+                    duracion, latencias = escenario_http_v1(db, n, args, servidor.url)
+            elif escenario in ("por_mensaje", "campania"):
+                with BackendSendEachFalso(sim).instalado():
+                    if escenario == "por_mensaje":
+                        duracion, latencias = escenario_por_mensaje(db, n, args)
+                    else:
+                        duracion, latencias = escenario_campania(db, n, args)
+            else:
+                raise SystemExit(f"Escenario desconocido: {escenario}")
+            _informe(escenario, n, duracion, latencias, db, sim)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,367 @@
+import datetime
+import heapq
+import json
+import logging
+import math
+import threading
+import time
+import uuid
+from typing import Optional
+
+from registro_notificados import abrir_sqlite
+
+logger = logging.getLogger(__name__)
+
+PROGRAMADAS_DB = "campanias_programadas.sqlite3"
+MARGEN_RETRASO = 300.0  # segundos de retraso que aún cuentan como "a tiempo"
+MIN_USUARIOS_TRAMO = 50  # no se trocea el reparto por debajo de esto
+MIN_SEPARACION_TRAMO = 10.0  # segundos mínimos entre tramos del reparto
+REINTENTO_TRAMO = 60.0  # segundos hasta reintentar un tramo que falló entero
+
+ESTADO_PROGRAMADA = "programada"
+ESTADO_ENVIANDO = "enviando"
+ESTADO_ENVIADA = "enviada"
+ESTADO_OMITIDA = "omitida"
+ESTADO_CANCELADA = "cancelada"
+
+# Qué hacer con un envío que venció con la app cerrada (más allá de MARGEN_RETRASO).
+POLITICA_ENVIAR = "enviar"  # se envía en cuanto se pueda, repartido desde ese momento
+POLITICA_OMITIR = "omitir"  # se descarta y queda como omitida
+POLITICAS = (POLITICA_ENVIAR, POLITICA_OMITIR)
+
+
+def calcular_tramos(usuarios: int, ventana: float) -> int:
+    """Número de tramos en que se reparte el envío dentro de la ventana."""
+    if ventana <= 0 or usuarios <= MIN_USUARIOS_TRAMO:
+        return 1
+    por_tamano = math.ceil(usuarios / MIN_USUARIOS_TRAMO)
+    por_tiempo = int(ventana // MIN_SEPARACION_TRAMO) + 1
+    return max(1, min(por_tamano, por_tiempo))
+
+
+class CampaniaProgramada:
+    """Fila de la tabla de campañas programadas."""
+
+    def __init__(self, fila: tuple) -> None:
+        (
+            self.id,
+            self.estado,
+            self.envio,
+            self.ventana,
+            self.politica,
+            parametros,
+            usuarios,
+            self.tramos,
+            hechos,
+            self.creado,
+            resumen,
+        ) = fila
+        self.parametros: dict = json.loads(parametros or "{}")
+        self.usuarios: list[tuple[str, dict]] = [(str(u), d or {}) for u, d in json.loads(usuarios or "[]")]
+        self.hechos: set[int] = set(json.loads(hechos or "[]"))
+        self.resumen: dict = json.loads(resumen or "{}")
+
+    @property
+    def envio_utc(self) -> datetime.datetime:
+        return datetime.datetime.fromtimestamp(self.envio, datetime.timezone.utc)
+
+    def ahora_utc(self) -> datetime.datetime:
+        """Instante fijo de la campaña: el de envío con los microsegundos del alta.
+
+        Los ids de Mensajes se derivan de él, así que dos campañas programadas al mismo
+        minuto no colisionan y repetir un tramo no crea duplicados.
+        """
+        creado = datetime.datetime.fromtimestamp(self.creado, datetime.timezone.utc)
+        return self.envio_utc.replace(microsecond=creado.microsecond)
+
+    def usuarios_tramo(self, tramo: int) -> list[tuple[str, dict]]:
+        tam = math.ceil(len(self.usuarios) / max(1, self.tramos)) or 1
+        return self.usuarios[tramo * tam:(tramo + 1) * tam]
+
+    def descripcion(self) -> str:
+        fecha = self.envio_utc.astimezone().strftime("%d-%m-%Y %H:%M")
+        texto = self.parametros.get("mensaje") or ""
+        return f"{fecha} · {texto[:40]} · {len(self.usuarios)} usuarios · {self.estado}"
+
+
+_COLUMNAS = (
+    "id, estado, envio, ventana, politica, parametros, usuarios, tramos, hechos, creado, resumen"
+)
+
+
+class AlmacenProgramadas:
+    """Campañas programadas persistidas en SQLite local."""
+
+    def __init__(self, ruta: str = PROGRAMADAS_DB) -> None:
+        self.ruta = ruta
+        self._lock = threading.Lock()
+        self._conn = abrir_sqlite(ruta)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS programadas ("
+            " id TEXT PRIMARY KEY,"
+            " estado TEXT NOT NULL,"
+            " envio REAL NOT NULL,"
+            " ventana REAL NOT NULL DEFAULT 0,"
+            " politica TEXT NOT NULL,"
+            " parametros TEXT NOT NULL,"
+            " usuarios TEXT NOT NULL,"
+            " tramos INTEGER NOT NULL DEFAULT 1,"
+            " hechos TEXT NOT NULL DEFAULT '[]',"
+            " creado REAL NOT NULL,"
+            " actualizado REAL NOT NULL,"
+            " resumen TEXT"
+            ") WITHOUT ROWID"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_programadas_estado ON programadas(estado, envio)")
+
+    def crear(
+        self,
+        parametros: dict,
+        usuarios: list[tuple[str, dict]],
+        envio_utc: datetime.datetime,
+        ventana: float,
+        politica: str,
+    ) -> CampaniaProgramada:
+        if politica not in POLITICAS:
+            raise ValueError(f"Política de envío desconocida: {politica}")
+        ahora = time.time()
+        campania_id = uuid.uuid4().hex
+        fila = (
+            campania_id,
+            ESTADO_PROGRAMADA,
+            envio_utc.timestamp(),
+            float(ventana),
+            politica,
+            json.dumps(parametros, ensure_ascii=False),
+            json.dumps([[uid, datos] for uid, datos in usuarios], ensure_ascii=False, default=str),
+            calcular_tramos(len(usuarios), ventana),
+            "[]",
+            ahora,
+            None,
+        )
+        with self._lock:
+            self._conn.execute(
+                f"INSERT INTO programadas ({_COLUMNAS}, actualizado) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                fila + (ahora,),
+            )
+        return CampaniaProgramada(fila)
+
+    def obtener(self, campania_id: str) -> Optional[CampaniaProgramada]:
+        with self._lock:
+            fila = self._conn.execute(
+                f"SELECT {_COLUMNAS} FROM programadas WHERE id = ?", (campania_id,)
+            ).fetchone()
+        return CampaniaProgramada(fila) if fila else None
+
+    def activas(self) -> list[CampaniaProgramada]:
+        """Programadas y a medio enviar, por hora de envío."""
+        with self._lock:
+            filas = self._conn.execute(
+                f"SELECT {_COLUMNAS} FROM programadas WHERE estado IN (?, ?) ORDER BY envio",
+                (ESTADO_PROGRAMADA, ESTADO_ENVIANDO),
+            ).fetchall()
+        return [CampaniaProgramada(f) for f in filas]
+
+    def marcar_tramo(self, campania_id: str, tramo: int, resumen: dict) -> CampaniaProgramada:
+        """Anota un tramo enviado, acumula su resumen y cierra la campaña con el último."""
+        with self._lock:
+            fila = self._conn.execute(
+                f"SELECT {_COLUMNAS} FROM programadas WHERE id = ?", (campania_id,)
+            ).fetchone()
+            campania = CampaniaProgramada(fila)
+            campania.hechos.add(tramo)
+            for clave in ("creados", "existentes", "enviados", "fallidos", "dedupe", "tokens_podados"):
+                campania.resumen[clave] = campania.resumen.get(clave, 0) + int(resumen.get(clave) or 0)
+            campania.resumen["errores"] = campania.resumen.get("errores", 0) + len(resumen.get("errores") or [])
+            if len(campania.hechos) >= campania.tramos and campania.estado != ESTADO_CANCELADA:
+                campania.estado = ESTADO_ENVIADA
+            elif campania.estado == ESTADO_PROGRAMADA:
+                campania.estado = ESTADO_ENVIANDO
+            self._conn.execute(
+                "UPDATE programadas SET estado = ?, hechos = ?, resumen = ?, actualizado = ? WHERE id = ?",
+                (
+                    campania.estado,
+                    json.dumps(sorted(campania.hechos)),
+                    json.dumps(campania.resumen),
+                    time.time(),
+                    campania_id,
+                ),
+            )
+        return campania
+
+    def cambiar_estado(self, campania_id: str, estado: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "UPDATE programadas SET estado = ?, actualizado = ? WHERE id = ?",
+                (estado, time.time(), campania_id),
+            )
+
+
+class ProgramadorCampanias:
+    """Temporizador en proceso que lanza las campañas programadas a su hora.
+
+    Mantiene un montículo de (instante, tramo) y un único hilo que duerme hasta el
+    siguiente vencimiento; cada tramo se envía en su propio hilo con `enviar_campania`
+    (`reanudar=True`), de modo que repetir un tramo tras un corte no duplica nada.
+    """
+
+    def __init__(self, db, almacen: AlmacenProgramadas) -> None:
+        self.db = db
+        self.almacen = almacen
+        self._heap: list[tuple[float, int, str, int]] = []
+        self._secuencia = 0
+        self._cond = threading.Condition()
+        self._parar = False
+        self._hilo: Optional[threading.Thread] = None
+
+    def iniciar(self) -> None:
+        if self._hilo is not None and self._hilo.is_alive():
+            return
+        ahora = time.time()
+        with self._cond:
+            self._heap = []
+        for campania in self.almacen.activas():
+            self._planificar(campania, ahora, al_arrancar=True)
+        self._parar = False
+        self._hilo = threading.Thread(target=self._bucle, daemon=True, name="campanias_programadas")
+        self._hilo.start()
+
+    def detener(self) -> None:
+        with self._cond:
+            self._parar = True
+            self._cond.notify()
+
+    # --- planificación ---
+    def _encolar(self, instante: float, campania_id: str, tramo: int) -> None:
+        with self._cond:
+            self._secuencia += 1
+            heapq.heappush(self._heap, (instante, self._secuencia, campania_id, tramo))
+            self._cond.notify()
+
+    def _planificar(self, campania: CampaniaProgramada, ahora: float, al_arrancar: bool = False) -> None:
+        pendientes = [t for t in range(campania.tramos) if t not in campania.hechos]
+        if not pendientes:
+            self.almacen.cambiar_estado(campania.id, ESTADO_ENVIADA)
+            return
+        paso = campania.ventana / campania.tramos if campania.tramos > 1 else 0.0
+        retraso = ahora - (campania.envio + pendientes[0] * paso)
+        if al_arrancar and retraso > MARGEN_RETRASO:
+            if campania.politica == POLITICA_OMITIR:
+                logger.warning(
+                    "Campaña programada %s vencida hace %.0f s con la app cerrada; se omite",
+                    campania.id,
+                    retraso,
+                )
+                self.almacen.cambiar_estado(campania.id, ESTADO_OMITIDA)
+                return
+            logger.warning(
+                "Campaña programada %s vencida hace %.0f s; se envía ahora", campania.id, retraso
+            )
+            # El reparto se reanuda desde ahora con la misma separación entre tramos.
+            for i, tramo in enumerate(pendientes):
+                self._encolar(ahora + i * paso, campania.id, tramo)
+            return
+        for tramo in pendientes:
+            self._encolar(campania.envio + tramo * paso, campania.id, tramo)
+
+    def programar(
+        self,
+        parametros: dict,
+        usuarios: list[tuple[str, dict]],
+        envio_utc: datetime.datetime,
+        *,
+        ventana: float = 0.0,
+        politica: str = POLITICA_ENVIAR,
+    ) -> CampaniaProgramada:
+        """Persiste la campaña y la deja en el temporizador."""
+        campania = self.almacen.crear(parametros, usuarios, envio_utc, ventana, politica)
+        self._planificar(campania, time.time())
+        logger.info(
+            "Campaña %s programada para %s (%s usuarios, %s tramos en %.0f s)",
+            campania.id,
+            campania.envio_utc.astimezone().isoformat(timespec="minutes"),
+            len(campania.usuarios),
+            campania.tramos,
+            campania.ventana,
+        )
+        return campania
+
+    def cancelar(self, campania_id: str) -> None:
+        """Los tramos ya en curso terminan; los pendientes se descartan al vencer."""
+        self.almacen.cambiar_estado(campania_id, ESTADO_CANCELADA)
+
+    # --- ejecución ---
+    def _bucle(self) -> None:
+        while True:
+            with self._cond:
+                while not self._parar and (not self._heap or self._heap[0][0] > time.time()):
+                    espera = self._heap[0][0] - time.time() if self._heap else None
+                    self._cond.wait(espera)
+                if self._parar:
+                    return
+                _instante, _seq, campania_id, tramo = heapq.heappop(self._heap)
+            threading.Thread(
+                target=self._despachar,
+                args=(campania_id, tramo),
+                daemon=True,
+                name=f"campania_programada_{tramo}",
+            ).start()
+
+    def _despachar(self, campania_id: str, tramo: int) -> None:
+        from GenerarMensajes import enviar_campania
+        from GestionUsuarios import on_mensajes_generados
+
+        campania = self.almacen.obtener(campania_id)
+        if campania is None or campania.estado not in (ESTADO_PROGRAMADA, ESTADO_ENVIANDO):
+            return
+        if tramo in campania.hechos:
+            return
+        usuarios = campania.usuarios_tramo(tramo)
+        try:
+            resumen = enviar_campania(
+                self.db,
+                usuarios,
+                ahora_utc=campania.ahora_utc(),
+                reanudar=True,
+                **campania.parametros,
+            )
+        except Exception:
+            logger.exception("Error enviando el tramo %s de la campaña programada %s", tramo, campania_id)
+            self._encolar(time.time() + REINTENTO_TRAMO, campania_id, tramo)
+            return
+        campania = self.almacen.marcar_tramo(campania_id, tramo, resumen)
+        logger.info(
+            "Campaña programada %s: tramo %s/%s enviado (%s enviados, %s fallidos)",
+            campania_id,
+            tramo + 1,
+            campania.tramos,
+            resumen.get("enviados", 0),
+            resumen.get("fallidos", 0),
+        )
+        if resumen.get("uids"):
+            on_mensajes_generados(resumen["uids"], self.db)
+
+
+_almacen: Optional[AlmacenProgramadas] = None
+_programador: Optional[ProgramadorCampanias] = None
+_programador_lock = threading.Lock()
+
+
+def get_almacen_programadas() -> AlmacenProgramadas:
+    global _almacen
+    if _almacen is None:
+        with _programador_lock:
+            if _almacen is None:
+                _almacen = AlmacenProgramadas()
+    return _almacen
+
+
+def get_programador_campanias(db) -> ProgramadorCampanias:
+    """Arranca (una sola vez por proceso) el temporizador de campañas programadas."""
+    global _programador
+    almacen = get_almacen_programadas()
+    with _programador_lock:
+        if _programador is None:
+            _programador = ProgramadorCampanias(db, almacen)
+    _programador.iniciar()
+    return _programador
@@ -0,0 +1,174 @@
+import logging
+import threading
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+COLECCION_TIPOS = "PlantillasTipoMensaje"
+DOC_TIPOS = "TipoMensaje"
+COLECCION_MENSAJES = "PlantillasMensaje"
+ESPERA_CARGA = 10.0  # segundos máximos esperando la primera instantánea
+
+
+def _lista_csv(texto) -> list[str]:
+    if not isinstance(texto, str):
+        return []
+    return [s.strip() for s in texto.split(",") if s.strip()]
+
+
+def _parsear_mensajes(datos: Optional[dict]) -> list[str]:
+    """Mensajes de un documento de PlantillasMensaje (campo `Mensaje` separado por comas).
+
+    Algunos documentos antiguos guardan el texto en un mapa anidado, p.ej.
+    `{"Producción": {"Mensaje": "..."}}`; se usa como alternativa.
+    """
+    datos = datos or {}
+    mensajes = _lista_csv(datos.get("Mensaje"))
+    if mensajes:
+        return mensajes
+    for valor in datos.values():
+        if isinstance(valor, dict):
+            mensajes = _lista_csv(valor.get("Mensaje"))
+            if mensajes:
+                return mensajes
+    return []
+
+
+class CatalogoPlantillas:
+    """Catálogo en memoria de tipos de mensaje y sus plantillas.
+
+    Se carga con dos listeners (`PlantillasTipoMensaje/TipoMensaje` y la colección
+    `PlantillasMensaje`), que lo mantienen al día; consultar un tipo no lee nada.
+    Sin listener se cae a una lectura completa y, por tipo, a `get` bajo demanda.
+    """
+
+    def __init__(self, db) -> None:
+        self.db = db
+        self._tipos: list[str] = []
+        self._mensajes: dict[str, list[str]] = {}
+        self._lock = threading.Lock()
+        self._tipos_listos = threading.Event()
+        self._mensajes_listos = threading.Event()
+        self._watches: list = []
+        self._iniciado = False
+        self.lecturas = 0
+
+    # --- carga y listeners ---
+    def iniciar(self) -> None:
+        if self._watches:
+            return
+        self._iniciado = True
+        try:
+            self._watches.append(
+                self.db.collection(COLECCION_TIPOS).document(DOC_TIPOS).on_snapshot(self._on_tipos)
+            )
+            self._watches.append(self.db.collection(COLECCION_MENSAJES).on_snapshot(self._on_mensajes))
+        except Exception:
+            logger.exception("No se pudo suscribir el catálogo de plantillas; se carga sin listener")
+            self.detener()
+            self._cargar_completo()
+
+    def _cargar_completo(self) -> None:
+        try:
+            snap = self.db.collection(COLECCION_TIPOS).document(DOC_TIPOS).get()
+            tipos = _lista_csv((snap.to_dict() or {}).get("Tipo")) if snap.exists else []
+            mensajes = {
+                doc.id: _parsear_mensajes(doc.to_dict())
+                for doc in self.db.collection(COLECCION_MENSAJES).stream()
+            }
+        except Exception:
+            logger.exception("No se pudo cargar el catálogo de plantillas; se leerá bajo demanda")
+            return
+        with self._lock:
+            self._tipos = tipos
+            self._mensajes = mensajes
+        self._tipos_listos.set()
+        self._mensajes_listos.set()
+        logger.info("Catálogo de plantillas cargado: %s tipos, %s plantillas", len(tipos), len(mensajes))
+
+    def _on_tipos(self, docs, changes, read_time) -> None:
+        tipos: list[str] = []
+        for snap in docs:
+            if getattr(snap, "exists", True):
+                tipos = _lista_csv((snap.to_dict() or {}).get("Tipo"))
+        with self._lock:
+            self._tipos = tipos
+        self._tipos_listos.set()
+
+    def _on_mensajes(self, docs, changes, read_time) -> None:
+        with self._lock:
+            if not self._mensajes_listos.is_set():
+                self._mensajes = {doc.id: _parsear_mensajes(doc.to_dict()) for doc in docs}
+            else:
+                for change in changes:
+                    doc = change.document
+                    if getattr(change.type, "name", "") == "REMOVED":
+                        self._mensajes.pop(doc.id, None)
+                    else:
+                        self._mensajes[doc.id] = _parsear_mensajes(doc.to_dict())
+            total = len(self._mensajes)
+        if not self._mensajes_listos.is_set():
+            self._mensajes_listos.set()
+            logger.info("Catálogo de plantillas cargado: %s plantillas", total)
+
+    def detener(self) -> None:
+        for watch in self._watches:
+            try:
+                watch.unsubscribe()
+            except Exception:
+                logger.exception("Error cancelando un listener del catálogo de plantillas")
+        self._watches = []
+
+    # --- consultas ---
+    def _esperar(self, evento: threading.Event) -> bool:
+        if not self._iniciado:
+            self.iniciar()
+        if not self._watches:
+            return evento.is_set()
+        return evento.wait(ESPERA_CARGA)
+
+    def tipos(self) -> list[str]:
+        """Tipos de mensaje en el orden de `PlantillasTipoMensaje/TipoMensaje`."""
+        if not self._esperar(self._tipos_listos):
+            snap = self.db.collection(COLECCION_TIPOS).document(DOC_TIPOS).get()
+            self.lecturas += 1
+            return _lista_csv((snap.to_dict() or {}).get("Tipo")) if snap.exists else []
+        with self._lock:
+            return list(self._tipos)
+
+    def mensajes(self, tipo: str) -> list[str]:
+        """Plantillas del tipo (lista vacía si no hay documento)."""
+        tipo = (tipo or "").strip()
+        if not tipo:
+            return []
+        if self._esperar(self._mensajes_listos):
+            with self._lock:
+                return list(self._mensajes.get(tipo, []))
+        with self._lock:
+            if tipo in self._mensajes:
+                return list(self._mensajes[tipo])
+        snap = self.db.collection(COLECCION_MENSAJES).document(tipo).get()
+        self.lecturas += 1
+        mensajes = _parsear_mensajes(snap.to_dict()) if snap.exists else []
+        with self._lock:
+            self._mensajes[tipo] = mensajes
+        return list(mensajes)
+
+    def catalogo(self) -> dict[str, list[str]]:
+        """{tipo: [mensajes]} para todos los tipos declarados."""
+        return {tipo: self.mensajes(tipo) for tipo in self.tipos()}
+
+
+_catalogo: Optional[CatalogoPlantillas] = None
+_catalogo_lock = threading.Lock()
+
+
+def get_catalogo_plantillas(db) -> CatalogoPlantillas:
+    """Catálogo compartido por Generar mensajes e Informe de asistencia."""
+    global _catalogo
+    if _catalogo is None:
+        with _catalogo_lock:
+            if _catalogo is None:
+                _catalogo = CatalogoPlantillas(db)
+                _catalogo.iniciar()
+    return _catalogo
@@ -0,0 +1,172 @@
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from push_service import CODIGOS_REINTENTABLES, ErrorReintentable, get_push_service, parse_retry_after
+
+try:  # opcional: modo HTTP/2 multiplexado (pip install "httpx[http2]")
+    import httpx
+except Exception:  # pragma: no cover - httpx opcional
+    httpx = None  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+CONFIG_PATH = Path("config.json")
+FCM_URL = "https://fcm.googleapis.com/v1/projects/{project_id}/messages:send"
+POOL_MAX = 32
+TIMEOUT_CONEXION = 5.0
+TIMEOUT_LECTURA = 30.0
+KEEPALIVE_S = 60.0
+
+
+class ClienteFCM:
+    """Cliente HTTP compartido para FCM v1 con pool de conexiones keep-alive.
+
+    Con `http2=True` (y httpx instalado) todas las peticiones se multiplexan sobre
+    pocas conexiones HTTP/2; si no, se usa un `requests.Session` con pool propio.
+    """
+
+    def __init__(
+        self,
+        pool_max: int = POOL_MAX,
+        timeout_conexion: float = TIMEOUT_CONEXION,
+        timeout_lectura: float = TIMEOUT_LECTURA,
+        keepalive: float = KEEPALIVE_S,
+        http2: bool = False,
+    ) -> None:
+        self.pool_max = pool_max
+        self._timeout = (timeout_conexion, timeout_lectura)
+        self._httpx = None
+        self._session: Optional[requests.Session] = None
+        if http2 and httpx is None:
+            logger.warning("HTTP/2 solicitado pero httpx no está instalado; se usa HTTP/1.1")
+        if http2 and httpx is not None:
+            try:
+                self._httpx = httpx.Client(
+                    http2=True,
+                    limits=httpx.Limits(
+                        max_connections=pool_max,
+                        max_keepalive_connections=pool_max,
+                        keepalive_expiry=keepalive,
+                    ),
+                    timeout=httpx.Timeout(timeout_lectura, connect=timeout_conexion),
+                )
+            except Exception:
+                logger.exception("No se pudo iniciar el cliente HTTP/2; se usa HTTP/1.1")
+                self._httpx = None
+        if self._httpx is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_max, max_retries=0, pool_block=True)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.headers["Connection"] = "keep-alive"
+            self._session = session
+        self._executor = ThreadPoolExecutor(max_workers=pool_max, thread_name_prefix="fcm_http")
+
+    @property
+    def http2(self) -> bool:
+        return self._httpx is not None
+
+    def post(self, url: str, *, headers: dict, json: dict) -> Any:
+        """POST sobre el pool; la respuesta expone `status_code`, `headers` y `text`."""
+        if self._httpx is not None:
+            return self._httpx.post(url, headers=headers, json=json)
+        return self._session.post(url, headers=headers, json=json, timeout=self._timeout)  # type: ignore[union-attr]
+
+    def enviar_lote(self, url: str, token_oauth: str, payloads: list[dict]) -> dict[str, dict]:
+        """Envía `payloads` concurrentemente sobre el pool; devuelve {token: resultado}.
+
+        Cada payload pasa por `enviar_mensaje` (token propio del limitador y
+        reintentos 429/5xx con Retry-After). El resultado lleva `ok`, `status` y `error`.
+        """
+        futuros = [
+            (
+                (payload.get("message") or {}).get("token"),
+                self._executor.submit(enviar_mensaje, url, token_oauth, payload),
+            )
+            for payload in payloads
+        ]
+        resultados: dict[str, dict] = {}
+        for token, futuro in futuros:
+            try:
+                response = futuro.result()
+            except Exception as exc:
+                resultados[token] = {"ok": False, "status": getattr(exc, "status", None), "error": str(exc)}
+                continue
+            ok = response.status_code == 200
+            resultados[token] = {
+                "ok": ok,
+                "status": response.status_code,
+                "error": None if ok else response.text,
+            }
+        return resultados
+
+    def cerrar(self) -> None:
+        self._executor.shutdown(wait=False)
+        if self._httpx is not None:
+            self._httpx.close()
+        if self._session is not None:
+            self._session.close()
+
+
+def _leer_config_http() -> dict:
+    if not CONFIG_PATH.exists():
+        return {}
+    try:
+        with CONFIG_PATH.open("r", encoding="utf-8") as fh:
+            cfg = json.load(fh)
+    except Exception:
+        logger.exception("No se pudo leer la configuración desde %s", CONFIG_PATH)
+        return {}
+    datos = cfg.get("fcm_http") if isinstance(cfg, dict) else None
+    return datos if isinstance(datos, dict) else {}
+
+
+def enviar_mensaje(url: str, token_oauth: str, payload: dict) -> Any:
+    """POST de un mensaje FCM v1 con el limitador y los reintentos 429/5xx del servicio push.
+
+    Devuelve la última respuesta; las no reintentables (400/401/404...) se devuelven tal cual.
+    """
+    headers = {
+        "Authorization": f"Bearer {token_oauth}",
+        "Content-Type": "application/json",
+    }
+
+    def _post():
+        response = get_cliente_fcm().post(url, headers=headers, json=payload)
+        if response.status_code in CODIGOS_REINTENTABLES:
+            raise ErrorReintentable(
+                f"FCM respondió {response.status_code}",
+                retry_after=parse_retry_after(response.headers.get("Retry-After")),
+                status=response.status_code,
+            )
+        return response
+
+    return get_push_service().llamar(_post)
+
+
+_cliente: Optional[ClienteFCM] = None
+_cliente_lock = threading.Lock()
+
+
+def get_cliente_fcm() -> ClienteFCM:
+    """Cliente compartido; se configura con la sección opcional "fcm_http" de config.json."""
+    global _cliente
+    if _cliente is None:
+        with _cliente_lock:
+            if _cliente is None:
+                cfg = _leer_config_http()
+                _cliente = ClienteFCM(
+                    pool_max=int(cfg.get("pool_max", POOL_MAX)),
+                    timeout_conexion=float(cfg.get("timeout_conexion", TIMEOUT_CONEXION)),
+                    timeout_lectura=float(cfg.get("timeout_lectura", TIMEOUT_LECTURA)),
+                    keepalive=float(cfg.get("keepalive", KEEPALIVE_S)),
+                    http2=bool(cfg.get("http2", False)),
+                )
+    return _cliente
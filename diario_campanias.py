@@ -0,0 +1,182 @@
+import datetime
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+CARPETA_CAMPANIAS = Path("campanias")
+
+ORIGEN_GENERAR = "generar"  # GenerarMensajes.guardar
+ORIGEN_TODOS = "todos"  # main._crear_mensajes_para_todos_bg
+
+FASE_CREACION = "creacion"
+FASE_ENVIO = "envio"
+
+
+def _ahora_iso() -> str:
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+
+class DiarioCampania:
+    """Diario local (JSON Lines) de una campaña para poder reanudarla tras un corte.
+
+    Cada línea es un evento: `inicio` (parámetros, instante fijo y destinatarios),
+    `hecho` (uids completados en una fase), `cursor` (última página leída) y `fin`.
+    Al reanudar se reconstruye el estado leyendo el fichero de principio a fin.
+    """
+
+    def __init__(self, ruta: Path) -> None:
+        self.ruta = Path(ruta)
+        self.id = self.ruta.stem
+        self.origen = ""
+        self.parametros: dict = {}
+        self.ahora_utc: Optional[datetime.datetime] = None
+        self.usuarios: list[tuple[str, dict]] = []
+        self.hechos: dict[str, set[str]] = {FASE_CREACION: set(), FASE_ENVIO: set()}
+        self.cursor: Optional[str] = None
+        self.terminada = False
+        self.resumen: dict = {}
+        self._lock = threading.Lock()
+
+    # --- creación / apertura ---
+    @classmethod
+    def crear(
+        cls,
+        origen: str,
+        parametros: dict,
+        ahora_utc: datetime.datetime,
+        usuarios: Optional[list[tuple[str, dict]]] = None,
+        carpeta: Path = CARPETA_CAMPANIAS,
+    ) -> "DiarioCampania":
+        carpeta = Path(carpeta)
+        carpeta.mkdir(parents=True, exist_ok=True)
+        campania_id = f"{origen}_{ahora_utc.strftime('%Y%m%dT%H%M%S%fZ')}"
+        diario = cls(carpeta / f"{campania_id}.jsonl")
+        diario.origen = origen
+        diario.parametros = dict(parametros)
+        diario.ahora_utc = ahora_utc
+        diario.usuarios = list(usuarios or [])
+        diario._escribir({
+            "tipo": "inicio",
+            "id": campania_id,
+            "origen": origen,
+            "ts": _ahora_iso(),
+            "ahora_utc": ahora_utc.isoformat(),
+            "parametros": diario.parametros,
+            "usuarios": [[uid, datos] for uid, datos in diario.usuarios],
+        }, sincronizar=True)
+        logger.info("Campaña %s iniciada (%s destinatarios)", campania_id, len(diario.usuarios))
+        return diario
+
+    @classmethod
+    def abrir(cls, ruta: Path) -> "DiarioCampania":
+        diario = cls(ruta)
+        with diario.ruta.open("r", encoding="utf-8") as fh:
+            for num, linea in enumerate(fh, start=1):
+                linea = linea.strip()
+                if not linea:
+                    continue
+                try:
+                    evento = json.loads(linea)
+                except ValueError:
+                    # Una línea a medias al final es el rastro normal de un corte.
+                    logger.warning("Línea %s ilegible en %s; se ignora", num, diario.ruta)
+                    continue
+                diario._aplicar(evento)
+        if diario.ahora_utc is None:
+            raise ValueError(f"Diario de campaña sin evento de inicio: {ruta}")
+        diario._cerrar_linea_cortada()
+        return diario
+
+    def _cerrar_linea_cortada(self) -> None:
+        # Tras un corte a mitad de línea, los eventos nuevos deben empezar en una línea propia.
+        with self.ruta.open("rb") as fh:
+            fh.seek(0, os.SEEK_END)
+            if fh.tell() == 0:
+                return
+            fh.seek(-1, os.SEEK_END)
+            ultimo = fh.read(1)
+        if ultimo != b"\n":
+            with self.ruta.open("a", encoding="utf-8") as fh:
+                fh.write("\n")
+
+    def _aplicar(self, evento: dict) -> None:
+        tipo = evento.get("tipo")
+        if tipo == "inicio":
+            self.origen = evento.get("origen", "")
+            self.parametros = evento.get("parametros") or {}
+            self.ahora_utc = datetime.datetime.fromisoformat(evento["ahora_utc"])
+            self.usuarios = [(str(uid), datos or {}) for uid, datos in evento.get("usuarios") or []]
+        elif tipo == "hecho":
+            self.hechos.setdefault(evento.get("fase", ""), set()).update(evento.get("uids") or [])
+        elif tipo == "cursor":
+            self.cursor = evento.get("ultimo")
+        elif tipo == "fin":
+            self.terminada = True
+            self.resumen = evento.get("resumen") or {}
+
+    # --- escritura ---
+    def _escribir(self, evento: dict, sincronizar: bool = False) -> None:
+        linea = json.dumps(evento, ensure_ascii=False, default=str)
+        with self._lock:
+            with self.ruta.open("a", encoding="utf-8") as fh:
+                fh.write(linea + "\n")
+                fh.flush()
+                if sincronizar:
+                    os.fsync(fh.fileno())
+
+    def marcar(self, fase: str, uids: Iterable[str]) -> None:
+        uids = [str(u) for u in uids]
+        if not uids:
+            return
+        self._escribir({"tipo": "hecho", "fase": fase, "uids": uids})
+        with self._lock:
+            self.hechos.setdefault(fase, set()).update(uids)
+
+    def guardar_cursor(self, ultimo: str) -> None:
+        self._escribir({"tipo": "cursor", "ultimo": ultimo})
+        self.cursor = ultimo
+
+    def terminar(self, resumen: Optional[dict] = None) -> None:
+        self.resumen = {k: v for k, v in (resumen or {}).items() if k != "uids"}
+        self._escribir({"tipo": "fin", "ts": _ahora_iso(), "resumen": self.resumen}, sincronizar=True)
+        self.terminada = True
+        logger.info("Campaña %s terminada", self.id)
+
+    # --- consultas ---
+    def hecho(self, fase: str, uid: str) -> bool:
+        with self._lock:
+            return uid in self.hechos.get(fase, set())
+
+    def descripcion(self) -> str:
+        total = len(self.usuarios)
+        enviados = len(self.hechos.get(FASE_ENVIO, set()))
+        creados = len(self.hechos.get(FASE_CREACION, set()))
+        texto = self.parametros.get("mensaje") or ""
+        fecha = self.ahora_utc.astimezone().strftime("%d-%m-%Y %H:%M") if self.ahora_utc else "?"
+        if total:
+            avance = f"{creados}/{total} creados, {enviados}/{total} enviados"
+        else:
+            avance = f"{creados} creados"
+        return f"{fecha} · {self.origen} · {texto[:40]} · {avance}"
+
+
+def campanias_pendientes(carpeta: Path = CARPETA_CAMPANIAS) -> list[DiarioCampania]:
+    """Campañas con diario sin evento `fin`, la más reciente primero."""
+    carpeta = Path(carpeta)
+    if not carpeta.exists():
+        return []
+    pendientes: list[DiarioCampania] = []
+    for ruta in sorted(carpeta.glob("*.jsonl"), key=lambda p: p.stat().st_mtime, reverse=True):
+        try:
+            diario = DiarioCampania.abrir(ruta)
+        except Exception:
+            logger.exception("No se pudo leer el diario de campaña %s", ruta)
+            continue
+        if not diario.terminada:
+            pendientes.append(diario)
+    return pendientes
@@ -0,0 +1,149 @@
+import logging
+import threading
+from typing import Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+COLECCION_USUARIOS = "UsuariosAutorizados"
+CAMPOS = ("fcmToken", "Nombre", "Telefono", "telefono", "UID", "uid", "Mensaje")
+ESPERA_CARGA = 15.0  # segundos máximos esperando la primera instantánea
+
+
+def _entrada(data: Optional[dict]) -> dict:
+    data = data or {}
+    return {campo: data[campo] for campo in CAMPOS if campo in data}
+
+
+class DirectorioTokens:
+    """Directorio en memoria uid -> {fcmToken, Nombre, Telefono} de UsuariosAutorizados.
+
+    Se carga de una vez con un listener `on_snapshot`, que lo mantiene al día; los
+    uids que aún no estén (o si el listener no está activo) se leen bajo demanda.
+    """
+
+    def __init__(self, db, coleccion: str = COLECCION_USUARIOS) -> None:
+        self.db = db
+        self.coleccion = coleccion
+        self._datos: dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self._listo = threading.Event()
+        self._watch = None
+        self._espera_agotada = False  # la primera instantánea no llegó a tiempo
+        self.aciertos = 0
+        self.lecturas = 0
+
+    # --- carga y listener ---
+    def iniciar(self) -> None:
+        if self._watch is not None:
+            return
+        try:
+            self._watch = self.db.collection(self.coleccion).on_snapshot(self._on_snapshot)
+        except Exception:
+            logger.exception("No se pudo suscribir el directorio de tokens; se carga sin listener")
+            self._watch = None
+            try:
+                self._cargar_completo()
+            except Exception:
+                logger.exception("No se pudo cargar el directorio de tokens; se leerá bajo demanda")
+                self._listo.set()
+
+    def _cargar_completo(self) -> None:
+        datos = {doc.id: _entrada(doc.to_dict()) for doc in self.db.collection(self.coleccion).stream()}
+        with self._lock:
+            self._datos = datos
+        self._listo.set()
+        logger.info("Directorio de tokens cargado: %s usuarios", len(datos))
+
+    def _on_snapshot(self, docs, changes, read_time) -> None:
+        with self._lock:
+            if not self._listo.is_set():
+                self._datos = {doc.id: _entrada(doc.to_dict()) for doc in docs}
+            else:
+                for change in changes:
+                    doc = change.document
+                    if getattr(change.type, "name", "") == "REMOVED":
+                        self._datos.pop(doc.id, None)
+                    else:
+                        self._datos[doc.id] = _entrada(doc.to_dict())
+            total = len(self._datos)
+        if not self._listo.is_set():
+            self._listo.set()
+            logger.info("Directorio de tokens cargado: %s usuarios", total)
+
+    def detener(self) -> None:
+        if self._watch is not None:
+            try:
+                self._watch.unsubscribe()
+            except Exception:
+                logger.exception("Error cancelando el listener del directorio de tokens")
+            self._watch = None
+
+    # --- consultas ---
+    def _esperar_carga(self) -> bool:
+        """Espera la primera carga sólo una vez; si no llegó, se sigue con `get_all`."""
+        if self._listo.is_set():
+            return True
+        if self._espera_agotada:
+            return False
+        if self._watch is None:
+            self.iniciar()
+        if self._listo.wait(ESPERA_CARGA):
+            return True
+        self._espera_agotada = True
+        logger.warning(
+            "El directorio de tokens no cargó en %.0f s; se leerá bajo demanda hasta que el listener responda",
+            ESPERA_CARGA,
+        )
+        return False
+
+    def obtener(self, uid: str) -> Optional[dict]:
+        """Entrada del usuario o None si no existe."""
+        if not uid:
+            return None
+        return self.obtener_varios([uid]).get(str(uid))
+
+    def obtener_varios(self, uids: Iterable[str]) -> dict[str, dict]:
+        """{uid: entrada} para los uids existentes; los ausentes se leen con un solo get_all."""
+        uids = [str(u) for u in dict.fromkeys(uids) if u]
+        self._esperar_carga()
+        with self._lock:
+            encontrados = {uid: dict(self._datos[uid]) for uid in uids if uid in self._datos}
+            self.aciertos += len(encontrados)
+        faltan = [uid for uid in uids if uid not in encontrados]
+        if faltan:
+            refs = [self.db.collection(self.coleccion).document(uid) for uid in faltan]
+            try:
+                for snap in self.db.get_all(refs):
+                    if getattr(snap, "exists", False):
+                        entrada = _entrada(snap.to_dict())
+                        encontrados[snap.id] = dict(entrada)
+                        with self._lock:
+                            self._datos[snap.id] = entrada
+            except Exception:
+                logger.exception("No se pudieron leer %s usuarios fuera del directorio", len(faltan))
+            with self._lock:
+                self.lecturas += len(faltan)
+        return encontrados
+
+    def tokens(self, uid: str) -> list[str]:
+        tok = (self.obtener(uid) or {}).get("fcmToken")
+        if isinstance(tok, str):
+            return [tok] if tok else []
+        if isinstance(tok, (list, tuple)):
+            return [t for t in tok if t]
+        return []
+
+
+_directorio: Optional[DirectorioTokens] = None
+_directorio_lock = threading.Lock()
+
+
+def get_directorio_tokens(db) -> DirectorioTokens:
+    """Directorio compartido por todos los caminos de envío."""
+    global _directorio
+    if _directorio is None:
+        with _directorio_lock:
+            if _directorio is None:
+                _directorio = DirectorioTokens(db)
+                _directorio.iniciar()
+    return _directorio
@@ -0,0 +1,191 @@
+import atexit
+import logging
+import threading
+import time
+import weakref
+from typing import Any, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+MAX_OPS_LOTE = 500  # límite de Firestore por WriteBatch
+TAM_LOTE = 400
+INTERVALO_FLUSH = 1.0
+MAX_REINTENTOS = 4
+
+_escritores_vivos: "weakref.WeakSet[EscritorLotes]" = weakref.WeakSet()
+
+
+class EscritorLotes:
+    """Acumula escrituras Firestore y las confirma en WriteBatch por tamaño y por tiempo.
+
+    Los fallos se reportan por documento: si un lote no se puede confirmar tras los
+    reintentos, sus operaciones se aplican una a una para aislar las que fallan, que
+    quedan en `fallos` y se notifican a `on_fallo(path, exc)`.
+    """
+
+    def __init__(
+        self,
+        db,
+        *,
+        tam_lote: int = TAM_LOTE,
+        intervalo: Optional[float] = INTERVALO_FLUSH,
+        max_reintentos: int = MAX_REINTENTOS,
+        on_fallo: Optional[Callable[[str, Exception], None]] = None,
+        nombre: str = "escritor_lotes",
+    ) -> None:
+        self.db = db
+        self.tam_lote = max(1, min(int(tam_lote), MAX_OPS_LOTE))
+        self.intervalo = intervalo
+        self.max_reintentos = max_reintentos
+        self.on_fallo = on_fallo
+        self.nombre = nombre
+        self.escritos = 0
+        self.lotes = 0
+        self.fallos: list[tuple[str, str]] = []
+        self._pendientes: list[tuple[str, Any, Any, dict]] = []
+        self._primero_en: Optional[float] = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._cerrado = False
+        self._parar = threading.Event()
+        self._hilo: Optional[threading.Thread] = None
+        if intervalo:
+            self._hilo = threading.Thread(target=self._bucle_tiempo, daemon=True, name=f"{nombre}_flush")
+            self._hilo.start()
+        _escritores_vivos.add(self)
+
+    # --- operaciones ---
+    def set(self, ref, data: dict, merge: bool = False) -> None:
+        self._agregar("set", ref, data, {"merge": merge} if merge else {})
+
+    def update(self, ref, data: dict) -> None:
+        self._agregar("update", ref, data, {})
+
+    def create(self, ref, data: dict) -> None:
+        self._agregar("create", ref, data, {})
+
+    def delete(self, ref) -> None:
+        self._agregar("delete", ref, None, {})
+
+    def _agregar(self, op: str, ref, data, kwargs: dict) -> None:
+        if self._cerrado:
+            raise RuntimeError(f"{self.nombre} ya está cerrado")
+        with self._lock:
+            self._pendientes.append((op, ref, data, kwargs))
+            if self._primero_en is None:
+                self._primero_en = time.monotonic()
+            lleno = len(self._pendientes) >= self.tam_lote
+        if lleno:
+            self.flush()
+
+    @property
+    def pendientes(self) -> int:
+        with self._lock:
+            return len(self._pendientes)
+
+    # --- confirmación ---
+    def _bucle_tiempo(self) -> None:
+        while not self._parar.wait(self.intervalo):
+            with self._lock:
+                vencido = (
+                    self._primero_en is not None
+                    and time.monotonic() - self._primero_en >= self.intervalo
+                )
+            if vencido:
+                try:
+                    self.flush()
+                except Exception:
+                    logger.exception("Error en flush periódico de %s", self.nombre)
+
+    def flush(self) -> int:
+        """Confirma todo lo pendiente. Devuelve el número de operaciones escritas."""
+        escritas = 0
+        with self._flush_lock:
+            while True:
+                with self._lock:
+                    lote = self._pendientes[: self.tam_lote]
+                    del self._pendientes[: self.tam_lote]
+                    self._primero_en = time.monotonic() if self._pendientes else None
+                if not lote:
+                    break
+                escritas += self._confirmar(lote)
+        return escritas
+
+    def _confirmar(self, lote: list) -> int:
+        for intento in range(1, self.max_reintentos + 1):
+            batch = self.db.batch()
+            for op, ref, data, kwargs in lote:
+                if op == "delete":
+                    batch.delete(ref)
+                else:
+                    getattr(batch, op)(ref, data, **kwargs)
+            try:
+                batch.commit(timeout=60.0)
+                self.escritos += len(lote)
+                self.lotes += 1
+                return len(lote)
+            except Exception as exc:
+                if intento >= self.max_reintentos:
+                    logger.warning(
+                        "%s: lote de %s operaciones rechazado (%s); aplicando una a una",
+                        self.nombre,
+                        len(lote),
+                        exc,
+                    )
+                    break
+                delay = min(6.0, 0.7 * (2 ** (intento - 1)))
+                logger.warning(
+                    "%s: error al confirmar lote (intento %s/%s). Reintentando en %.2f s",
+                    self.nombre,
+                    intento,
+                    self.max_reintentos,
+                    delay,
+                    exc_info=exc,
+                )
+                time.sleep(delay)
+        return self._confirmar_individual(lote)
+
+    def _confirmar_individual(self, lote: list) -> int:
+        escritas = 0
+        for op, ref, data, kwargs in lote:
+            try:
+                if op == "delete":
+                    ref.delete()
+                else:
+                    getattr(ref, op)(data, **kwargs)
+                escritas += 1
+            except Exception as exc:
+                path = getattr(ref, "path", None) or getattr(ref, "id", str(ref))
+                logger.error("%s: no se pudo escribir %s: %s", self.nombre, path, exc)
+                self.fallos.append((path, str(exc)))
+                if self.on_fallo is not None:
+                    try:
+                        self.on_fallo(path, exc)
+                    except Exception:
+                        logger.exception("Error en callback on_fallo de %s", self.nombre)
+        self.escritos += escritas
+        return escritas
+
+    def cerrar(self) -> None:
+        """Detiene el flush periódico y confirma lo pendiente (idempotente)."""
+        self._parar.set()
+        if self._hilo is not None and self._hilo is not threading.current_thread():
+            self._hilo.join(timeout=5.0)
+        self.flush()
+        self._cerrado = True
+        _escritores_vivos.discard(self)
+
+    def __enter__(self) -> "EscritorLotes":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.cerrar()
+
+
+@atexit.register
+def _flush_al_salir() -> None:
+    for escritor in list(_escritores_vivos):
+        try:
+            escritor.cerrar()
+        except Exception:
+            logger.exception("No se pudo confirmar %s al salir", escritor.nombre)
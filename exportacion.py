@@ -0,0 +1,507 @@
+import csv
+import datetime
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterator, Optional
+
+from google.cloud.firestore_v1.base_query import FieldFilter
+from openpyxl import Workbook, load_workbook
+
+logger = logging.getLogger(__name__)
+
+FORMATO_XLSX = "xlsx"
+FORMATO_CSV = "csv"
+TAM_PAGINA_EXPORT = 1000
+MAX_HILOS_EXPORT = 4
+TAM_GET_ALL_EXPORT = 300
+ARCHIVO_MARCAS = ".marcas_exportacion.json"
+# Los documentos con update_time dentro de este margen previo a la marca se vuelven a
+# leer: cubre escrituras que se cruzaron con el listado anterior y desfases de reloj.
+SOLAPE_MARCA = datetime.timedelta(minutes=10)
+CONFIG_PATH = "config.json"
+# En modo por campo de modificación los borrados sólo se ven en una exportación
+# completa: se fuerza una si la última es más antigua que esto.
+MAX_ANTIGUEDAD_COMPLETA = datetime.timedelta(days=7)
+
+
+def limpiar_fechas(doc):
+    limpio = {}
+    for k, v in doc.items():
+        if isinstance(v, datetime.datetime):
+            v = v.astimezone(datetime.timezone.utc).replace(tzinfo=None).isoformat()
+        limpio[k] = v
+    return limpio
+
+
+def tipo_de_valor(valor):
+    if isinstance(valor, bool): return "bool"
+    if isinstance(valor, int): return "int"
+    if isinstance(valor, float): return "float"
+    if isinstance(valor, datetime.datetime): return "datetime"
+    if isinstance(valor, list): return "list"
+    if isinstance(valor, dict): return "dict"
+    return "str"
+
+
+def _valor_celda(valor):
+    """Valor escribible en una celda: listas y mapas como literal de Python, resto tal cual."""
+    if valor is None or isinstance(valor, (str, int, float, bool)):
+        return valor
+    if isinstance(valor, (list, dict)):
+        return repr(valor)
+    return str(valor)
+
+
+def iter_paginas(
+    coleccion, tam_pagina: int = TAM_PAGINA_EXPORT, campos: Optional[list[str]] = None
+) -> Iterator[list]:
+    """Recorre la colección en páginas ordenadas por id (cursor `start_after`).
+
+    A diferencia de un único `stream()`, cada página es una consulta corta, así que
+    una colección grande no se corta por timeout a mitad de lectura. Con `campos=[]`
+    sólo se piden las claves (y `update_time`), sin el contenido de los documentos.
+    """
+    ultimo = None
+    while True:
+        consulta = coleccion.order_by("__name__").limit(tam_pagina)
+        if campos is not None:
+            consulta = consulta.select(campos)
+        if ultimo is not None:
+            consulta = consulta.start_after(ultimo)
+        pagina = list(consulta.stream())
+        if not pagina:
+            return
+        yield pagina
+        if len(pagina) < tam_pagina:
+            return
+        ultimo = pagina[-1]
+
+
+def iter_modificados(
+    coleccion, campo: str, desde: datetime.datetime, tam_pagina: int = TAM_PAGINA_EXPORT
+) -> Iterator[list]:
+    """Páginas de documentos con `campo > desde` (consulta indexada por ese campo).
+
+    Sólo se leen (y se facturan) los documentos modificados; los borrados no aparecen.
+    """
+    ultimo = None
+    while True:
+        consulta = coleccion.where(filter=FieldFilter(campo, ">", desde)).order_by(campo).limit(tam_pagina)
+        if ultimo is not None:
+            consulta = consulta.start_after(ultimo)
+        pagina = list(consulta.stream())
+        if not pagina:
+            return
+        yield pagina
+        if len(pagina) < tam_pagina:
+            return
+        ultimo = pagina[-1]
+
+
+def campos_modificacion() -> dict[str, str]:
+    """{colección: campo de fecha de modificación} de la sección "exportacion" de config.json.
+
+    Sólo las colecciones cuyo campo mantienen todas las escrituras pueden exportarse
+    en incremental leyendo únicamente los cambios.
+    """
+    try:
+        with open(CONFIG_PATH, "r", encoding="utf-8") as fh:
+            cfg = json.load(fh)
+    except FileNotFoundError:
+        return {}
+    except Exception:
+        logger.exception("No se pudo leer la configuración desde %s", CONFIG_PATH)
+        return {}
+    datos = (cfg.get("exportacion") or {}).get("campos_modificacion") if isinstance(cfg, dict) else None
+    if not isinstance(datos, dict):
+        return {}
+    return {str(k): str(v) for k, v in datos.items() if v}
+
+
+def listar_ids(coleccion, tam_pagina: int = TAM_PAGINA_EXPORT) -> Iterator[str]:
+    """Ids de la colección sin leer su contenido (proyección vacía, paginada)."""
+    for pagina in iter_paginas(coleccion, tam_pagina, campos=[]):
+        for doc in pagina:
+            yield doc.id
+
+
+class Spool:
+    """Filas de una exportación volcadas a un temporal JSON Lines.
+
+    Las columnas y los tipos sólo se conocen al final, así que las filas se guardan
+    en disco mientras se leen y se escriben después en streaming: la memoria no crece
+    con el tamaño de la colección.
+    """
+
+    def __init__(self) -> None:
+        self._fh = tempfile.TemporaryFile("w+", encoding="utf-8")
+        self.columnas: dict[str, None] = {"_id": None}
+        self.tipos: dict[str, str] = {}
+        self.total = 0
+
+    def agregar(self, fila: dict, tipos: Optional[dict] = None) -> None:
+        for k in fila:
+            self.columnas.setdefault(k, None)
+        if tipos:
+            self.tipos.update(tipos)
+        self._fh.write(json.dumps({k: _valor_celda(v) for k, v in fila.items()}, ensure_ascii=False))
+        self._fh.write("\n")
+        self.total += 1
+
+    def filas(self) -> Iterator[dict]:
+        self._fh.flush()
+        self._fh.seek(0)
+        for linea in self._fh:
+            yield json.loads(linea)
+
+    def cerrar(self) -> None:
+        self._fh.close()
+
+
+def ruta_exportacion(carpeta: str, nombre: str, formato: str = FORMATO_XLSX) -> str:
+    return os.path.join(carpeta, f"{nombre}.{formato}")
+
+
+def ruta_tipos_csv(ruta: str) -> str:
+    return f"{os.path.splitext(ruta)[0]}_tipos.csv"
+
+
+def escribir_spool(spool: Spool, ruta: str, formato: str = FORMATO_XLSX) -> None:
+    """Escribe el spool en xlsx (openpyxl write_only) o CSV; sustituye el fichero al final."""
+    columnas = list(spool.columnas)
+    tmp = f"{ruta}.tmp"
+    if formato == FORMATO_CSV:
+        with open(tmp, "w", newline="", encoding="utf-8-sig") as fh:
+            writer = csv.DictWriter(fh, fieldnames=columnas, extrasaction="ignore")
+            writer.writeheader()
+            for fila in spool.filas():
+                writer.writerow(fila)
+        ruta_tipos = ruta_tipos_csv(ruta)
+        with open(f"{ruta_tipos}.tmp", "w", newline="", encoding="utf-8-sig") as fh:
+            writer = csv.writer(fh)
+            writer.writerow(["campo", "tipo"])
+            writer.writerows(spool.tipos.items())
+        os.replace(f"{ruta_tipos}.tmp", ruta_tipos)
+    else:
+        wb = Workbook(write_only=True)
+        hoja = wb.create_sheet("datos")
+        hoja.append(columnas)
+        for fila in spool.filas():
+            hoja.append([fila.get(c) for c in columnas])
+        hoja_tipos = wb.create_sheet("tipos")
+        hoja_tipos.append(["campo", "tipo"])
+        for campo, tipo in spool.tipos.items():
+            hoja_tipos.append([campo, tipo])
+        wb.save(tmp)
+    os.replace(tmp, ruta)
+
+
+def _update_time(doc) -> Optional[datetime.datetime]:
+    valor = getattr(doc, "update_time", None)
+    return valor if isinstance(valor, datetime.datetime) else None
+
+
+class MarcasExportacion:
+    """Marca de agua por colección (máximo update_time exportado) junto a los ficheros."""
+
+    def __init__(self, carpeta: str) -> None:
+        self.ruta = os.path.join(carpeta, ARCHIVO_MARCAS)
+        self._lock = threading.Lock()
+        try:
+            with open(self.ruta, "r", encoding="utf-8") as fh:
+                self._marcas: dict[str, dict] = json.load(fh)
+        except FileNotFoundError:
+            self._marcas = {}
+        except Exception:
+            logger.exception("Marcas de exportación ilegibles en %s; se hará exportación completa", self.ruta)
+            self._marcas = {}
+
+    def obtener(self, coleccion: str, formato: str) -> Optional[datetime.datetime]:
+        with self._lock:
+            marca = self._marcas.get(coleccion) or {}
+        if marca.get("formato") != formato or not marca.get("update_time"):
+            return None
+        return datetime.datetime.fromisoformat(marca["update_time"])
+
+    def ultima_completa(self, coleccion: str) -> Optional[datetime.datetime]:
+        with self._lock:
+            completa = (self._marcas.get(coleccion) or {}).get("completa")
+        return datetime.datetime.fromisoformat(completa) if completa else None
+
+    def guardar(
+        self,
+        coleccion: str,
+        formato: str,
+        update_time: Optional[datetime.datetime],
+        documentos: int,
+        completa: bool = False,
+    ) -> None:
+        if update_time is None:
+            return
+        ahora = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        with self._lock:
+            anterior = self._marcas.get(coleccion) or {}
+            self._marcas[coleccion] = {
+                "update_time": update_time.isoformat(),
+                "formato": formato,
+                "documentos": documentos,
+                "exportado": ahora,
+                "completa": ahora if completa else anterior.get("completa"),
+            }
+            tmp = f"{self.ruta}.tmp"
+            with open(tmp, "w", encoding="utf-8") as fh:
+                json.dump(self._marcas, fh, ensure_ascii=False, indent=2)
+            os.replace(tmp, self.ruta)
+
+
+def exportar_coleccion(
+    coleccion,
+    carpeta: str,
+    *,
+    formato: str = FORMATO_XLSX,
+    tam_pagina: int = TAM_PAGINA_EXPORT,
+    on_progreso: Optional[Callable[[dict], None]] = None,
+) -> dict:
+    """Exporta una colección página a página; devuelve {coleccion, documentos, segundos, ruta}."""
+    nombre = getattr(coleccion, "id", "coleccion")
+    t0 = time.monotonic()
+    spool = Spool()
+    maximo: Optional[datetime.datetime] = None
+    try:
+        for pagina in iter_paginas(coleccion, tam_pagina):
+            for doc in pagina:
+                raw = doc.to_dict() or {}
+                fila = {"_id": doc.id, **limpiar_fechas(raw)}
+                spool.agregar(fila, {k: tipo_de_valor(v) for k, v in raw.items()})
+                actualizado = _update_time(doc)
+                if actualizado is not None and (maximo is None or actualizado > maximo):
+                    maximo = actualizado
+            if on_progreso is not None:
+                on_progreso({"coleccion": nombre, "documentos": spool.total, "estado": "leyendo"})
+        ruta = None
+        if spool.total:
+            if on_progreso is not None:
+                on_progreso({"coleccion": nombre, "documentos": spool.total, "estado": "escribiendo"})
+            ruta = ruta_exportacion(carpeta, nombre, formato)
+            escribir_spool(spool, ruta, formato)
+    finally:
+        spool.cerrar()
+    resumen = {
+        "coleccion": nombre,
+        "documentos": spool.total,
+        "segundos": time.monotonic() - t0,
+        "ruta": ruta,
+        "update_time": maximo,
+    }
+    logger.info("Exportada %s: %s documentos en %.1f s", nombre, spool.total, resumen["segundos"])
+    return resumen
+
+
+def _leer_exportacion(ruta: str, formato: str) -> tuple[Iterator[dict], dict[str, str]]:
+    """(filas, tipos) de un fichero exportado, leído en streaming."""
+    if formato == FORMATO_CSV:
+        tipos: dict[str, str] = {}
+        ruta_tipos = ruta_tipos_csv(ruta)
+        if os.path.exists(ruta_tipos):
+            with open(ruta_tipos, newline="", encoding="utf-8-sig") as fh:
+                tipos = {f["campo"]: f["tipo"] for f in csv.DictReader(fh)}
+
+        def _filas_csv() -> Iterator[dict]:
+            with open(ruta, newline="", encoding="utf-8-sig") as fh:
+                for fila in csv.DictReader(fh):
+                    yield {k: (v if v != "" else None) for k, v in fila.items()}
+
+        return _filas_csv(), tipos
+
+    wb = load_workbook(ruta, read_only=True)
+    tipos = {}
+    if "tipos" in wb.sheetnames:
+        for campo, tipo, *_ in wb["tipos"].iter_rows(min_row=2, values_only=True):
+            if campo:
+                tipos[str(campo)] = str(tipo)
+
+    def _filas_xlsx() -> Iterator[dict]:
+        try:
+            filas = wb["datos"].iter_rows(values_only=True)
+            cabecera = [str(c) if c is not None else "" for c in next(filas, ())]
+            for valores in filas:
+                yield dict(zip(cabecera, valores))
+        finally:
+            wb.close()
+
+    return _filas_xlsx(), tipos
+
+
+def exportar_coleccion_incremental(
+    db,
+    coleccion,
+    carpeta: str,
+    marca: datetime.datetime,
+    *,
+    formato: str = FORMATO_XLSX,
+    tam_pagina: int = TAM_PAGINA_EXPORT,
+    campo_modificacion: Optional[str] = None,
+    on_progreso: Optional[Callable[[dict], None]] = None,
+) -> dict:
+    """Actualiza una exportación existente con los cambios desde `marca`.
+
+    Con `campo_modificacion` se consulta `campo > marca` por índice: sólo se leen los
+    documentos cambiados, pero los borrados no se detectan (sí en la exportación
+    completa). Sin él se listan todas las claves con `update_time` (proyección vacía,
+    que Firestore factura como una lectura por documento) y se leen con `get_all` los
+    cambiados: ahorra descarga y escritura del fichero, no lecturas.
+    """
+    nombre = getattr(coleccion, "id", "coleccion")
+    t0 = time.monotonic()
+    desde = marca - SOLAPE_MARCA
+    actuales: Optional[set[str]] = None
+    frescos: dict[str, dict] = {}
+    maximo = marca
+    if campo_modificacion:
+        for pagina in iter_modificados(coleccion, campo_modificacion, desde, tam_pagina):
+            for doc in pagina:
+                raw = doc.to_dict() or {}
+                frescos[doc.id] = raw
+                modificado = raw.get(campo_modificacion)
+                if isinstance(modificado, datetime.datetime) and modificado > maximo:
+                    maximo = modificado
+            if on_progreso is not None:
+                on_progreso({"coleccion": nombre, "documentos": len(frescos), "estado": "leyendo cambios"})
+        leidos = len(frescos)
+    else:
+        actuales = set()
+        cambiados: list[str] = []
+        for pagina in iter_paginas(coleccion, tam_pagina, campos=[]):
+            for doc in pagina:
+                actuales.add(doc.id)
+                actualizado = _update_time(doc)
+                if actualizado is None or actualizado > desde:
+                    cambiados.append(doc.id)
+                if actualizado is not None and actualizado > maximo:
+                    maximo = actualizado
+            if on_progreso is not None:
+                on_progreso({"coleccion": nombre, "documentos": len(actuales), "estado": "listando"})
+        for i in range(0, len(cambiados), TAM_GET_ALL_EXPORT):
+            refs = [coleccion.document(doc_id) for doc_id in cambiados[i:i + TAM_GET_ALL_EXPORT]]
+            for snap in db.get_all(refs):
+                if getattr(snap, "exists", False):
+                    frescos[snap.id] = snap.to_dict() or {}
+        leidos = len(actuales) + len(cambiados)
+
+    ruta = ruta_exportacion(carpeta, nombre, formato)
+    filas_previas, tipos_previos = _leer_exportacion(ruta, formato)
+    spool = Spool()
+    spool.tipos.update(tipos_previos)
+    borrados = actualizados = 0
+    try:
+        if on_progreso is not None:
+            on_progreso({"coleccion": nombre, "documentos": len(filas_previas), "estado": "escribiendo"})
+        for fila in filas_previas:
+            doc_id = str(fila.get("_id"))
+            if actuales is not None and doc_id not in actuales:
+                borrados += 1
+                continue
+            raw = frescos.pop(doc_id, None)
+            if raw is None:
+                spool.agregar(fila)
+                continue
+            actualizados += 1
+            spool.agregar({"_id": doc_id, **limpiar_fechas(raw)}, {k: tipo_de_valor(v) for k, v in raw.items()})
+        nuevos = len(frescos)
+        for doc_id, raw in frescos.items():
+            spool.agregar({"_id": doc_id, **limpiar_fechas(raw)}, {k: tipo_de_valor(v) for k, v in raw.items()})
+        escribir_spool(spool, ruta, formato)
+    finally:
+        spool.cerrar()
+    resumen = {
+        "coleccion": nombre,
+        "documentos": spool.total,
+        "segundos": time.monotonic() - t0,
+        "ruta": ruta,
+        "update_time": maximo,
+        "leidos": leidos,
+        "nuevos": nuevos,
+        "actualizados": actualizados,
+        "borrados": borrados,
+    }
+    logger.info(
+        "Exportada %s (incremental%s): %s lecturas, %s nuevos, %s actualizados, %s borrados en %.1f s",
+        nombre,
+        f" por {campo_modificacion}" if campo_modificacion else " por listado de claves",
+        leidos,
+        nuevos,
+        actualizados,
+        borrados,
+        resumen["segundos"],
+    )
+    return resumen
+
+
+def exportar_colecciones(
+    db,
+    carpeta: str,
+    *,
+    formato: str = FORMATO_XLSX,
+    incremental: bool = False,
+    max_hilos: int = MAX_HILOS_EXPORT,
+    on_progreso: Optional[Callable[[dict], None]] = None,
+) -> list[dict]:
+    """Exporta todas las colecciones raíz en paralelo (pool acotado).
+
+    Con `incremental`, las colecciones con marca de agua y fichero previo en el mismo
+    formato sólo descargan los cambios (por el campo de modificación de config.json
+    si lo tienen, forzando una completa cada MAX_ANTIGUEDAD_COMPLETA); el resto se
+    exporta completa. `on_progreso`
+    recibe {coleccion, documentos, estado, segundos?} desde los hilos del pool.
+    Devuelve un resumen por colección; las que fallan llevan `error`.
+    """
+    colecciones = list(db.collections())
+    marcas = MarcasExportacion(carpeta)
+    campos = campos_modificacion() if incremental else {}
+
+    def _una(coleccion) -> dict:
+        nombre = getattr(coleccion, "id", "coleccion")
+        try:
+            marca = marcas.obtener(nombre, formato) if incremental else None
+            campo = campos.get(nombre)
+            if marca is not None and campo:
+                ultima = marcas.ultima_completa(nombre)
+                if ultima is None or datetime.datetime.now(datetime.timezone.utc) - ultima > MAX_ANTIGUEDAD_COMPLETA:
+                    marca = None  # toca exportación completa para recoger los borrados
+            completa = marca is None or not os.path.exists(ruta_exportacion(carpeta, nombre, formato))
+            if not completa:
+                resumen = exportar_coleccion_incremental(
+                    db,
+                    coleccion,
+                    carpeta,
+                    marca,
+                    formato=formato,
+                    campo_modificacion=campo,
+                    on_progreso=on_progreso,
+                )
+            else:
+                resumen = exportar_coleccion(coleccion, carpeta, formato=formato, on_progreso=on_progreso)
+            if resumen["ruta"]:
+                marcas.guardar(
+                    nombre,
+                    formato,
+                    resumen.get("update_time"),
+                    resumen["documentos"],
+                    completa=completa,
+                )
+        except Exception as exc:
+            logger.exception("Error exportando la colección %s", nombre)
+            resumen = {"coleccion": nombre, "documentos": 0, "segundos": 0.0, "ruta": None, "error": str(exc)}
+        if on_progreso is not None:
+            on_progreso({**resumen, "estado": "error" if "error" in resumen else "hecho"})
+        return resumen
+
+    if not colecciones:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, min(max_hilos, len(colecciones))), thread_name_prefix="exportar") as pool:
+        return list(pool.map(_una, colecciones))
@@ -0,0 +1,194 @@
+"""Sustitutos locales de FCM para medir el envío push sin tocar dispositivos reales.
+
+- `ServidorFCMFalso`: servidor HTTP local que imita `POST /v1/projects/<id>/messages:send`.
+- `BackendSendEachFalso`: reemplazo de `firebase_admin.messaging.send_each`.
+
+Ambos simulan latencia, errores transitorios (503/UnavailableError) y tokens no
+registrados (404 UNREGISTERED/UnregisteredError). Los tokens que empiezan por
+`PREFIJO_MUERTO` siempre se tratan como no registrados.
+"""
+
+import contextlib
+import json
+import logging
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterator, Optional
+
+from firebase_admin import exceptions as fb_exceptions
+from firebase_admin import messaging
+
+logger = logging.getLogger(__name__)
+
+PREFIJO_MUERTO = "dead"
+_RUTA_SEND = re.compile(r"^/v1/projects/[^/]+/messages:send$")
+
+
+class SimuladorFCM:
+    """Decide el resultado de cada envío según la latencia y las tasas configuradas."""
+
+    def __init__(
+        self,
+        latencia_ms: float = 20.0,
+        tasa_error: float = 0.0,
+        tasa_unregistered: float = 0.0,
+        semilla: Optional[int] = None,
+    ) -> None:
+        self.latencia_ms = latencia_ms
+        self.tasa_error = tasa_error
+        self.tasa_unregistered = tasa_unregistered
+        self._random = random.Random(semilla)
+        self._lock = threading.Lock()
+        self.peticiones = 0
+        self.mensajes = 0
+        self.errores = 0
+        self.no_registrados = 0
+
+    def esperar(self) -> None:
+        if self.latencia_ms > 0:
+            with self._lock:
+                factor = self._random.uniform(0.5, 1.5)
+            time.sleep(self.latencia_ms * factor / 1000.0)
+
+    def resultado(self, token: Optional[str]) -> str:
+        """Devuelve "ok", "error" o "unregistered" para un token."""
+        with self._lock:
+            self.mensajes += 1
+            if token and token.startswith(PREFIJO_MUERTO):
+                self.no_registrados += 1
+                return "unregistered"
+            azar = self._random.random()
+            if azar < self.tasa_error:
+                self.errores += 1
+                return "error"
+            if azar < self.tasa_error + self.tasa_unregistered:
+                self.no_registrados += 1
+                return "unregistered"
+            return "ok"
+
+    def contar_peticion(self) -> None:
+        with self._lock:
+            self.peticiones += 1
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            return {
+                "peticiones": self.peticiones,
+                "mensajes": self.mensajes,
+                "errores": self.errores,
+                "no_registrados": self.no_registrados,
+            }
+
+
+class BackendSendEachFalso:
+    """Callable compatible con `messaging.send_each`: una latencia por llamada, como un lote."""
+
+    def __init__(self, simulador: SimuladorFCM) -> None:
+        self.simulador = simulador
+
+    def __call__(self, messages, dry_run: bool = False, app=None) -> messaging.BatchResponse:
+        self.simulador.contar_peticion()
+        self.simulador.esperar()
+        respuestas = []
+        for i, msg in enumerate(messages):
+            resultado = self.simulador.resultado(getattr(msg, "token", None))
+            if resultado == "ok":
+                respuestas.append(messaging.SendResponse({"name": f"projects/falso/messages/{i}"}, None))
+            elif resultado == "unregistered":
+                respuestas.append(
+                    messaging.SendResponse(None, messaging.UnregisteredError("Requested entity was not found."))
+                )
+            else:
+                respuestas.append(
+                    messaging.SendResponse(None, fb_exceptions.UnavailableError("Servicio no disponible (falso)"))
+                )
+        return messaging.BatchResponse(respuestas)
+
+    @contextlib.contextmanager
+    def instalado(self) -> Iterator["BackendSendEachFalso"]:
+        """Sustituye `messaging.send_each` mientras dura el bloque `with`."""
+        original = messaging.send_each
+        messaging.send_each = self  # type: ignore[assignment]
+        try:
+            yield self
+        finally:
+            messaging.send_each = original  # type: ignore[assignment]
+
+
+class _ManejadorFCM(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, como el endpoint real
+    disable_nagle_algorithm = True  # cabeceras y cuerpo van en escrituras separadas
+    simulador: SimuladorFCM
+
+    def do_POST(self) -> None:  # noqa: N802 - nombre fijado por BaseHTTPRequestHandler
+        longitud = int(self.headers.get("Content-Length") or 0)
+        cuerpo = self.rfile.read(longitud) if longitud else b""
+        if not _RUTA_SEND.match(self.path):
+            self._responder(404, {"error": {"code": 404, "status": "NOT_FOUND"}})
+            return
+        try:
+            token = (json.loads(cuerpo or b"{}").get("message") or {}).get("token")
+        except ValueError:
+            self._responder(400, {"error": {"code": 400, "status": "INVALID_ARGUMENT"}})
+            return
+        self.simulador.contar_peticion()
+        self.simulador.esperar()
+        resultado = self.simulador.resultado(token)
+        if resultado == "ok":
+            self._responder(200, {"name": "projects/falso/messages/1"})
+        elif resultado == "unregistered":
+            self._responder(404, {"error": {
+                "code": 404,
+                "status": "NOT_FOUND",
+                "details": [{"errorCode": "UNREGISTERED"}],
+            }})
+        else:
+            self._responder(503, {"error": {"code": 503, "status": "UNAVAILABLE"}}, {"Retry-After": "0"})
+
+    def _responder(self, status: int, datos: dict, cabeceras: Optional[dict] = None) -> None:
+        cuerpo = json.dumps(datos).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(cuerpo)))
+        for clave, valor in (cabeceras or {}).items():
+            self.send_header(clave, valor)
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+class ServidorFCMFalso:
+    """Endpoint FCM v1 local en 127.0.0.1 (puerto libre) servido desde un hilo propio."""
+
+    def __init__(self, simulador: SimuladorFCM, puerto: int = 0) -> None:
+        self.simulador = simulador
+        manejador = type("ManejadorFCM", (_ManejadorFCM,), {"simulador": simulador})
+        self._servidor = ThreadingHTTPServer(("127.0.0.1", puerto), manejador)
+        self._servidor.daemon_threads = True
+        self._hilo: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        """Plantilla equivalente a `cliente_fcm.FCM_URL` apuntando al servidor local."""
+        host, puerto = self._servidor.server_address[:2]
+        return f"http://{host}:{puerto}/v1/projects/{{project_id}}/messages:send"
+
+    def iniciar(self) -> "ServidorFCMFalso":
+        self._hilo = threading.Thread(target=self._servidor.serve_forever, daemon=True, name="fcm_falso")
+        self._hilo.start()
+        return self
+
+    def detener(self) -> None:
+        self._servidor.shutdown()
+        self._servidor.server_close()
+
+    def __enter__(self) -> "ServidorFCMFalso":
+        return self.iniciar()
+
+    def __exit__(self, *exc_info) -> None:
+        self.detener()
@@ -0,0 +1,350 @@
+import ast
+import datetime
+import hashlib
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Iterator, Optional
+
+import pandas as pd
+
+from escritor_lotes import MAX_OPS_LOTE, EscritorLotes
+from exportacion import listar_ids
+
+logger = logging.getLogger(__name__)
+
+MUESTRA_VISTA_PREVIA = 20  # ids de ejemplo por categoría en la vista previa
+TAM_GET_ALL_IMPORT = 300
+HILOS_BORRADO = 4
+MAX_BORRADOS_SIN_CONFIRMAR = 200  # por encima se pide una confirmación explícita más
+
+
+_VERDADERO = {"true", "sí", "si", "1", "1.0", "verdadero"}
+_FALSO = {"false", "no", "0", "0.0", "falso"}
+
+
+class InformeConversion:
+    """Errores de conversión por columna y fila del Excel (fila 2 = primera de datos)."""
+
+    def __init__(self) -> None:
+        self.errores: list[tuple[str, int, object, str]] = []
+        self._filas: set[int] = set()
+
+    def agregar(self, columna: str, posiciones, valores, motivo: str) -> None:
+        for pos, valor in zip(posiciones, valores):
+            self.errores.append((columna, int(pos) + 2, valor, motivo))
+            self._filas.add(int(pos))
+
+    def tiene_error(self, posicion: int) -> bool:
+        return posicion in self._filas
+
+    @property
+    def filas(self) -> int:
+        return len(self._filas)
+
+    def por_columna(self) -> dict[str, int]:
+        cuenta: dict[str, int] = {}
+        for columna, *_ in self.errores:
+            cuenta[columna] = cuenta.get(columna, 0) + 1
+        return cuenta
+
+    def muestra(self, limite: int) -> list[str]:
+        return [
+            f"! fila {fila}, {columna}: {valor!r} ({motivo})"
+            for columna, fila, valor, motivo in self.errores[:limite]
+        ]
+
+
+def _texto(valor) -> str:
+    # pandas sube a float las columnas numéricas con huecos: 600123456.0 -> "600123456"
+    if isinstance(valor, float) and valor.is_integer():
+        return str(int(valor))
+    return str(valor)
+
+
+def _literal(valor):
+    if isinstance(valor, str):
+        return ast.literal_eval(valor)
+    if isinstance(valor, (list, dict)):
+        return valor
+    raise ValueError("no es lista ni mapa")
+
+
+def convertir_columna(serie: pd.Series, tipo: str, columna: str, informe: InformeConversion) -> list:
+    """Convierte una columna entera según su tipo; None en huecos y en celdas erróneas.
+
+    Fechas, números y booleanos se convierten de una vez con pandas; sólo las columnas
+    list/dict se evalúan celda a celda con `literal_eval`.
+    """
+    presentes = serie.notna().to_numpy()
+    posiciones = range(len(serie))
+    if tipo == "datetime":
+        conv = pd.to_datetime(serie, errors="coerce", utc=True, format="ISO8601")
+        validos = conv.notna().to_numpy()
+        valores = [d if ok else None for d, ok in zip(conv.dt.to_pydatetime(), validos)]
+        motivo = "fecha no válida"
+    elif tipo in ("int", "float"):
+        num = pd.to_numeric(serie, errors="coerce")
+        if tipo == "int":
+            validos = (num.notna() & (num % 1 == 0)).to_numpy()
+            valores = num.where(validos).astype("Int64").astype(object).where(validos, None).tolist()
+            motivo = "no es un entero"
+        else:
+            validos = num.notna().to_numpy()
+            valores = num.astype(object).where(validos, None).tolist()
+            motivo = "no es un número"
+    elif tipo == "bool":
+        if pd.api.types.is_bool_dtype(serie):
+            conv = serie.astype(object)
+        else:
+            texto = serie.map(_texto, na_action="ignore").str.strip().str.lower()
+            conv = texto.map(lambda v: True if v in _VERDADERO else False if v in _FALSO else None)
+        validos = conv.notna().to_numpy()
+        valores = conv.where(validos, None).tolist()
+        motivo = "no es verdadero/falso"
+    elif tipo in ("list", "dict"):
+        valores = [None] * len(serie)
+        validos = [False] * len(serie)
+        motivo = f"no es un literal {tipo} válido"
+        for pos, (valor, presente) in enumerate(zip(serie.tolist(), presentes)):
+            if not presente:
+                continue
+            try:
+                valores[pos] = _literal(valor)
+                validos[pos] = True
+            except (ValueError, SyntaxError, TypeError, MemoryError, RecursionError):
+                pass
+    else:
+        valores = serie.map(_texto, na_action="ignore").astype(object).where(serie.notna(), None).tolist()
+        validos = presentes
+        motivo = ""
+    malos = [pos for pos, presente, ok in zip(posiciones, presentes, validos) if presente and not ok]
+    if malos:
+        originales = serie.tolist()
+        informe.agregar(columna, malos, [originales[p] for p in malos], motivo)
+    return valores
+
+
+def filas_convertidas(df: pd.DataFrame, tipos: dict, informe: InformeConversion) -> Iterator[tuple[str, dict]]:
+    """(doc_id, datos listos para escribir) por fila; las filas con errores se omiten."""
+    columnas = [c for c in df.columns if c != "_id"]
+    convertidas = {c: convertir_columna(df[c], tipos.get(c, "str"), c, informe) for c in columnas}
+    sin_id = [pos for pos, vacio in enumerate(df["_id"].isna().to_numpy()) if vacio]
+    if sin_id:
+        informe.agregar("_id", sin_id, [None] * len(sin_id), "fila sin _id")
+    ids = df["_id"].map(_texto, na_action="ignore").tolist()
+    for pos, doc_id in enumerate(ids):
+        if informe.tiene_error(pos):
+            continue
+        yield doc_id, {c: valores[pos] for c, valores in convertidas.items() if valores[pos] is not None}
+
+
+def leer_excel(archivo: str) -> tuple[str, pd.DataFrame, dict]:
+    """(colección, hoja datos, {campo: tipo}) de un Excel exportado por la aplicación."""
+    nombre_coleccion = os.path.splitext(os.path.basename(archivo))[0]
+    df = pd.read_excel(archivo, sheet_name="datos")
+    df_tipos = pd.read_excel(archivo, sheet_name="tipos")
+    tipos = dict(zip(df_tipos["campo"], df_tipos["tipo"]))
+    if "_id" not in df.columns:
+        raise ValueError("El archivo no contiene una columna '_id'")
+    return nombre_coleccion, df, tipos
+
+
+def _normalizar(valor):
+    if isinstance(valor, datetime.datetime):
+        if valor.tzinfo is None:
+            valor = valor.replace(tzinfo=datetime.timezone.utc)
+        return valor.astimezone(datetime.timezone.utc).isoformat(timespec="microseconds")
+    if isinstance(valor, dict):
+        return {str(k): _normalizar(v) for k, v in valor.items() if v not in (None, "")}
+    if isinstance(valor, (list, tuple)):
+        return [_normalizar(v) for v in valor]
+    if isinstance(valor, (str, int, float, bool)):
+        return valor
+    return str(valor)
+
+
+def huella(datos: dict) -> str:
+    """Hash del contenido de un documento, estable entre Excel y Firestore.
+
+    Los campos vacíos (None o "") se ignoran: en el Excel son celdas en blanco y no
+    deben contar como cambio.
+    """
+    normal = _normalizar(datos or {})
+    texto = json.dumps(normal, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(texto.encode("utf-8")).hexdigest()
+
+
+class DiffImportacion:
+    """Cambios a aplicar en una colección para que quede igual que el Excel."""
+
+    def __init__(self, coleccion: str) -> None:
+        self.coleccion = coleccion
+        self.crear: dict[str, dict] = {}
+        self.actualizar: dict[str, dict] = {}
+        self.borrar: list[str] = []
+        self.sin_cambios = 0
+        self.duplicados = 0
+        self.filas = 0
+        self.conversion = InformeConversion()
+
+    @property
+    def total_cambios(self) -> int:
+        return len(self.crear) + len(self.actualizar) + len(self.borrar)
+
+    def descripcion(self) -> str:
+        texto = (
+            f"Colección {self.coleccion}: {self.filas} filas en el Excel.\n"
+            f"• Nuevos: {len(self.crear)}\n"
+            f"• Modificados: {len(self.actualizar)}\n"
+            f"• A eliminar: {len(self.borrar)}\n"
+            f"• Sin cambios: {self.sin_cambios}"
+        )
+        if self.duplicados:
+            texto += f"\n• _id repetidos en el Excel (se usa la última fila): {self.duplicados}"
+        if self.conversion.filas:
+            columnas = ", ".join(f"{c} ({n})" for c, n in self.conversion.por_columna().items())
+            texto += (
+                f"\n• Filas con errores de conversión (no se subirán): {self.conversion.filas}"
+                f"\n  Columnas: {columnas}"
+            )
+        return texto
+
+    def muestra(self) -> list[str]:
+        lineas = [f"+ {i}" for i in list(self.crear)[:MUESTRA_VISTA_PREVIA]]
+        lineas += [f"~ {i}" for i in list(self.actualizar)[:MUESTRA_VISTA_PREVIA]]
+        lineas += [f"- {i}" for i in self.borrar[:MUESTRA_VISTA_PREVIA]]
+        lineas += self.conversion.muestra(MUESTRA_VISTA_PREVIA)
+        return lineas
+
+
+def calcular_diff(
+    db,
+    nombre_coleccion: str,
+    df: pd.DataFrame,
+    tipos: dict,
+    *,
+    eliminar_faltantes: bool,
+    on_progreso: Optional[Callable[[str], None]] = None,
+) -> DiffImportacion:
+    """Compara el Excel con la colección sin escribir nada.
+
+    La colección se enumera sólo por claves; el contenido (para comparar huellas)
+    se lee con `get_all` únicamente para los ids que también están en el Excel.
+    """
+    diff = DiffImportacion(nombre_coleccion)
+    coleccion = db.collection(nombre_coleccion)
+    existentes: set[str] = set()
+    for doc_id in listar_ids(coleccion):
+        existentes.add(doc_id)
+        if on_progreso is not None and len(existentes) % 5000 == 0:
+            on_progreso(f"🔎 Listando {nombre_coleccion}: {len(existentes)} documentos...")
+
+    diff.filas = len(df)
+    filas: dict[str, dict] = {}
+    for doc_id, datos in filas_convertidas(df, tipos, diff.conversion):
+        if doc_id in filas:
+            diff.duplicados += 1
+            del filas[doc_id]  # la última fila manda, también en el orden de escritura
+        filas[doc_id] = datos
+
+    comunes = [doc_id for doc_id in filas if doc_id in existentes]
+    for i in range(0, len(comunes), TAM_GET_ALL_IMPORT):
+        refs = [coleccion.document(doc_id) for doc_id in comunes[i:i + TAM_GET_ALL_IMPORT]]
+        for snap in db.get_all(refs):
+            if getattr(snap, "exists", False) and huella(snap.to_dict() or {}) != huella(filas[snap.id]):
+                diff.actualizar[snap.id] = filas[snap.id]
+        if on_progreso is not None:
+            on_progreso(f"🔎 Comparando {nombre_coleccion}: {min(i + TAM_GET_ALL_IMPORT, len(comunes))}/{len(comunes)}...")
+    diff.crear = {doc_id: datos for doc_id, datos in filas.items() if doc_id not in existentes}
+    if eliminar_faltantes:
+        # Un _id cuya fila no se pudo convertir sigue en el Excel: no se borra.
+        en_excel = set(filas) | set(df["_id"].map(_texto, na_action="ignore").dropna())
+        diff.borrar = sorted(existentes - en_excel)
+    diff.sin_cambios = len(filas) - len(diff.crear) - len(diff.actualizar)
+    return diff
+
+
+def borrar_documentos(
+    db,
+    nombre_coleccion: str,
+    ids: list[str],
+    *,
+    hilos: int = HILOS_BORRADO,
+    on_progreso: Optional[Callable[[int, int], None]] = None,
+) -> dict:
+    """Borra `ids` en WriteBatch de hasta 500, confirmando varios lotes en paralelo.
+
+    Devuelve {borrados, fallos}; `on_progreso(hechos, total)` se llama tras cada lote.
+    """
+    coleccion = db.collection(nombre_coleccion)
+    trozos = [ids[i:i + MAX_OPS_LOTE] for i in range(0, len(ids), MAX_OPS_LOTE)]
+
+    def _trozo(trozo: list[str]) -> tuple[int, list]:
+        escritor = EscritorLotes(db, tam_lote=MAX_OPS_LOTE, intervalo=None, nombre=f"borrar_{nombre_coleccion}")
+        with escritor:
+            for doc_id in trozo:
+                escritor.delete(coleccion.document(doc_id))
+        return escritor.escritos, escritor.fallos
+
+    borrados = 0
+    fallos: list[tuple[str, str]] = []
+    hechos = 0
+    if not trozos:
+        return {"borrados": 0, "fallos": []}
+    with ThreadPoolExecutor(max_workers=max(1, min(hilos, len(trozos))), thread_name_prefix="borrar") as pool:
+        futuros = {pool.submit(_trozo, trozo): len(trozo) for trozo in trozos}
+        for futuro in as_completed(futuros):
+            escritos, fallos_trozo = futuro.result()
+            borrados += escritos
+            fallos.extend(fallos_trozo)
+            hechos += futuros[futuro]
+            if on_progreso is not None:
+                on_progreso(hechos, len(ids))
+    return {"borrados": borrados, "fallos": fallos}
+
+
+def aplicar_diff(
+    db,
+    diff: DiffImportacion,
+    *,
+    on_progreso: Optional[Callable[[str], None]] = None,
+) -> dict:
+    """Escribe sólo los cambios del diff en WriteBatch; devuelve {escritos, fallos, segundos}."""
+    t0 = time.monotonic()
+    coleccion = db.collection(diff.coleccion)
+    total = len(diff.crear) + len(diff.actualizar)
+    hechos = 0
+    with EscritorLotes(db, nombre=f"importar_{diff.coleccion}", intervalo=None) as escritor:
+        for doc_id, datos in (*diff.crear.items(), *diff.actualizar.items()):
+            escritor.set(coleccion.document(doc_id), datos)
+            hechos += 1
+            if on_progreso is not None and hechos % escritor.tam_lote == 0:
+                on_progreso(f"⬆️ {diff.coleccion}: {hechos}/{total} documentos escritos...")
+    borrado = borrar_documentos(
+        db,
+        diff.coleccion,
+        diff.borrar,
+        on_progreso=(
+            (lambda n, t: on_progreso(f"🗑️ {diff.coleccion}: {n}/{t} documentos eliminados..."))
+            if on_progreso is not None
+            else None
+        ),
+    )
+    resumen = {
+        "escritos": escritor.escritos + borrado["borrados"],
+        "fallos": list(escritor.fallos) + borrado["fallos"],
+        "lotes": escritor.lotes,
+        "segundos": time.monotonic() - t0,
+    }
+    logger.info(
+        "Importación %s: %s operaciones en %s lotes (%s fallos) en %.1f s",
+        diff.coleccion,
+        resumen["escritos"],
+        resumen["lotes"],
+        len(resumen["fallos"]),
+        resumen["segundos"],
+    )
+    return resumen
@@ -0,0 +1,210 @@
+import datetime as dt
+import logging
+import threading
+from datetime import date, timedelta, timezone
+from typing import Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+COLECCION_PETICIONES = "Peticiones"
+DIAS_HISTORIA = 7  # días hacia atrás que cubre el listener
+ESPERA_CARGA = 15.0  # segundos máximos esperando la primera instantánea
+
+
+def _inicio_dia_utc(d: date) -> dt.datetime:
+    local_tz = dt.datetime.now().astimezone().tzinfo
+    return dt.datetime(d.year, d.month, d.day, tzinfo=local_tz).astimezone(timezone.utc)
+
+
+def _fin_dia_utc(d: date) -> dt.datetime:
+    local_tz = dt.datetime.now().astimezone().tzinfo
+    local = dt.datetime(d.year, d.month, d.day, 23, 59, 59, 999000, tzinfo=local_tz)
+    return local.astimezone(timezone.utc)
+
+
+def _fecha_local(value) -> Optional[date]:
+    if value is None:
+        return None
+    if hasattr(value, "to_datetime"):
+        try:
+            value = value.to_datetime()
+        except Exception:
+            return None
+    if isinstance(value, dt.datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=dt.datetime.now().astimezone().tzinfo)
+        return value.astimezone().date()
+    if isinstance(value, date):
+        return value
+    return None
+
+
+def _entrada(data: Optional[dict]) -> Optional[tuple[str, date]]:
+    """(uid, fecha local) si la petición está admitida; None en otro caso."""
+    data = data or {}
+    if (data.get("Admitido") or "").strip().lower() != "ok":
+        return None
+    uid = data.get("uid") or data.get("Uid")
+    fecha = _fecha_local(data.get("Fecha"))
+    if not uid or fecha is None:
+        return None
+    return str(uid), fecha
+
+
+class IndiceDiasLibres:
+    """Índice en memoria de las Peticiones admitidas: fecha -> uids y uid -> fechas.
+
+    Un listener `on_snapshot` sobre las peticiones desde `DIAS_HISTORIA` días atrás lo
+    mantiene al día (altas, aprobaciones, denegaciones y borrados). Las fechas fuera
+    de esa ventana, o si el listener no llega a cargar, se consultan a Firestore.
+    """
+
+    def __init__(self, db, coleccion: str = COLECCION_PETICIONES, dias_historia: int = DIAS_HISTORIA) -> None:
+        self.db = db
+        self.coleccion = coleccion
+        self.desde = dt.datetime.now().date() - timedelta(days=dias_historia)
+        self._docs: dict[str, tuple[str, date]] = {}
+        self._por_fecha: dict[date, dict[str, int]] = {}
+        self._por_uid: dict[str, dict[date, int]] = {}
+        self._lock = threading.Lock()
+        self._listo = threading.Event()
+        self._watch = None
+
+    # --- listener ---
+    def iniciar(self) -> None:
+        if self._watch is not None:
+            return
+        try:
+            consulta = self.db.collection(self.coleccion).where("Fecha", ">=", _inicio_dia_utc(self.desde))
+            self._watch = consulta.on_snapshot(self._on_snapshot)
+        except Exception:
+            logger.exception("No se pudo suscribir el índice de días libres; se consultará bajo demanda")
+            self._watch = None
+
+    def _on_snapshot(self, docs, changes, read_time) -> None:
+        with self._lock:
+            if not self._listo.is_set():
+                self._docs.clear()
+                self._por_fecha.clear()
+                self._por_uid.clear()
+                for doc in docs:
+                    self._poner(doc.id, _entrada(doc.to_dict()))
+            else:
+                for change in changes:
+                    doc = change.document
+                    if getattr(change.type, "name", "") == "REMOVED":
+                        self._poner(doc.id, None)
+                    else:
+                        self._poner(doc.id, _entrada(doc.to_dict()))
+            total = len(self._docs)
+        if not self._listo.is_set():
+            self._listo.set()
+            logger.info("Índice de días libres cargado: %s peticiones admitidas", total)
+
+    def _poner(self, doc_id: str, entrada: Optional[tuple[str, date]]) -> None:
+        # Varias peticiones pueden dar el mismo (uid, fecha): se cuentan para no
+        # quitar el día libre al borrar sólo una de ellas.
+        anterior = self._docs.pop(doc_id, None)
+        if anterior is not None:
+            uid, fecha = anterior
+            self._restar(self._por_fecha, fecha, uid)
+            self._restar(self._por_uid, uid, fecha)
+        if entrada is not None:
+            uid, fecha = entrada
+            self._docs[doc_id] = entrada
+            cuenta = self._por_fecha.setdefault(fecha, {})
+            cuenta[uid] = cuenta.get(uid, 0) + 1
+            cuenta = self._por_uid.setdefault(uid, {})
+            cuenta[fecha] = cuenta.get(fecha, 0) + 1
+
+    @staticmethod
+    def _restar(indice: dict, clave, valor) -> None:
+        cuenta = indice.get(clave)
+        if not cuenta or valor not in cuenta:
+            return
+        cuenta[valor] -= 1
+        if cuenta[valor] <= 0:
+            del cuenta[valor]
+        if not cuenta:
+            del indice[clave]
+
+    def detener(self) -> None:
+        if self._watch is not None:
+            try:
+                self._watch.unsubscribe()
+            except Exception:
+                logger.exception("Error cancelando el listener del índice de días libres")
+            self._watch = None
+
+    # --- consultas ---
+    def _cubre(self, desde: date) -> bool:
+        if self._watch is None and not self._listo.is_set():
+            self.iniciar()
+        if self._watch is None:
+            return False
+        return desde >= self.desde and self._listo.wait(ESPERA_CARGA)
+
+    def _consultar(self, desde: date, hasta: date) -> list[tuple[str, date]]:
+        docs = (
+            self.db.collection(self.coleccion)
+            .where("Fecha", ">=", _inicio_dia_utc(desde))
+            .where("Fecha", "<=", _fin_dia_utc(hasta))
+            .stream()
+        )
+        entradas = []
+        for doc in docs:
+            entrada = _entrada(doc.to_dict())
+            if entrada is not None and desde <= entrada[1] <= hasta:
+                entradas.append(entrada)
+        return entradas
+
+    def libres_en(self, fecha: date, uids: Optional[Iterable[str]] = None) -> set[str]:
+        """uids con día libre admitido en `fecha` (limitado a `uids` si se indica)."""
+        if self._cubre(fecha):
+            with self._lock:
+                libres = set(self._por_fecha.get(fecha, ()))
+        else:
+            libres = {uid for uid, _ in self._consultar(fecha, fecha)}
+        if uids is not None:
+            libres &= {str(u) for u in uids}
+        return libres
+
+    def proximos(self, desde: date, hasta: date) -> dict[str, list[date]]:
+        """{uid: [fechas ordenadas]} con los días libres admitidos entre `desde` y `hasta`."""
+        por_uid: dict[str, set[date]] = {}
+        if self._cubre(desde):
+            with self._lock:
+                dia = desde
+                while dia <= hasta:
+                    for uid in self._por_fecha.get(dia, ()):
+                        por_uid.setdefault(uid, set()).add(dia)
+                    dia += timedelta(days=1)
+        else:
+            for uid, fecha in self._consultar(desde, hasta):
+                por_uid.setdefault(uid, set()).add(fecha)
+        return {uid: sorted(fechas) for uid, fechas in por_uid.items()}
+
+    def dias_de(self, uid: str, desde: Optional[date] = None) -> list[date]:
+        """Días libres admitidos de un usuario, desde `desde` si se indica."""
+        desde = desde or self.desde
+        if self._cubre(desde):
+            with self._lock:
+                fechas = list(self._por_uid.get(str(uid), ()))
+            return sorted(f for f in fechas if f >= desde)
+        hasta = dt.datetime.now().date() + timedelta(days=366)
+        return sorted(f for u, f in self._consultar(desde, hasta) if u == str(uid))
+
+
+_indice: Optional[IndiceDiasLibres] = None
+_indice_lock = threading.Lock()
+
+
+def get_indice_dias_libres(db) -> IndiceDiasLibres:
+    """Índice compartido por Generar mensajes y Gestión de usuarios."""
+    global _indice
+    if _indice is None:
+        with _indice_lock:
+            if _indice is None:
+                _indice = IndiceDiasLibres(db)
+                _indice.iniciar()
+    return _indice
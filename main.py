@@ -10,21 +10,29 @@ from thread_utils import run_bg
 logger = logging.getLogger(__name__)
 import firebase_admin
 from firebase_admin import credentials, firestore
-import pandas as pd
 import datetime
 import os
 import json
-import requests
+import threading
 import time
-from dateutil import parser
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from PIL import Image, ImageTk
-from google.auth.transport.requests import Request
-from google.oauth2 import service_account
-from GestionUsuarios import abrir_gestion_usuarios
+from GestionUsuarios import abrir_gestion_usuarios, on_mensajes_generados
 from GestionMensajes import abrir_gestion_mensajes
-from GenerarMensajes import abrir_generar_mensajes
-from notificaciones_push import NOTI_DB
-from utils_mensajes import build_mensaje_id, reenviar_mensaje
+from GenerarMensajes import abrir_generar_mensajes, reanudar_campania as reanudar_campania_generar
+from campanias_programadas import get_almacen_programadas, get_programador_campanias
+from catalogo_plantillas import get_catalogo_plantillas
+from exportacion import FORMATO_CSV, FORMATO_XLSX, exportar_colecciones
+from importacion_excel import MAX_BORRADOS_SIN_CONFIRMAR, aplicar_diff, calcular_diff, leer_excel
+from diario_campanias import FASE_CREACION, ORIGEN_TODOS, DiarioCampania, campanias_pendientes
+from registro_notificados import get_registro_notificados
+from directorio_tokens import get_directorio_tokens
+from indice_dias_libres import get_indice_dias_libres
+from outbox_push import get_outbox, iniciar_programador_reintentos
+from utils_mensajes import build_mensaje_id, reenviar_mensajes
+from token_oauth import get_proveedor_token
+from cliente_fcm import FCM_URL, enviar_mensaje, get_cliente_fcm
 import re
 from decimal import Decimal
 from typing import List, Optional, Tuple
@@ -72,14 +80,20 @@ def _is_valid_fcm_token(token: Optional[str]) -> bool:
     return bool(_FCM_TOKEN_RE.match(token))
 
 
+LIMITE_RECIENTES_ESTADO = 200  # mensajes recientes revisados por si no tienen `estado`
+TAM_GET_ALL_ESTADO = 300
+INTERVALO_VIVO_MS = 300  # agrupa los cambios en vivo en como mucho ~3 repintados/s
+
+
 # 🔧 Configuración inicial
 credenciales_dinamicas = {"ruta": "sansebassms.json"}
 project_info = {"id": None}
 carpeta_excel = {"ruta": None}
-archivo_notificados = NOTI_DB
 
 ventana: Optional[tk.Misc] = None
 estado: Optional[tk.StringVar] = None
+csv_var: Optional[tk.BooleanVar] = None
+incremental_var: Optional[tk.BooleanVar] = None
 
 
 def _get_root() -> Optional[tk.Misc]:
@@ -98,30 +112,21 @@ def _set_estado_async(texto: str) -> None:
     root_ref.after(0, lambda: estado.set(texto))
 
 
-def _leer_notificados_local() -> list[str]:
-    if not os.path.exists(archivo_notificados):
-        return []
+def _leer_notificados_local(ids: list[str]) -> set[str]:
+    """Devuelve el subconjunto de `ids` ya registrados como notificados."""
     try:
-        with open(archivo_notificados, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        if isinstance(data, dict):
-            ids = data.get("ids", [])
-        elif isinstance(data, list):
-            ids = data
-        else:
-            ids = []
-        return [str(i) for i in ids if i]
+        registro = get_registro_notificados()
+        return {i for i in ids if registro.contiene(i)}
     except Exception:
-        logger.exception("No se pudo leer %s", archivo_notificados)
-        return []
+        logger.exception("No se pudo leer el registro de notificados")
+        return set()
 
 
 def _guardar_notificados_local(ids: list[str]) -> None:
     try:
-        with open(archivo_notificados, "w", encoding="utf-8") as f:
-            json.dump({"ids": sorted(set(ids))}, f, ensure_ascii=False, indent=2)
+        get_registro_notificados().agregar_varios(ids)
     except Exception:
-        logger.exception("No se pudo guardar %s", archivo_notificados)
+        logger.exception("No se pudo guardar el registro de notificados")
 
 
 def with_retry(fn, tries: int = 3, base: float = 0.5, cap: float = 5.0):
@@ -185,29 +190,6 @@ def _paged_query(
     return list(query.limit(page_size).stream(timeout=timeout))
 
 
-def get_doc_safe(doc_ref):
-    try:
-        doc = doc_ref.get()
-    except Exception as exc:
-        logger.exception("Error al obtener documento %s", getattr(doc_ref, "id", doc_ref))
-        return None
-    if not getattr(doc, "exists", False):
-        return None
-    try:
-        return doc.to_dict() or {}
-    except Exception as exc:
-        logger.exception("Error al convertir documento %s a dict", getattr(doc, "id", doc_ref))
-        return None
-
-
-def iter_collection_safe(col_ref):
-    try:
-        for doc in col_ref.stream():
-            yield doc
-    except Exception:
-        logger.exception("Error al iterar colección %s", getattr(col_ref, "id", col_ref))
-
-
 def enviar_fcm(uid: str, token: Optional[str], token_oauth: str, *, notification: dict, data: Optional[dict] = None) -> bool:
     if not _is_valid_fcm_token(token):
         logger.warning("Token FCM inválido para %s, se omite", uid)
@@ -217,14 +199,10 @@ def enviar_fcm(uid: str, token: Optional[str], token_oauth: str, *, notification
     if data:
         payload["message"]["data"] = data
 
-    headers = {
-        "Authorization": f"Bearer {token_oauth}",
-        "Content-Type": "application/json",
-    }
+    url = FCM_URL.format(project_id=project_info["id"])
 
-    url = f"https://fcm.googleapis.com/v1/projects/{project_info['id']}/messages:send"
     try:
-        response = requests.post(url, headers=headers, json=payload, timeout=30)
+        response = enviar_mensaje(url, token_oauth, payload)
     except Exception:
         logger.exception("Error enviando notificación a %s", uid)
         return False
@@ -233,9 +211,46 @@ def enviar_fcm(uid: str, token: Optional[str], token_oauth: str, *, notification
         logger.info("Notificación enviada a %s", uid)
         return True
 
+    if response.status_code == 401:
+        get_proveedor_token(credenciales_dinamicas["ruta"]).invalidar()
     logger.error("Error al enviar a %s: %s", uid, response.text)
     return False
 
+
+def enviar_fcm_lote(items: list[tuple[str, Optional[str], dict, Optional[dict]]], token_oauth: str) -> list[dict]:
+    """Envía varias notificaciones (uid, token, notification, data) en paralelo sobre el pool HTTP.
+
+    Devuelve un resultado por elemento con `uid`, `token`, `ok`, `status` y `error`.
+    """
+    resultados: list[dict] = []
+    payloads: list[dict] = []
+    for uid, token, notification, data in items:
+        if not _is_valid_fcm_token(token):
+            logger.warning("Token FCM inválido para %s, se omite", uid)
+            continue
+        payload = {"message": {"token": token, "notification": notification}}
+        if data:
+            payload["message"]["data"] = data
+        payloads.append(payload)
+
+    por_token = (
+        get_cliente_fcm().enviar_lote(FCM_URL.format(project_id=project_info["id"]), token_oauth, payloads)
+        if payloads
+        else {}
+    )
+    if any(r["status"] == 401 for r in por_token.values()):
+        get_proveedor_token(credenciales_dinamicas["ruta"]).invalidar()
+    for uid, token, _notification, _data in items:
+        resultado = por_token.get(token) if _is_valid_fcm_token(token) else None
+        if resultado is None:
+            resultado = {"ok": False, "status": None, "error": "Token FCM inválido"}
+        resultados.append({"uid": uid, "token": token, **resultado})
+
+    enviados = sum(1 for r in resultados if r["ok"])
+    logger.info("Lote FCM: %s/%s notificaciones enviadas", enviados, len(items))
+    return resultados
+
+
 # Inicializar Firebase
 try:
     if not os.path.exists(credenciales_dinamicas["ruta"]):
@@ -273,6 +288,31 @@ except Exception as exc:
     root_dialog.destroy()
     raise SystemExit(1)
 
+try:
+    get_directorio_tokens(db)
+except Exception:
+    logger.exception("No se pudo iniciar el directorio de tokens")
+
+try:
+    get_catalogo_plantillas(db)
+except Exception:
+    logger.exception("No se pudo iniciar el catálogo de plantillas")
+
+try:
+    get_indice_dias_libres(db)
+except Exception:
+    logger.exception("No se pudo iniciar el índice de días libres")
+
+try:
+    iniciar_programador_reintentos(db)
+except Exception:
+    logger.exception("No se pudo iniciar el reintento automático de pushes")
+
+try:
+    get_programador_campanias(db)
+except Exception:
+    logger.exception("No se pudo iniciar el temporizador de campañas programadas")
+
 
 def abrir_gestion_peticiones(db):
     from GestionPeticiones import abrir_gestion_peticiones as abrir
@@ -292,12 +332,7 @@ def abrir_informes():
 
 def obtener_token_oauth():
     try:
-        creds = service_account.Credentials.from_service_account_file(
-            credenciales_dinamicas["ruta"],
-            scopes=["https://www.googleapis.com/auth/firebase.messaging"]
-        )
-        creds.refresh(Request())
-        return creds.token
+        return get_proveedor_token(credenciales_dinamicas["ruta"]).obtener()
     except Exception as exc:
         logger.exception("No se pudo obtener el token de acceso")
         raise RuntimeError(f"No se pudo obtener el token de acceso: {exc}") from exc
@@ -328,6 +363,13 @@ def abrir_estado_notificaciones():
     btn_refrescar = ttk.Button(filtro_frame, text="Refrescar")
     btn_refrescar.grid(row=0, column=2, padx=(12, 0), pady=2)
 
+    vivo_var = tk.BooleanVar(value=False)
+    chk_vivo = ttk.Checkbutton(filtro_frame, text="En vivo", variable=vivo_var)
+    chk_vivo.grid(row=0, column=3, padx=(12, 0), pady=2)
+
+    btn_descartados = ttk.Button(filtro_frame, text="Pushes descartados")
+    btn_descartados.grid(row=0, column=4, padx=(12, 0), pady=2)
+
     pendiente_frame = ttk.LabelFrame(top, text="Pendientes de enviar", padding=10)
     pendiente_frame.pack(fill="both", expand=True, padx=10, pady=(10, 5))
 
@@ -556,72 +598,85 @@ def abrir_estado_notificaciones():
         push_fallidos = _safe_str(doc_data.get("pushFallidos"))
         return base + (push_error, push_enviados, push_fallidos)
 
+    def _consultas(fecha_desde_utc: Optional[datetime.datetime]) -> dict:
+        """Consultas de Mensajes que alimentan las dos tablas, por nombre."""
+        mensajes = db.collection("Mensajes")
+
+        def _desde(query):
+            if fecha_desde_utc is not None:
+                query = query.where(filter=FieldFilter("fechaHora", ">=", fecha_desde_utc))
+            return query
+
+        # Los documentos sin campo `estado` no aparecen en ninguna igualdad: se miran
+        # sólo entre los más recientes (consulta acotada sobre el índice de fechaHora).
+        consultas = {
+            "pendiente": _desde(mensajes.where(filter=FieldFilter("estado", "==", "Pendiente"))),
+            "nulo": _desde(mensajes.where(filter=FieldFilter("estado", "==", None))),
+            "recientes": _desde(mensajes)
+            .order_by("fechaHora", direction=firestore.Query.DESCENDING)
+            .limit(LIMITE_RECIENTES_ESTADO),
+            "incidencias": _desde(
+                mensajes.where(filter=FieldFilter("pushEstado", "in", ["ErrorPush", "Parcial", "SinToken"]))
+            ),
+        }
+        return consultas
+
+    def _es_pendiente(nombre: str, data: dict) -> bool:
+        if nombre == "recientes" and data.get("estado") not in (None, "", "Pendiente"):
+            return False
+        return nombre != "incidencias"
+
     def _consultar(fecha_desde_utc: Optional[datetime.datetime]):
-        pendientes: list[tuple[str, dict]] = []
-        incidencias: list[tuple[str, dict]] = []
-        vistos: set[str] = set()
+        """Lanza las cuatro consultas en paralelo; devuelve (pendientes, incidencias, lecturas)."""
+        consultas = _consultas(fecha_desde_utc)
+        opcionales = {"nulo", "recientes"}
 
-        query_pend = db.collection("Mensajes").where(filter=FieldFilter("estado", "==", "Pendiente"))
-        if fecha_desde_utc is not None:
-            query_pend = query_pend.where(filter=FieldFilter("fechaHora", ">=", fecha_desde_utc))
-        snapshot_pend = with_retry(lambda: list(query_pend.stream()))
-        for doc in snapshot_pend:
-            data = doc.to_dict() or {}
-            pendientes.append((doc.id, data))
-            vistos.add(doc.id)
+        def _ejecutar(nombre: str) -> list:
+            try:
+                return with_retry(lambda: list(consultas[nombre].stream()))
+            except Exception:
+                if nombre not in opcionales:
+                    raise
+                logger.exception("No se pudo ejecutar la consulta '%s' de Estado notificaciones", nombre)
+                return []
 
-        try:
-            query_null = db.collection("Mensajes").where(filter=FieldFilter("estado", "==", None))
-            if fecha_desde_utc is not None:
-                query_null = query_null.where(filter=FieldFilter("fechaHora", ">=", fecha_desde_utc))
-            snapshot_null = with_retry(lambda: list(query_null.stream()))
-        except Exception:
-            logger.exception("No se pudo consultar mensajes con estado nulo")
-            snapshot_null = []
-        for doc in snapshot_null:
-            if doc.id in vistos:
-                continue
-            data = doc.to_dict() or {}
-            pendientes.append((doc.id, data))
-            vistos.add(doc.id)
+        with ThreadPoolExecutor(max_workers=len(consultas), thread_name_prefix="estado_notif") as pool:
+            futuros = {nombre: pool.submit(_ejecutar, nombre) for nombre in consultas}
+            resultados = {nombre: futuro.result() for nombre, futuro in futuros.items()}
+        lecturas = sum(len(docs) for docs in resultados.values())
 
-        try:
-            if fecha_desde_utc is not None:
-                extra_query = (
-                    db.collection("Mensajes")
-                    .where(filter=FieldFilter("fechaHora", ">=", fecha_desde_utc))
-                    .order_by("fechaHora")
-                )
-            else:
-                extra_query = (
-                    db.collection("Mensajes")
-                    .order_by("fechaHora", direction=firestore.Query.DESCENDING)
-                    .limit(200)
-                )
-            extra_docs = with_retry(lambda: list(extra_query.stream()))
-        except Exception:
-            logger.exception("No se pudo obtener mensajes adicionales para pendientes")
-            extra_docs = []
-        for doc in extra_docs:
-            if doc.id in vistos:
-                continue
-            data = doc.to_dict() or {}
-            estado_val = data.get("estado")
-            if estado_val in (None, "", "Pendiente"):
+        pendientes: list[tuple[str, dict]] = []
+        vistos: set[str] = set()
+        for nombre in ("pendiente", "nulo", "recientes"):
+            for doc in resultados[nombre]:
+                if doc.id in vistos:
+                    continue
+                data = doc.to_dict() or {}
+                if not _es_pendiente(nombre, data):
+                    continue
                 pendientes.append((doc.id, data))
                 vistos.add(doc.id)
-
-        query_inc = db.collection("Mensajes").where(
-            filter=FieldFilter("pushEstado", "in", ["ErrorPush", "Parcial", "SinToken"])
-        )
-        if fecha_desde_utc is not None:
-            query_inc = query_inc.where(filter=FieldFilter("fechaHora", ">=", fecha_desde_utc))
-        snapshot_inc = with_retry(lambda: list(query_inc.stream()))
-        for doc in snapshot_inc:
-            data = doc.to_dict() or {}
-            incidencias.append((doc.id, data))
-
-        return pendientes, incidencias
+        incidencias = [(doc.id, doc.to_dict() or {}) for doc in resultados["incidencias"]]
+        return pendientes, incidencias, lecturas
+
+    def _usuarios(uids: set[str]) -> dict[str, dict]:
+        """Datos de `UsuariosAutorizados` para `uids` en lecturas `get_all` agrupadas."""
+        col = db.collection("UsuariosAutorizados")
+        orden = sorted(u for u in uids if u)
+        usuarios: dict[str, dict] = {}
+        for i in range(0, len(orden), TAM_GET_ALL_ESTADO):
+            refs = [col.document(uid) for uid in orden[i:i + TAM_GET_ALL_ESTADO]]
+            try:
+                snaps = with_retry(
+                    lambda: list(db.get_all(refs, field_paths=["Nombre", "Telefono", "telefono"]))
+                )
+            except Exception:
+                logger.exception("No se pudieron leer %s usuarios para Estado notificaciones", len(refs))
+                continue
+            for snap in snaps:
+                if getattr(snap, "exists", False):
+                    usuarios[snap.id] = snap.to_dict() or {}
+        return usuarios
 
     def refrescar():
         try:
@@ -635,8 +690,11 @@ def abrir_estado_notificaciones():
         incid_total_var.set("Total: …")
 
         def worker():
+            t0 = time.monotonic()
             try:
-                pendientes, incidencias = _consultar(fecha_desde_utc)
+                pendientes, incidencias, lecturas = _consultar(fecha_desde_utc)
+                uids = {_safe_str(data.get("uid")) for _, data in (*pendientes, *incidencias)}
+                usuarios = _usuarios(uids)
             except Exception as exc:
                 logger.exception("No se pudo cargar el estado de notificaciones")
 
@@ -647,16 +705,17 @@ def abrir_estado_notificaciones():
                 top.after(0, _error)
                 return
 
-            uid_cache: dict[str, dict] = {}
+            lecturas += len(usuarios)
+            logger.info(
+                "Estado notificaciones: %s pendientes, %s incidencias, %s documentos leídos en %.2f s",
+                len(pendientes),
+                len(incidencias),
+                lecturas,
+                time.monotonic() - t0,
+            )
 
             def _usuario(uid: str) -> dict:
-                if not uid:
-                    return {}
-                if uid not in uid_cache:
-                    uid_cache[uid] = get_doc_safe(
-                        db.collection("UsuariosAutorizados").document(uid)
-                    ) or {}
-                return uid_cache[uid]
+                return usuarios.get(uid, {}) if uid else {}
 
             pend_rows: list[dict] = []
             for doc_id, data in pendientes:
@@ -673,6 +732,8 @@ def abrir_estado_notificaciones():
                 inc_rows.append({"doc_id": doc_id, "doc": data, "usuario": usuario, "values": valores})
 
             def _actualizar():
+                if vivo["watches"]:
+                    return  # el modo en vivo ya gestiona las tablas
                 btn_refrescar.config(state="normal")
 
                 for tree in (tree_pend, tree_inc):
@@ -696,8 +757,176 @@ def abrir_estado_notificaciones():
 
         run_bg(worker, _thread_name="estado_notificaciones_refresh")
 
+    # --- modo en vivo: listeners sobre las mismas consultas, cambios agrupados ---
+    vivo = {
+        "watches": [],
+        "docs": {},  # {consulta: {doc_id: data}}
+        "usuarios": {},
+        "sucios": set(),
+        "programado": False,
+    }
+    vivo_lock = threading.Lock()
+
+    def _fila(doc_id: str, data: dict, include_push: bool) -> dict:
+        usuario = vivo["usuarios"].get(_safe_str(data.get("uid")), {})
+        valores = _datos_para_tabla(doc_id, data, usuario, include_push=include_push)
+        return {"doc_id": doc_id, "doc": data, "usuario": usuario, "values": valores}
+
+    def _aplicar_fila(tree: ttk.Treeview, data_map: dict, doc_id: str, fila: Optional[dict]) -> None:
+        if fila is None:
+            data_map.pop(doc_id, None)
+            if tree.exists(doc_id):
+                tree.delete(doc_id)
+            return
+        data_map[doc_id] = fila
+        if tree.exists(doc_id):
+            tree.item(doc_id, values=fila["values"])
+        else:
+            tree.insert("", "end", iid=doc_id, values=fila["values"])
+
+    def _volcar_cambios() -> None:
+        with vivo_lock:
+            sucios = vivo["sucios"]
+            vivo["sucios"] = set()
+            vivo["programado"] = False
+            docs = {nombre: dict(por_id) for nombre, por_id in vivo["docs"].items()}
+        if not vivo["watches"] or not top.winfo_exists():
+            return
+        for doc_id in sucios:
+            pendiente = None
+            for nombre in ("pendiente", "nulo", "recientes"):
+                data = docs.get(nombre, {}).get(doc_id)
+                if data is not None and _es_pendiente(nombre, data) and not _safe_str(data.get("pushEstado")):
+                    pendiente = _fila(doc_id, data, include_push=False)
+                    break
+            _aplicar_fila(tree_pend, pend_data, doc_id, pendiente)
+            incidencia = docs.get("incidencias", {}).get(doc_id)
+            _aplicar_fila(
+                tree_inc,
+                inc_data,
+                doc_id,
+                _fila(doc_id, incidencia, include_push=True) if incidencia is not None else None,
+            )
+        pend_total_var.set(f"Total: {len(pend_data)}")
+        incid_total_var.set(f"Total: {len(inc_data)}")
+        _actualizar_botones()
+
+    def _on_snapshot(nombre: str, docs, changes, read_time) -> None:
+        nuevos: dict[str, dict] = {}
+        borrados: list[str] = []
+        for change in changes:
+            doc = change.document
+            if getattr(change.type, "name", "") == "REMOVED":
+                borrados.append(doc.id)
+            else:
+                nuevos[doc.id] = doc.to_dict() or {}
+        uids = {_safe_str(data.get("uid")) for data in nuevos.values()} - set(vivo["usuarios"]) - {""}
+        if uids:
+            usuarios = _usuarios(uids)
+            with vivo_lock:
+                vivo["usuarios"].update(usuarios)
+                vivo["usuarios"].update({uid: {} for uid in uids - set(usuarios)})
+        with vivo_lock:
+            por_id = vivo["docs"].setdefault(nombre, {})
+            por_id.update(nuevos)
+            for doc_id in borrados:
+                por_id.pop(doc_id, None)
+            vivo["sucios"].update(nuevos)
+            vivo["sucios"].update(borrados)
+            if vivo["programado"]:
+                return
+            vivo["programado"] = True
+        try:
+            top.after(INTERVALO_VIVO_MS, _volcar_cambios)
+        except Exception:
+            logger.debug("Ventana de Estado notificaciones cerrada; se descarta el cambio")
+
+    def _detener_vivo() -> None:
+        for watch in vivo["watches"]:
+            try:
+                watch.unsubscribe()
+            except Exception:
+                logger.exception("Error cancelando un listener de Estado notificaciones")
+        with vivo_lock:
+            vivo["watches"] = []
+            vivo["docs"] = {}
+            vivo["sucios"] = set()
+
+    def _iniciar_vivo() -> bool:
+        try:
+            fecha_desde_utc = _parse_fecha_desde()
+        except ValueError as exc:
+            messagebox.showerror("Fecha", str(exc), parent=top)
+            return False
+        for tree in (tree_pend, tree_inc):
+            tree.delete(*tree.get_children())
+        pend_data.clear()
+        inc_data.clear()
+        try:
+            for nombre, query in _consultas(fecha_desde_utc).items():
+                vivo["watches"].append(query.on_snapshot(partial(_on_snapshot, nombre)))
+        except Exception as exc:
+            logger.exception("No se pudo activar el modo en vivo de Estado notificaciones")
+            _detener_vivo()
+            error(root, "Estado notificaciones", f"No se pudo activar el modo en vivo: {exc}")
+            return False
+        logger.info("Estado notificaciones en vivo: %s listeners activos", len(vivo["watches"]))
+        return True
+
+    def _toggle_vivo() -> None:
+        if vivo_var.get():
+            if _iniciar_vivo():
+                btn_refrescar.config(state="disabled")
+            else:
+                vivo_var.set(False)
+            return
+        _detener_vivo()
+        btn_refrescar.config(state="normal")
+        refrescar()
+
+    def _cerrar() -> None:
+        _detener_vivo()
+        top.destroy()
+
+    def _ver_descartados() -> None:
+        """Pushes que agotaron los reintentos automáticos de la bandeja local."""
+        outbox = get_outbox()
+        ventana_muertos = tk.Toplevel(top)
+        ventana_muertos.title("Pushes descartados")
+        ventana_muertos.geometry("760x360")
+        ventana_muertos.transient(top)
+        columnas = ("mensaje_id", "intentos", "error", "actualizado")
+        tree_muertos = ttk.Treeview(ventana_muertos, columns=columnas, show="headings", selectmode="extended")
+        for col, texto, ancho in zip(
+            columnas, ("MensajeID", "Intentos", "Último error", "Descartado"), (260, 70, 260, 140)
+        ):
+            tree_muertos.heading(col, text=texto)
+            tree_muertos.column(col, width=ancho, stretch=col in {"mensaje_id", "error"})
+        tree_muertos.pack(fill="both", expand=True, padx=10, pady=(10, 4))
+
+        def _cargar() -> None:
+            tree_muertos.delete(*tree_muertos.get_children())
+            for mensaje_id, intentos, ultimo_error, actualizado in outbox.muertos():
+                cuando = datetime.datetime.fromtimestamp(actualizado).strftime("%Y-%m-%d %H:%M")
+                tree_muertos.insert(
+                    "", "end", iid=mensaje_id, values=(mensaje_id, intentos, ultimo_error or "", cuando)
+                )
+
+        def _quitar() -> None:
+            seleccion = tree_muertos.selection()
+            if not seleccion:
+                return
+            for mensaje_id in seleccion:
+                outbox.eliminar(mensaje_id)
+            _cargar()
+
+        pie = ttk.Frame(ventana_muertos)
+        pie.pack(fill="x", padx=10, pady=(0, 10))
+        ttk.Button(pie, text="Quitar de la bandeja", command=_quitar).pack(side="right")
+        _cargar()
+
     def _toggle_operaciones(state: str):
-        btn_refrescar.config(state=state)
+        btn_refrescar.config(state="disabled" if vivo["watches"] else state)
         btn_reintentar_pend.config(state=state)
         btn_reintentar_inc.config(state=state)
 
@@ -708,20 +937,47 @@ def abrir_estado_notificaciones():
             return
 
         _toggle_operaciones("disabled")
+        columna_push = "push_estado"
+
+        def _mostrar_resultado(doc_id: str, resultado) -> None:
+            if isinstance(resultado, Exception):
+                texto = "❌ Error"
+            elif int(resultado.get("enviados", 0)):
+                texto = "✅ Enviado"
+            elif int(resultado.get("fallidos", 0)):
+                texto = "❌ Fallido"
+            else:
+                texto = "= Duplicado"
+            try:
+                if tree_widget.exists(doc_id):
+                    tree_widget.set(doc_id, columna_push, texto)
+            except tk.TclError:
+                pass  # ventana cerrada mientras se reintentaba
 
         def worker():
             total_env = total_fall = dedupe = 0
             errores_locales: list[str] = []
 
+            try:
+                por_id = reenviar_mensajes(
+                    db,
+                    seleccion,
+                    force=True,
+                    on_resultado=lambda doc_id, res: top.after(0, lambda: _mostrar_resultado(doc_id, res)),
+                    on_progreso=lambda p: _set_estado_async(
+                        f"🔁 Reintentando {p['procesados']}/{p['total']} ({p['por_segundo']:.1f}/s)"
+                    ),
+                )
+            except Exception as exc:
+                logger.exception("No se pudo preparar el reintento de %s mensajes", len(seleccion))
+                errores_locales.append(str(exc))
+                por_id = {}
             for doc_id in seleccion:
-                try:
-                    resultado = reenviar_mensaje(db, doc_id, force=True)
-                except ValueError as exc:
-                    errores_locales.append(f"{doc_id}: {exc}")
+                resultado = por_id.get(doc_id)
+                if resultado is None:
                     continue
-                except Exception as exc:
-                    logger.exception("No se pudo reenviar el mensaje %s", doc_id)
-                    errores_locales.append(f"{doc_id}: {exc}")
+                if isinstance(resultado, Exception):
+                    errores_locales.append(f"{doc_id}: {resultado}")
                     continue
                 env = int(resultado.get("enviados", 0))
                 fall = int(resultado.get("fallidos", 0))
@@ -749,7 +1005,8 @@ def abrir_estado_notificaciones():
                     info(root, "Reintentar", f"✅ {texto}")
                 else:
                     info(root, "Reintentar", texto)
-                refrescar()
+                if not vivo["watches"]:
+                    refrescar()
 
             top.after(0, _fin)
 
@@ -762,6 +1019,9 @@ def abrir_estado_notificaciones():
         _exportar_csv("notificaciones_incidencias", inc_data, incid_headers)
 
     btn_refrescar.config(command=refrescar)
+    chk_vivo.config(command=_toggle_vivo)
+    btn_descartados.config(command=_ver_descartados)
+    top.protocol("WM_DELETE_WINDOW", _cerrar)
     btn_export_pend.config(command=exportar_pendientes)
     btn_export_inc.config(command=exportar_incidencias)
     btn_reintentar_pend.config(command=lambda: _reintentar_desde(tree_pend))
@@ -785,15 +1045,28 @@ def crear_mensajes_para_todos():
     )
 
 
-def _crear_mensajes_para_todos_bg(mensaje: str) -> None:
+def _crear_mensajes_para_todos_bg(mensaje: Optional[str] = None, diario: Optional[DiarioCampania] = None) -> None:
+    """Crea un mensaje por usuario con `Mensaje = true`, anotando el avance en un diario.
+
+    Con `diario` se reanuda: mismo instante (mismos ids), desde la última página
+    confirmada y saltando los uids ya creados.
+    """
     root = _get_root()
     try:
         usuarios_col = db.collection("UsuariosAutorizados")
         mensajes_col = db.collection("Mensajes")
 
-        total_creados = 0
+        if diario is None:
+            ahora = datetime.datetime.now(datetime.timezone.utc)
+            diario = DiarioCampania.crear(ORIGEN_TODOS, {"mensaje": mensaje}, ahora)
+        else:
+            mensaje = diario.parametros.get("mensaje") or ""
+            ahora = diario.ahora_utc
+        local_now = ahora.astimezone()
+
+        total_creados = len(diario.hechos[FASE_CREACION])
         pagina_actual = 0
-        ultimo_doc = None
+        ultimo_doc = {"__name__": diario.cursor} if diario.cursor else None
 
         while True:
             pagina = _paged_query(
@@ -805,6 +1078,7 @@ def _crear_mensajes_para_todos_bg(mensaje: str) -> None:
 
             if not pagina:
                 if pagina_actual == 0 and total_creados == 0:
+                    diario.terminar({"creados": 0})
                     info(root, "Sin usuarios", "No hay usuarios con 'Mensaje = true'.")
                     return
                 break
@@ -815,16 +1089,16 @@ def _crear_mensajes_para_todos_bg(mensaje: str) -> None:
             )
 
             batch = db.batch()
-            batch_count = 0
+            batch_uids: list[str] = []
 
             for usuario in pagina:
                 uid = usuario.id
+                if diario.hecho(FASE_CREACION, uid):
+                    continue
                 data = usuario.to_dict() or {}
                 telefono = data.get("Telefono", "")
 
-                ahora = datetime.datetime.now(datetime.timezone.utc)
                 doc_id = build_mensaje_id(uid, ahora)
-                local_now = ahora.astimezone()
                 doc = {
                     "estado": "Pendiente",
                     "fechaHora": ahora,
@@ -836,33 +1110,152 @@ def _crear_mensajes_para_todos_bg(mensaje: str) -> None:
                 }
 
                 batch.set(mensajes_col.document(doc_id), doc, timeout=30.0)
-                batch_count += 1
+                batch_uids.append(uid)
 
-                if batch_count >= 100:
+                if len(batch_uids) >= 100:
                     _set_estado_async(
-                        f"⬆️ Confirmando lote página {pagina_actual} (total: {total_creados + batch_count})"
+                        f"⬆️ Confirmando lote página {pagina_actual} (total: {total_creados + len(batch_uids)})"
                     )
                     _commit_with_retry(batch)
-                    total_creados += batch_count
+                    diario.marcar(FASE_CREACION, batch_uids)
+                    total_creados += len(batch_uids)
                     batch = db.batch()
-                    batch_count = 0
+                    batch_uids = []
 
-            if batch_count:
+            if batch_uids:
                 _set_estado_async(
-                    f"⬆️ Confirmando lote final página {pagina_actual} (total: {total_creados + batch_count})"
+                    f"⬆️ Confirmando lote final página {pagina_actual} (total: {total_creados + len(batch_uids)})"
                 )
                 _commit_with_retry(batch)
-                total_creados += batch_count
+                diario.marcar(FASE_CREACION, batch_uids)
+                total_creados += len(batch_uids)
 
             ultimo_doc = pagina[-1]
+            diario.guardar_cursor(ultimo_doc.id)
 
+        diario.terminar({"creados": total_creados})
         _set_estado_async(f"✅ Mensajes creados: {total_creados}")
         info(root, "Éxito", f"✅ Se han creado mensajes para {total_creados} usuarios.")
         logger.info("Se crearon %s mensajes pendientes", total_creados)
     except Exception as exc:  # pragma: no cover - logging side effect
         logger.exception("No se pudieron crear los mensajes automáticos")
         _set_estado_async("❌ Error al crear mensajes.")
-        error(root, "Error", f"No se pudieron crear los mensajes: {exc}")
+        error(
+            root,
+            "Error",
+            f"No se pudieron crear los mensajes: {exc}\n\nPuede continuar con «Reanudar campaña».",
+        )
+
+
+def _reanudar_generar_bg(diario: DiarioCampania) -> None:
+    root = _get_root()
+    try:
+        resumen = reanudar_campania_generar(
+            db,
+            diario,
+            on_progreso=lambda p: _set_estado_async(
+                f"⏯ Reanudando campaña ({p.get('fase')}): {p['procesados']}/{p['total']}"
+            ),
+        )
+        if resumen["uids"]:
+            on_mensajes_generados(resumen["uids"], db)
+        _set_estado_async("✅ Campaña reanudada.")
+        info(
+            root,
+            "Campaña reanudada",
+            f"Mensajes creados: {resumen['creados']} (ya existían {resumen['existentes']}). "
+            f"Notificaciones: {resumen['enviados']} enviadas, {resumen['fallidos']} fallidas.",
+        )
+    except Exception as exc:
+        logger.exception("No se pudo reanudar la campaña %s", diario.id)
+        _set_estado_async("❌ Error al reanudar la campaña.")
+        error(root, "Error", f"No se pudo reanudar la campaña: {exc}")
+
+
+def reanudar_campania():
+    """Lista las campañas interrumpidas y continúa la elegida desde su último punto de control."""
+    pendientes = campanias_pendientes()
+    if not pendientes:
+        messagebox.showinfo("Reanudar campaña", "No hay campañas interrumpidas.", parent=ventana)
+        return
+
+    top = tk.Toplevel(ventana)
+    top.title("Reanudar campaña")
+    top.transient(ventana)
+    top.grab_set()
+    ttk.Label(top, text="Campañas interrumpidas:").pack(padx=12, pady=(12, 6), anchor="w")
+    lst = tk.Listbox(top, width=90, height=min(10, max(3, len(pendientes))))
+    for diario in pendientes:
+        lst.insert("end", diario.descripcion())
+    lst.selection_set(0)
+    lst.pack(fill="both", expand=True, padx=12)
+
+    def _seleccionado() -> Optional[DiarioCampania]:
+        sel = lst.curselection()
+        return pendientes[sel[0]] if sel else None
+
+    def _reanudar():
+        diario = _seleccionado()
+        if diario is None:
+            return
+        top.destroy()
+        if diario.origen == ORIGEN_TODOS:
+            run_bg(_crear_mensajes_para_todos_bg, diario=diario, _thread_name="reanudar_campania")
+        else:
+            run_bg(_reanudar_generar_bg, diario, _thread_name="reanudar_campania")
+
+    def _descartar():
+        diario = _seleccionado()
+        if diario is None or not messagebox.askyesno(
+            "Descartar", "¿Descartar esta campaña? No se podrá reanudar.", parent=top
+        ):
+            return
+        diario.terminar({"descartada": True})
+        idx = pendientes.index(diario)
+        pendientes.pop(idx)
+        lst.delete(idx)
+        if not pendientes:
+            top.destroy()
+
+    botones = ttk.Frame(top)
+    botones.pack(fill="x", padx=12, pady=12)
+    ttk.Button(botones, text="Descartar", command=_descartar).pack(side="left")
+    ttk.Button(botones, text="Reanudar", command=_reanudar).pack(side="right")
+
+def ver_campanias_programadas():
+    """Lista las campañas programadas pendientes y permite cancelarlas."""
+    programadas = get_almacen_programadas().activas()
+    if not programadas:
+        messagebox.showinfo("Campañas programadas", "No hay campañas programadas pendientes.", parent=ventana)
+        return
+
+    top = tk.Toplevel(ventana)
+    top.title("Campañas programadas")
+    top.transient(ventana)
+    top.grab_set()
+    ttk.Label(top, text="Pendientes de envío:").pack(padx=12, pady=(12, 6), anchor="w")
+    lst = tk.Listbox(top, width=90, height=min(10, max(3, len(programadas))))
+    for programada in programadas:
+        lst.insert("end", programada.descripcion())
+    lst.selection_set(0)
+    lst.pack(fill="both", expand=True, padx=12)
+
+    def _cancelar():
+        sel = lst.curselection()
+        if not sel or not messagebox.askyesno(
+            "Cancelar", "¿Cancelar esta campaña programada? Lo ya enviado no se deshace.", parent=top
+        ):
+            return
+        programada = programadas.pop(sel[0])
+        get_programador_campanias(db).cancelar(programada.id)
+        lst.delete(sel[0])
+        if not programadas:
+            top.destroy()
+
+    botones = ttk.Frame(top)
+    botones.pack(fill="x", padx=12, pady=12)
+    ttk.Button(botones, text="Cancelar campaña", command=_cancelar).pack(side="left")
+    ttk.Button(botones, text="Cerrar", command=top.destroy).pack(side="right")
 
 # Funciones de sincronización (descargar, subir, etc.)
 def seleccionar_carpeta_destino():
@@ -872,84 +1265,64 @@ def seleccionar_carpeta_destino():
         if estado is not None:
             estado.set(f"📁 Carpeta de destino seleccionada:\n{carpeta}")
 
-def limpiar_fechas(doc):
-    limpio = {}
-    for k, v in doc.items():
-        if isinstance(v, datetime.datetime):
-            v = v.astimezone(datetime.timezone.utc).replace(tzinfo=None).isoformat()
-        limpio[k] = v
-    return limpio
-
-def tipo_de_valor(valor):
-    if isinstance(valor, bool): return "bool"
-    if isinstance(valor, int): return "int"
-    if isinstance(valor, float): return "float"
-    if isinstance(valor, datetime.datetime): return "datetime"
-    if isinstance(valor, list): return "list"
-    if isinstance(valor, dict): return "dict"
-    return "str"
-
-def convertir_desde_tipos(dic, tipos):
-    resultado = {}
-    for k, v in dic.items():
-        tipo = tipos.get(k, "str")
-        try:
-            if tipo == "datetime" and isinstance(v, str):
-                resultado[k] = parser.isoparse(v)
-            elif tipo == "int":
-                resultado[k] = int(v)
-            elif tipo == "float":
-                resultado[k] = float(v)
-            elif tipo == "bool":
-                resultado[k] = str(v).strip().lower() in ["true", "sí"]
-            elif tipo in ["list", "dict"]:
-                import ast
-                resultado[k] = ast.literal_eval(v) if isinstance(v, str) else v
-            else:
-                resultado[k] = str(v)
-        except:
-            resultado[k] = v
-    return resultado
-
 def descargar_todo():
     if not carpeta_excel["ruta"]:
         error(_get_root(), "Carpeta no seleccionada", "Debes seleccionar una carpeta de destino primero.")
         return
     root = _get_root()
+    formato = FORMATO_CSV if csv_var is not None and csv_var.get() else FORMATO_XLSX
+    incremental = bool(incremental_var is not None and incremental_var.get())
 
     def worker():
+        # Estado por colección, actualizado desde los hilos del pool de exportación.
+        progreso: dict[str, str] = {}
+        lock = threading.Lock()
+        t0 = time.monotonic()
+
+        def _on_progreso(p: dict) -> None:
+            nombre = p["coleccion"]
+            if p["estado"] == "hecho" and "leidos" in p:
+                linea = f"✅ {nombre}: {p['leidos']} cambios, {p['documentos']} docs en {p['segundos']:.1f} s"
+            elif p["estado"] == "hecho":
+                linea = f"✅ {nombre}: {p['documentos']} docs en {p['segundos']:.1f} s"
+            elif p["estado"] == "error":
+                linea = f"❌ {nombre}: {p.get('error')}"
+            elif p["estado"] == "escribiendo":
+                linea = f"💾 {nombre}: escribiendo {p['documentos']} docs..."
+            else:
+                linea = f"⏳ {nombre}: {p['documentos']} docs..."
+            with lock:
+                progreso[nombre] = linea
+                activas = [l for l in progreso.values() if not l.startswith("✅")]
+                hechas = len(progreso) - len(activas)
+                texto = "\n".join([f"Descargando ({hechas} terminadas)"] + activas[-4:])
+            _set_estado_async(texto)
+
         try:
-            colecciones = list(db.collections())
-            if not colecciones:
+            resumenes = exportar_colecciones(
+                db,
+                carpeta_excel["ruta"],
+                formato=formato,
+                incremental=incremental,
+                on_progreso=_on_progreso,
+            )
+            if not resumenes:
                 info(root, "Descarga", "No se encontraron colecciones en Firestore.")
                 _set_estado_async("Sin colecciones para descargar.")
                 return
 
-            for coleccion in colecciones:
-                nombre = getattr(coleccion, "id", "coleccion")
-                _set_estado_async(f"⏳ Descargando: {nombre}...")
-
-                datos: list[dict] = []
-                tipos: dict[str, str] = {}
-
-                for doc in iter_collection_safe(coleccion):
-                    raw = doc.to_dict() or {}
-                    limpio = limpiar_fechas(raw)
-                    limpio["_id"] = doc.id
-                    datos.append(limpio)
-                    for k, v in raw.items():
-                        tipos[k] = tipo_de_valor(v)
-
-                if datos:
-                    ruta_archivo = os.path.join(carpeta_excel["ruta"], f"{nombre}.xlsx")
-                    with pd.ExcelWriter(ruta_archivo, engine="openpyxl") as writer:
-                        pd.DataFrame(datos).to_excel(writer, sheet_name="datos", index=False)
-                        pd.DataFrame([
-                            {"campo": k, "tipo": v} for k, v in tipos.items()
-                        ]).to_excel(writer, sheet_name="tipos", index=False)
-
+            errores = [r for r in resumenes if r.get("error")]
+            total_docs = sum(r["documentos"] for r in resumenes)
+            segundos = time.monotonic() - t0
+            if errores:
+                detalle = "\n".join(f"{r['coleccion']}: {r['error']}" for r in errores)
+                error(root, "Descarga incompleta", f"No se pudieron exportar {len(errores)} colecciones:\n{detalle}")
+                _set_estado_async(f"⚠️ Descarga con {len(errores)} errores ({total_docs} docs, {segundos:.0f} s).")
+                return
             info(root, "Éxito", "Todas las colecciones fueron exportadas.")
-            _set_estado_async("✅ Descarga completada.")
+            _set_estado_async(
+                f"✅ Descarga completada: {len(resumenes)} colecciones, {total_docs} docs en {segundos:.0f} s."
+            )
         except Exception as exc:
             logger.exception("Error al descargar colecciones")
             error(root, "Error", str(exc))
@@ -957,6 +1330,68 @@ def descargar_todo():
 
     run_bg(worker, _thread_name="descargar_todo")
 
+def _vista_previa_importacion(diff) -> None:
+    """Muestra el diff calculado (simulación) y aplica sólo si se confirma."""
+    top = tk.Toplevel(ventana)
+    top.title("Vista previa de la subida")
+    top.transient(ventana)
+    top.grab_set()
+    ttk.Label(top, text=diff.descripcion(), justify="left").pack(padx=12, pady=(12, 6), anchor="w")
+    muestra = diff.muestra()
+    if muestra:
+        ttk.Label(top, text="Ejemplos (+ nuevo, ~ modificado, - eliminado, ! error):").pack(padx=12, anchor="w")
+        lst = tk.Listbox(top, width=70, height=min(12, len(muestra)))
+        for linea in muestra:
+            lst.insert("end", linea)
+        lst.pack(fill="both", expand=True, padx=12)
+
+    def _aplicar():
+        if len(diff.borrar) > MAX_BORRADOS_SIN_CONFIRMAR and not messagebox.askyesno(
+            "Confirmar eliminación",
+            f"Se van a ELIMINAR {len(diff.borrar)} documentos de '{diff.coleccion}'.\n"
+            "Esta operación no se puede deshacer. ¿Continuar?",
+            icon="warning",
+            parent=top,
+        ):
+            return
+        top.destroy()
+        run_bg(_aplicar_importacion_bg, diff, _thread_name="subir_archivo")
+
+    def _cancelar():
+        top.destroy()
+        _set_estado_async("Subida cancelada: no se escribió nada.")
+
+    botones = ttk.Frame(top)
+    botones.pack(fill="x", padx=12, pady=12)
+    ttk.Button(botones, text="Cancelar", command=_cancelar).pack(side="left")
+    btn_aplicar = ttk.Button(botones, text=f"Aplicar {diff.total_cambios} cambios", command=_aplicar)
+    btn_aplicar.pack(side="right")
+    if not diff.total_cambios:
+        btn_aplicar.config(state="disabled")
+    top.protocol("WM_DELETE_WINDOW", _cancelar)
+
+
+def _aplicar_importacion_bg(diff) -> None:
+    root = _get_root()
+    try:
+        resumen = aplicar_diff(db, diff, on_progreso=_set_estado_async)
+    except Exception as exc:
+        logger.exception("Error al aplicar la subida de %s", diff.coleccion)
+        error(root, "Error", str(exc))
+        _set_estado_async("❌ Error al subir archivo.")
+        return
+    if resumen["fallos"]:
+        error(
+            root,
+            "Subida incompleta",
+            f"{len(resumen['fallos'])} documentos no se pudieron escribir (ver log).",
+        )
+        _set_estado_async(f"⚠️ Subida con {len(resumen['fallos'])} errores.")
+        return
+    info(root, "Éxito", f"Archivo '{diff.coleccion}.xlsx' sincronizado ({resumen['escritos']} cambios).")
+    _set_estado_async(f"✅ Subida completada: {resumen['escritos']} cambios en {resumen['segundos']:.1f} s.")
+
+
 def subir_archivo():
     archivo = filedialog.askopenfilename(filetypes=[("Excel files", "*.xlsx")])
     if not archivo:
@@ -970,32 +1405,27 @@ def subir_archivo():
 
     def worker():
         try:
-            nombre_coleccion = os.path.splitext(os.path.basename(archivo))[0]
-            df = pd.read_excel(archivo, sheet_name="datos")
-            df_tipos = pd.read_excel(archivo, sheet_name="tipos")
-            tipos_dict = dict(zip(df_tipos["campo"], df_tipos["tipo"]))
-
-            if "_id" not in df.columns:
-                error(root, "Error", "El archivo no contiene una columna '_id'")
+            try:
+                nombre_coleccion, df, tipos_dict = leer_excel(archivo)
+            except ValueError as exc:
+                error(root, "Error", str(exc))
                 return
 
-            _set_estado_async(f"⬆️ Subiendo: {nombre_coleccion}...")
-
-            ids_excel = set()
-            for _, fila in df.iterrows():
-                doc_id = str(fila["_id"])
-                datos_limpios = fila.drop("_id").dropna().to_dict()
-                data = convertir_desde_tipos(datos_limpios, tipos_dict)
-                db.collection(nombre_coleccion).document(doc_id).set(data)
-                ids_excel.add(doc_id)
-
-            if eliminar_faltantes:
-                for doc in iter_collection_safe(db.collection(nombre_coleccion)):
-                    if doc.id not in ids_excel:
-                        db.collection(nombre_coleccion).document(doc.id).delete()
-
-            info(root, "Éxito", f"Archivo '{nombre_coleccion}.xlsx' sincronizado.")
-            _set_estado_async("✅ Subida completada.")
+            _set_estado_async(f"🔎 Comparando: {nombre_coleccion}...")
+            diff = calcular_diff(
+                db,
+                nombre_coleccion,
+                df,
+                tipos_dict,
+                eliminar_faltantes=eliminar_faltantes,
+                on_progreso=_set_estado_async,
+            )
+            if not diff.total_cambios and not diff.conversion.filas:
+                info(root, "Sin cambios", f"'{nombre_coleccion}' ya coincide con el Excel; no se escribió nada.")
+                _set_estado_async(f"✅ {nombre_coleccion}: sin cambios ({diff.sin_cambios} documentos).")
+                return
+            _set_estado_async(f"📋 {nombre_coleccion}: {diff.total_cambios} cambios pendientes de confirmar.")
+            root.after(0, lambda: _vista_previa_importacion(diff))
         except Exception as exc:
             logger.exception("Error al subir archivo")
             error(root, "Error", str(exc))
@@ -1008,23 +1438,21 @@ def revisar_mensajes():
 
     def worker():
         try:
-            notificados = _leer_notificados_local()
-
             nuevos = []
             snapshot = with_retry(
                 lambda: db.collection("Mensajes").where(
                     filter=FieldFilter("estado", "==", "Pendiente")
                 ).get()
             )
+            notificados = _leer_notificados_local([doc.id for doc in snapshot])
             for doc in snapshot:
                 if doc.id not in notificados:
                     mensaje = (doc.to_dict() or {}).get("mensaje", "(sin mensaje)")
                     nuevos.append((doc.id, mensaje))
                     info(root, "📨 Mensaje nuevo", f"{mensaje}")
-                    notificados.append(doc.id)
 
             if nuevos:
-                _guardar_notificados_local(notificados)
+                _guardar_notificados_local([doc_id for doc_id, _ in nuevos])
             else:
                 info(root, "Mensajes", "No hay mensajes pendientes nuevos.")
         except Exception as exc:
@@ -1036,7 +1464,8 @@ def revisar_mensajes():
 # Interfaz
 ventana = tk.Tk()
 ventana.title("Sansebassms Sync")
-ventana.geometry("500x580")
+# Sin alto fijo: la ventana crece con los botones y el estado de varias líneas.
+ventana.minsize(500, 580)
 ventana.resizable(False, False)
 
 try:
@@ -1089,8 +1518,20 @@ tk.Button(frame, text="📜 Gestionar Mensajes", command=lambda: abrir_gestion_m
 tk.Button(frame, text="Peticiones de Días Libres", command=lambda: abrir_gestion_peticiones(db), height=2, width=40).pack(pady=5)
 tk.Button(frame, text="Informe", command=abrir_informes, height=2, width=40).pack(pady=5)
 tk.Button(frame, text="🆕 Generar mensajes", command=lambda: abrir_generar_mensajes(db), height=2, width=40).pack(pady=5)
+tk.Button(frame, text="⏯ Reanudar campaña", command=reanudar_campania, height=2, width=40).pack(pady=5)
+tk.Button(frame, text="🕒 Campañas programadas", command=ver_campanias_programadas, height=2, width=40).pack(pady=5)
 
 
+csv_var = tk.BooleanVar(value=False)
+tk.Checkbutton(frame, text="Descargar en CSV en lugar de Excel", variable=csv_var).pack(pady=(5, 0))
+incremental_var = tk.BooleanVar(value=False)
+tk.Checkbutton(
+    frame,
+    text="Descarga incremental (ahorra descarga y escritura; sólo ahorra lecturas\n"
+    "en colecciones con campo de modificación en config.json)",
+    variable=incremental_var,
+).pack()
+
 eliminar_var = tk.BooleanVar(value=True)
 tk.Checkbutton(frame, text="Eliminar documentos no presentes en el Excel", variable=eliminar_var).pack(pady=5)
 
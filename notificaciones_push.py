@@ -1,37 +1,15 @@
-import json
 import logging
-import os
+import threading
 
 from firebase_admin import messaging
 from google.cloud import firestore
 
-NOTI_DB = "notificados.json"  # desduplicador por MensajeID
+from escritor_lotes import EscritorLotes
+from outbox_push import get_outbox
+from push_service import es_reintentable, get_push_service
+from registro_notificados import get_registro_notificados
 
-
-def _load_notificados() -> set[str]:
-    if not os.path.exists(NOTI_DB):
-        return set()
-    try:
-        with open(NOTI_DB, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        if isinstance(data, dict):
-            ids = data.get("ids", [])
-        elif isinstance(data, list):
-            ids = data
-        else:
-            ids = []
-        return {str(i) for i in ids if i}
-    except Exception:
-        logging.exception("No se pudo leer notificados.json")
-        return set()
-
-
-def _save_notificados(ids: set[str]) -> None:
-    try:
-        with open(NOTI_DB, "w", encoding="utf-8") as f:
-            json.dump({"ids": sorted(ids)}, f, ensure_ascii=False, indent=2)
-    except Exception:
-        logging.exception("No se pudo guardar notificados.json")
+FCM_MAX_LOTE = 500  # máximo de mensajes por llamada a send_each
 
 
 def _title_body_from_doc(doc_data: dict) -> tuple[str, str]:
@@ -51,69 +29,70 @@ def _tokens_from_user(user_doc: dict) -> list[str]:
     return []
 
 
-def _quitar_tokens_invalidos(
-    db: firestore.Client,
-    mensaje_data: dict,
-    usuario: dict,
-    tokens_a_remover: list[str],
-) -> None:
-    if not tokens_a_remover:
-        return
+class PodaTokens:
+    """Recoge los tokens no registrados de una campaña y los poda en una sola pasada.
 
-    uid = mensaje_data.get("uid") or usuario.get("UID") or usuario.get("uid")
-    if not uid:
-        return
-
-    ref = db.collection("UsuariosAutorizados").document(str(uid))
-    actual = usuario.get("fcmToken")
-    try:
-        if isinstance(actual, list):
-            nuevos = [t for t in actual if t not in tokens_a_remover]
-            ref.update({"fcmToken": nuevos})
-            usuario["fcmToken"] = nuevos
-        elif isinstance(actual, str):
-            if actual in tokens_a_remover:
-                ref.update({"fcmToken": firestore.DELETE_FIELD})
-                usuario.pop("fcmToken", None)
-        else:
-            ref.update({"fcmToken": firestore.DELETE_FIELD})
-            usuario.pop("fcmToken", None)
-    except Exception:
-        logging.exception("No se pudo actualizar tokens inválidos para %s", uid)
+    Mientras dura la campaña, los tokens anotados quedan en una lista de denegados
+    en memoria y no se vuelven a usar en otros envíos, aunque otros hilos tengan
+    una copia antigua del usuario.
+    """
 
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._denegados: set[str] = set()
+        self._por_uid: dict[str, set[str]] = {}
+        self._campo_texto: set[str] = set()  # uids cuyo fcmToken es un string, no una lista
 
-def enviar_push_por_mensaje(
-    db: firestore.Client,
-    mensaje_id: str,  # id del doc en Mensajes
-    mensaje_data: dict,  # contenido del doc recién guardado
-    usuario: dict,  # doc de UsuariosAutorizados del destinatario (por uid)
-    actualizar_estado: bool = True,
-    *,
-    force: bool = False,
-) -> dict:
-    """Devuelve dict con {enviados:int, fallidos:int}. No lanza si ya fue enviado (dedupe)."""
+    def anotar(self, uid: str | None, token: str, actual=None) -> None:
+        with self._lock:
+            self._denegados.add(token)
+            if not uid:
+                return
+            self._por_uid.setdefault(str(uid), set()).add(token)
+            if isinstance(actual, str):
+                self._campo_texto.add(str(uid))
 
-    enviados = fallidos = 0
-    dedupe = _load_notificados()
-    if not force and mensaje_id in dedupe:
-        logging.info("Notificación ya enviada para %s (dedupe)", mensaje_id)
-        return {"enviados": 0, "fallidos": 0}
-
-    tokens = _tokens_from_user(usuario)
-    if not tokens:
-        logging.warning("Usuario sin fcmToken; uid=%s", usuario.get("UID") or usuario.get("uid"))
-        if actualizar_estado:
-            db.collection("Mensajes").document(mensaje_id).update({
-                "pushEstado": "SinToken",
-                "pushEnviadoEn": firestore.SERVER_TIMESTAMP,
-                "pushEnviados": 0,
-                "pushFallidos": 1,
-                "pushError": "Usuario sin fcmToken",
-            })
-        return {"enviados": 0, "fallidos": 1}
+    def filtrar(self, tokens: list[str]) -> list[str]:
+        with self._lock:
+            if not self._denegados:
+                return tokens
+            return [t for t in tokens if t not in self._denegados]
 
-    titulo, cuerpo = _title_body_from_doc(mensaje_data)
-    data_payload = {
+    @property
+    def total(self) -> int:
+        with self._lock:
+            return sum(len(tokens) for tokens in self._por_uid.values())
+
+    def aplicar(self, db: firestore.Client, escritor: EscritorLotes | None = None) -> int:
+        """Quita los tokens anotados de UsuariosAutorizados (una escritura por uid).
+
+        Las listas se podan con ArrayRemove para no pisar tokens añadidos entretanto;
+        un fcmToken de tipo string se borra. Devuelve el número de tokens eliminados.
+        """
+        with self._lock:
+            por_uid = {uid: sorted(tokens) for uid, tokens in self._por_uid.items()}
+            campo_texto = set(self._campo_texto)
+            self._por_uid.clear()
+            self._campo_texto.clear()
+        if not por_uid:
+            return 0
+        if escritor is None:
+            with EscritorLotes(db, intervalo=None, nombre="poda_tokens") as propio:
+                return self._escribir(db, propio, por_uid, campo_texto)
+        return self._escribir(db, escritor, por_uid, campo_texto)
+
+    @staticmethod
+    def _escribir(db, escritor: EscritorLotes, por_uid: dict[str, list[str]], campo_texto: set[str]) -> int:
+        for uid, tokens in por_uid.items():
+            valor = firestore.DELETE_FIELD if uid in campo_texto else firestore.ArrayRemove(tokens)
+            escritor.update(db.collection("UsuariosAutorizados").document(uid), {"fcmToken": valor})
+        eliminados = sum(len(tokens) for tokens in por_uid.values())
+        logging.info("Poda de tokens: %s tokens no registrados en %s usuarios", eliminados, len(por_uid))
+        return eliminados
+
+
+def _data_payload(mensaje_id: str, mensaje_data: dict) -> dict:
+    return {
         "mensajeId": mensaje_id,
         "uid": str(mensaje_data.get("uid", "")),
         "tipo": str(mensaje_data.get("tipo", "")),
@@ -123,68 +102,268 @@ def enviar_push_por_mensaje(
         "route": "/usuario",  # tu app lo usa para abrir UsuarioScreen
     }
 
-    batch = []
-    for t in tokens:
-        batch.append(
-            messaging.Message(
-                notification=messaging.Notification(title=titulo, body=cuerpo),
-                token=t,
-                data=data_payload,
+
+def _construir_mensajes(mensaje_id: str, mensaje_data: dict, tokens: list[str]) -> list[messaging.Message]:
+    titulo, cuerpo = _title_body_from_doc(mensaje_data)
+    data_payload = _data_payload(mensaje_id, mensaje_data)
+    return [
+        messaging.Message(
+            notification=messaging.Notification(title=titulo, body=cuerpo),
+            token=t,
+            data=data_payload,
+        )
+        for t in tokens
+    ]
+
+
+def _marcar_sin_token(
+    db: firestore.Client,
+    escritor: EscritorLotes,
+    mensaje_id: str,
+    usuario: dict,
+    actualizar_estado: bool,
+) -> dict:
+    logging.warning("Usuario sin fcmToken; uid=%s", usuario.get("UID") or usuario.get("uid"))
+    if actualizar_estado:
+        escritor.update(db.collection("Mensajes").document(mensaje_id), {
+            "pushEstado": "SinToken",
+            "pushEnviadoEn": firestore.SERVER_TIMESTAMP,
+            "pushEnviados": 0,
+            "pushFallidos": 1,
+            "pushError": "Usuario sin fcmToken",
+        })
+    return {"enviados": 0, "fallidos": 1}
+
+
+def _registrar_resultado(
+    db: firestore.Client,
+    escritor: EscritorLotes,
+    mensaje_id: str,
+    mensaje_data: dict,
+    usuario: dict,
+    tokens: list[str],
+    respuestas: list[tuple[bool, Exception | None]],
+    actualizar_estado: bool,
+    poda: PodaTokens,
+    error_envio: Exception | None = None,
+    acumular: bool = False,
+) -> dict:
+    """Traduce las respuestas de FCM de un mensaje a OK/Parcial/ErrorPush y las persiste.
+
+    `tokensReintentables` son los tokens que fallaron con un error transitorio. Con
+    `acumular` (reintento de sólo los tokens fallidos) los contadores se suman a los
+    guardados en el mensaje y el estado se deduce del total.
+    """
+
+    enviados = fallidos = 0
+    errores: list[str] = []
+    reintentables: list[str] = []
+    uid = mensaje_data.get("uid") or usuario.get("UID") or usuario.get("uid")
+    for token, (exito, exc) in zip(tokens, respuestas):
+        if exito:
+            enviados += 1
+            continue
+        fallidos += 1
+        if es_reintentable(exc):
+            reintentables.append(token)
+        if exc is error_envio:
+            continue
+        mensaje_error = getattr(exc, "message", None) or str(exc)
+        if mensaje_error:
+            errores.append(mensaje_error)
+        if isinstance(exc, messaging.UnregisteredError):
+            poda.anotar(uid, token, usuario.get("fcmToken"))
+
+    if acumular:
+        # Los `tokens` reintentados estaban contados como fallidos en el intento anterior.
+        enviados += int(mensaje_data.get("pushEnviados") or 0)
+        fallidos += max(0, int(mensaje_data.get("pushFallidos") or 0) - len(tokens))
+
+    push_estado = "OK"
+    if fallidos:
+        push_estado = "Parcial" if enviados > 0 else "ErrorPush"
+
+    if errores:
+        logging.warning(
+            "Errores enviando push %s: %s",
+            mensaje_id,
+            "; ".join(dict.fromkeys(errores)),
+        )
+
+    if actualizar_estado:
+        escritor.update(db.collection("Mensajes").document(mensaje_id), {
+            "pushEstado": push_estado,
+            "pushEnviadoEn": firestore.SERVER_TIMESTAMP,
+            "pushEnviados": enviados,
+            "pushFallidos": fallidos,
+            "pushError": str(error_envio) if error_envio is not None else None,
+        })
+
+    if enviados > 0:
+        get_registro_notificados().agregar(mensaje_id)
+
+    return {
+        "enviados": enviados,
+        "fallidos": fallidos,
+        "pushEstado": push_estado,
+        "tokensReintentables": reintentables,
+    }
+
+
+def enviar_push_masivo(
+    db: firestore.Client,
+    items,  # iterable de (mensaje_id, mensaje_data, usuario)
+    actualizar_estado: bool = True,
+    *,
+    force: bool = False,
+    escritor: EscritorLotes | None = None,
+    poda: PodaTokens | None = None,
+    tokens_por_mensaje: dict[str, list[str]] | None = None,
+) -> dict[str, dict]:
+    """Envía muchos mensajes empaquetando sus tokens en llamadas send_each de hasta 500.
+
+    Devuelve {mensaje_id: {enviados, fallidos, pushEstado}} con los mismos estados
+    (OK/Parcial/ErrorPush/SinToken) que `enviar_push_por_mensaje`; los duplicados
+    devuelven enviados=fallidos=0 y pushEstado=None. Los estados push se escriben
+    con `escritor` (compartido por la campaña) o, si no se indica, con un escritor
+    propio que se confirma antes de volver.
+
+    Los tokens no registrados se anotan en `poda`; quien la pasa (la campaña) la
+    aplica al final. Sin `poda`, se usa una propia que se aplica antes de volver.
+
+    `tokens_por_mensaje` restringe el envío de esos mensajes a esos tokens (los que
+    fallaron en un intento anterior); los ya entregados no reciben el push otra vez.
+    """
+
+    if escritor is None:
+        with EscritorLotes(db, intervalo=None, nombre="estado_push") as propio:
+            return enviar_push_masivo(
+                db, items, actualizar_estado, force=force, escritor=propio, poda=poda,
+                tokens_por_mensaje=tokens_por_mensaje,
             )
+    if poda is None:
+        poda = PodaTokens()
+        resultados = enviar_push_masivo(
+            db, items, actualizar_estado, force=force, escritor=escritor, poda=poda,
+            tokens_por_mensaje=tokens_por_mensaje,
         )
+        poda.aplicar(db, escritor)
+        return resultados
 
-    try:
-        resp = messaging.send_each(batch, dry_run=False)
-        errores: list[str] = []
-        tokens_a_remover: list[str] = []
-        for token, resultado in zip(tokens, resp.responses):
-            if resultado.success:
-                enviados += 1
+    dedupe = get_registro_notificados()
+    tokens_por_mensaje = tokens_por_mensaje or {}
+    resultados: dict[str, dict] = {}
+    pendientes: list[tuple[str, dict, dict, list[str]]] = []
+    sin_tokens_restantes: list[str] = []
+    for mensaje_id, mensaje_data, usuario in items:
+        usuario = usuario or {}
+        if not force and dedupe.contiene(mensaje_id):
+            logging.info("Notificación ya enviada para %s (dedupe)", mensaje_id)
+            resultados[mensaje_id] = {"enviados": 0, "fallidos": 0, "pushEstado": None}
+            continue
+        tokens = poda.filtrar(_tokens_from_user(usuario))
+        restringir = tokens_por_mensaje.get(mensaje_id)
+        if restringir is not None:
+            restantes = set(restringir)
+            tokens = [t for t in tokens if t in restantes]
+            if not tokens:
+                # Los tokens que faltaban ya no son del usuario: nada que reintentar.
+                resultados[mensaje_id] = {
+                    "enviados": 0, "fallidos": 0, "pushEstado": None, "tokensReintentables": [],
+                }
+                sin_tokens_restantes.append(mensaje_id)
                 continue
-            fallidos += 1
-            exc = resultado.exception
-            mensaje_error = getattr(exc, "message", None) or str(exc)
-            if mensaje_error:
-                errores.append(mensaje_error)
-            if isinstance(exc, messaging.UnregisteredError):
-                tokens_a_remover.append(token)
-
-        push_estado = "OK"
-        if fallidos:
-            push_estado = "Parcial" if enviados > 0 else "ErrorPush"
-
-        if errores:
-            logging.warning(
-                "Errores enviando push %s: %s",
+        if not tokens:
+            resultados[mensaje_id] = {
+                **_marcar_sin_token(db, escritor, mensaje_id, usuario, actualizar_estado),
+                "pushEstado": "SinToken",
+            }
+            continue
+        pendientes.append((mensaje_id, mensaje_data, usuario, tokens))
+
+    # Cola plana (índice del mensaje, posición del token, Message) para empaquetar en lotes.
+    cola: list[tuple[int, int, messaging.Message]] = []
+    for idx, (mensaje_id, mensaje_data, _usuario, tokens) in enumerate(pendientes):
+        for pos, msg in enumerate(_construir_mensajes(mensaje_id, mensaje_data, tokens)):
+            cola.append((idx, pos, msg))
+
+    respuestas: list[list] = [[None] * len(p[3]) for p in pendientes]
+    errores_envio: dict[int, Exception] = {}
+    for inicio in range(0, len(cola), FCM_MAX_LOTE):
+        lote = cola[inicio:inicio + FCM_MAX_LOTE]
+        try:
+            resp = get_push_service().send_each([msg for _, _, msg in lote], dry_run=False)
+            pares = [(r.success, r.exception) for r in resp]
+        except Exception as e:
+            logging.exception("Error enviando push (lote de %s mensajes)", len(lote))
+            pares = [(False, e)] * len(lote)
+            for idx, _, _ in lote:
+                errores_envio[idx] = e
+        for (idx, pos, _), par in zip(lote, pares):
+            respuestas[idx][pos] = par
+
+    for idx, (mensaje_id, mensaje_data, usuario, tokens) in enumerate(pendientes):
+        try:
+            resultados[mensaje_id] = _registrar_resultado(
+                db,
+                escritor,
                 mensaje_id,
-                "; ".join(dict.fromkeys(errores)),
+                mensaje_data,
+                usuario,
+                tokens,
+                respuestas[idx],
+                actualizar_estado,
+                poda,
+                errores_envio.get(idx),
+                acumular=mensaje_id in tokens_por_mensaje,
             )
-
-        if actualizar_estado:
-            db.collection("Mensajes").document(mensaje_id).update({
-                "pushEstado": push_estado,
-                "pushEnviadoEn": firestore.SERVER_TIMESTAMP,
-                "pushEnviados": enviados,
-                "pushFallidos": fallidos,
-                "pushError": None,
-            })
-
-        if tokens_a_remover:
-            _quitar_tokens_invalidos(db, mensaje_data, usuario, tokens_a_remover)
-
-        if enviados > 0:
-            dedupe.add(mensaje_id)
-            _save_notificados(dedupe)
-
-        return {"enviados": enviados, "fallidos": fallidos}
-    except Exception as e:
-        logging.exception("Error enviando push")
-        if actualizar_estado:
-            db.collection("Mensajes").document(mensaje_id).update({
+        except Exception:
+            logging.exception("No se pudo registrar el resultado push de %s", mensaje_id)
+            resultados[mensaje_id] = {
+                "enviados": 0,
+                "fallidos": len(tokens),
                 "pushEstado": "ErrorPush",
-                "pushEnviadoEn": firestore.SERVER_TIMESTAMP,
-                "pushFallidos": len(tokens),
-                "pushEnviados": 0,
-                "pushError": str(e),
-            })
-        return {"enviados": 0, "fallidos": len(tokens)}
+                "tokensReintentables": [],
+            }
+
+    # Sólo los tokens con error transitorio quedan en la bandeja local para el
+    # reintento automático; los errores permanentes (token inválido o no
+    # registrado) no se reintentan.
+    if actualizar_estado and (pendientes or sin_tokens_restantes):
+        resueltos: list[str] = list(sin_tokens_restantes)
+        fallidos: list[tuple[str, str, list[str]]] = []
+        for idx, (mensaje_id, *_resto) in enumerate(pendientes):
+            resultado = resultados[mensaje_id]
+            tokens_reintento = resultado.get("tokensReintentables") or []
+            if resultado.get("pushEstado") in ("ErrorPush", "Parcial") and tokens_reintento:
+                error = errores_envio.get(idx)
+                fallidos.append(
+                    (mensaje_id, str(error) if error is not None else resultado["pushEstado"], tokens_reintento)
+                )
+            else:
+                resueltos.append(mensaje_id)
+        try:
+            get_outbox().registrar_resultados(resueltos, fallidos)
+        except Exception:
+            logging.exception("No se pudo actualizar la bandeja de reintentos push")
+    return resultados
+
+
+def enviar_push_por_mensaje(
+    db: firestore.Client,
+    mensaje_id: str,  # id del doc en Mensajes
+    mensaje_data: dict,  # contenido del doc recién guardado
+    usuario: dict,  # doc de UsuariosAutorizados del destinatario (por uid)
+    actualizar_estado: bool = True,
+    *,
+    force: bool = False,
+) -> dict:
+    """Devuelve dict con {enviados:int, fallidos:int}. No lanza si ya fue enviado (dedupe)."""
+
+    resultado = enviar_push_masivo(
+        db,
+        [(mensaje_id, mensaje_data, usuario)],
+        actualizar_estado,
+        force=force,
+    )[mensaje_id]
+    return {"enviados": resultado["enviados"], "fallidos": resultado["fallidos"]}
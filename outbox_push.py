@@ -0,0 +1,258 @@
+import json
+import logging
+import random
+import threading
+import time
+from typing import Iterable, Optional
+
+from directorio_tokens import get_directorio_tokens
+from registro_notificados import abrir_sqlite
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_DB = "outbox_push.sqlite3"
+MAX_INTENTOS = 6
+BACKOFF_BASE = 30.0  # segundos
+BACKOFF_MAX = 3600.0
+INTERVALO_SONDEO = 15.0
+LOTE_REINTENTO = 200
+
+ESTADO_PENDIENTE = "pendiente"
+ESTADO_FALLIDO = "fallido"
+ESTADO_MUERTO = "muerto"  # agotó los intentos (dead letter)
+
+
+def calcular_backoff(intentos: int) -> float:
+    """Backoff exponencial con jitter: entre el 50 % y el 100 % del tope del intento."""
+    tope = min(BACKOFF_MAX, BACKOFF_BASE * (2 ** max(0, intentos)))
+    return random.uniform(tope / 2, tope)
+
+
+class OutboxPush:
+    """Bandeja local (SQLite) de pushes pendientes de reintento."""
+
+    def __init__(self, ruta: str = OUTBOX_DB) -> None:
+        self.ruta = ruta
+        self._lock = threading.Lock()
+        self._conn = abrir_sqlite(ruta)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS outbox ("
+            " mensaje_id TEXT PRIMARY KEY,"
+            " estado TEXT NOT NULL,"
+            " intentos INTEGER NOT NULL DEFAULT 0,"
+            " proximo_intento REAL NOT NULL,"
+            " ultimo_error TEXT,"
+            " creado REAL NOT NULL,"
+            " actualizado REAL NOT NULL,"
+            " tokens TEXT"
+            ") WITHOUT ROWID"
+        )
+        columnas = {fila[1] for fila in self._conn.execute("PRAGMA table_info(outbox)")}
+        if "tokens" not in columnas:
+            self._conn.execute("ALTER TABLE outbox ADD COLUMN tokens TEXT")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_outbox_vencidos ON outbox(estado, proximo_intento)"
+        )
+
+    def _transaccion(self, sql: str, filas: list[tuple]) -> None:
+        if not filas:
+            return
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(sql, filas)
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def registrar_resultados(
+        self,
+        resueltos: Iterable[str],
+        fallidos: Iterable[tuple[str, str, list[str]]],
+    ) -> None:
+        """Saca de la bandeja los resueltos y encola los fallidos que no estuvieran ya.
+
+        `fallidos` son (mensaje_id, error, tokens): sólo los tokens con error
+        transitorio, que son los únicos que se reintentarán.
+        """
+        ahora = time.time()
+        self._transaccion(
+            "DELETE FROM outbox WHERE mensaje_id = ?",
+            [(mid,) for mid in resueltos],
+        )
+        self._transaccion(
+            "INSERT OR IGNORE INTO outbox"
+            " (mensaje_id, estado, intentos, proximo_intento, ultimo_error, creado, actualizado, tokens)"
+            " VALUES (?, ?, 0, ?, ?, ?, ?, ?)",
+            [
+                (mid, ESTADO_PENDIENTE, ahora + calcular_backoff(0), error, ahora, ahora, json.dumps(tokens))
+                for mid, error, tokens in fallidos
+            ],
+        )
+
+    def vencidos(self, limite: int = LOTE_REINTENTO) -> list[tuple[str, int, Optional[list[str]]]]:
+        """(mensaje_id, intentos, tokens) vencidos; tokens None en filas antiguas (todos)."""
+        with self._lock:
+            filas = self._conn.execute(
+                "SELECT mensaje_id, intentos, tokens FROM outbox"
+                " WHERE estado IN (?, ?) AND proximo_intento <= ?"
+                " ORDER BY proximo_intento LIMIT ?",
+                (ESTADO_PENDIENTE, ESTADO_FALLIDO, time.time(), limite),
+            ).fetchall()
+        return [
+            (str(mid), int(intentos), json.loads(tokens) if tokens else None)
+            for mid, intentos, tokens in filas
+        ]
+
+    def reprogramar(self, mensaje_id: str, intentos: int, error: Optional[str], tokens: list[str]) -> str:
+        """Anota un intento fallido con los tokens que quedan; devuelve el nuevo estado."""
+        ahora = time.time()
+        estado = ESTADO_MUERTO if intentos >= MAX_INTENTOS else ESTADO_FALLIDO
+        with self._lock:
+            self._conn.execute(
+                "UPDATE outbox SET estado = ?, intentos = ?, proximo_intento = ?,"
+                " ultimo_error = ?, actualizado = ?, tokens = ? WHERE mensaje_id = ?",
+                (estado, intentos, ahora + calcular_backoff(intentos), error, ahora, json.dumps(tokens), mensaje_id),
+            )
+        return estado
+
+    def eliminar(self, mensaje_id: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM outbox WHERE mensaje_id = ?", (mensaje_id,))
+
+    def muertos(self) -> list[tuple[str, int, Optional[str], float]]:
+        """(mensaje_id, intentos, ultimo_error, actualizado) de los pushes descartados."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT mensaje_id, intentos, ultimo_error, actualizado FROM outbox WHERE estado = ?"
+                " ORDER BY actualizado DESC",
+                (ESTADO_MUERTO,),
+            ).fetchall()
+
+    def resumen(self) -> dict[str, int]:
+        with self._lock:
+            filas = self._conn.execute("SELECT estado, COUNT(*) FROM outbox GROUP BY estado").fetchall()
+        return {estado: int(n) for estado, n in filas}
+
+
+class ProgramadorReintentos:
+    """Hilo en segundo plano que reintenta los pushes vencidos de la bandeja."""
+
+    def __init__(self, db, outbox: OutboxPush, intervalo: float = INTERVALO_SONDEO) -> None:
+        self.db = db
+        self.outbox = outbox
+        self.intervalo = intervalo
+        self._parar = threading.Event()
+        self._hilo: Optional[threading.Thread] = None
+
+    def iniciar(self) -> None:
+        if self._hilo is not None and self._hilo.is_alive():
+            return
+        self._parar.clear()
+        self._hilo = threading.Thread(target=self._bucle, daemon=True, name="outbox_push")
+        self._hilo.start()
+
+    def detener(self) -> None:
+        self._parar.set()
+
+    def _bucle(self) -> None:
+        while not self._parar.is_set():
+            try:
+                self.procesar_vencidos()
+            except Exception:
+                logger.exception("Error procesando la bandeja de reintentos push")
+            self._parar.wait(self.intervalo)
+
+    def procesar_vencidos(self) -> int:
+        vencidos = self.outbox.vencidos()
+        if not vencidos:
+            return 0
+
+        from notificaciones_push import enviar_push_masivo
+
+        intentos_por_id = {mid: intentos for mid, intentos, _tokens in vencidos}
+        tokens_por_id = {mid: tokens for mid, _intentos, tokens in vencidos if tokens is not None}
+        refs = [self.db.collection("Mensajes").document(mid) for mid in intentos_por_id]
+        mensajes: dict[str, dict] = {}
+        for snap in self.db.get_all(refs):
+            if getattr(snap, "exists", False):
+                mensajes[snap.id] = snap.to_dict() or {}
+
+        items: list[tuple[str, dict, dict]] = []
+        uids: set[str] = set()
+        for mid in intentos_por_id:
+            data = mensajes.get(mid)
+            # Ya no hace falta reintentar: borrado, respondido o entregado por otra vía.
+            if (
+                data is None
+                or data.get("estado") not in (None, "", "Pendiente")
+                or data.get("pushEstado") not in ("ErrorPush", "Parcial")
+            ):
+                self.outbox.eliminar(mid)
+                continue
+            items.append((mid, data, {}))
+            if data.get("uid"):
+                uids.add(str(data["uid"]))
+
+        usuarios = get_directorio_tokens(self.db).obtener_varios(uids) if uids else {}
+        items = [(mid, data, usuarios.get(str(data.get("uid")), {})) for mid, data, _ in items]
+        if not items:
+            return 0
+
+        # Sólo a los tokens que fallaron por error transitorio: los que ya recibieron
+        # el push no lo reciben otra vez.
+        resultados = enviar_push_masivo(
+            self.db, items, actualizar_estado=True, force=True, tokens_por_mensaje=tokens_por_id
+        )
+        entregados = muertos = 0
+        for mid, _data, _usuario in items:
+            res = resultados.get(mid) or {}
+            if res:
+                tokens = res.get("tokensReintentables") or []
+            else:
+                # Sin resultado: se conservan los tokens pendientes para el próximo intento.
+                tokens = tokens_por_id.get(mid)
+            if res and (res.get("pushEstado") == "OK" or not tokens):
+                # Entregado, o sólo quedan errores permanentes: ya salió de la bandeja.
+                if res.get("pushEstado") == "OK":
+                    entregados += 1
+                continue
+            estado = self.outbox.reprogramar(
+                mid, intentos_por_id[mid] + 1, res.get("pushEstado") or "sin resultado", tokens
+            )
+            if estado == ESTADO_MUERTO:
+                muertos += 1
+                logger.error("Push %s descartado tras %s intentos", mid, MAX_INTENTOS)
+        logger.info(
+            "Bandeja push: %s reintentados, %s entregados, %s descartados",
+            len(items),
+            entregados,
+            muertos,
+        )
+        return len(items)
+
+
+_outbox: Optional[OutboxPush] = None
+_outbox_lock = threading.Lock()
+_programador: Optional[ProgramadorReintentos] = None
+
+
+def get_outbox() -> OutboxPush:
+    global _outbox
+    if _outbox is None:
+        with _outbox_lock:
+            if _outbox is None:
+                _outbox = OutboxPush()
+    return _outbox
+
+
+def iniciar_programador_reintentos(db) -> ProgramadorReintentos:
+    """Arranca (una sola vez por proceso) el reintento automático de la bandeja."""
+    global _programador
+    outbox = get_outbox()
+    with _outbox_lock:
+        if _programador is None:
+            _programador = ProgramadorReintentos(db, outbox)
+    _programador.iniciar()
+    return _programador
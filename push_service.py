@@ -0,0 +1,344 @@
+import email.utils
+import logging
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Iterable, Optional
+
+from firebase_admin import exceptions as fb_exceptions
+from firebase_admin import messaging
+
+logger = logging.getLogger(__name__)
+
+MAX_WORKERS = 8
+MENSAJES_POR_SEGUNDO = 1000.0  # muy por debajo de la cuota FCM (600k/min por proyecto)
+RAFAGA = 1000  # capacidad del cubo; debe admitir un send_each completo (500)
+MAX_REINTENTOS = 4
+CODIGOS_REINTENTABLES = {429, 500, 502, 503, 504}
+
+
+class ErrorReintentable(Exception):
+    """Error transitorio (429/5xx) que debe reintentarse respetando `retry_after`."""
+
+    def __init__(self, mensaje: str, retry_after: Optional[float] = None, status: Optional[int] = None) -> None:
+        super().__init__(mensaje)
+        self.retry_after = retry_after
+        self.status = status
+
+
+def parse_retry_after(valor: Any) -> Optional[float]:
+    """Interpreta una cabecera Retry-After (segundos o fecha HTTP) como segundos de espera."""
+    if valor is None:
+        return None
+    texto = str(valor).strip()
+    if not texto:
+        return None
+    try:
+        return max(0.0, float(texto))
+    except ValueError:
+        pass
+    try:
+        fecha = email.utils.parsedate_to_datetime(texto)
+    except (TypeError, ValueError):
+        return None
+    if fecha is None:
+        return None
+    return max(0.0, fecha.timestamp() - time.time())
+
+
+def _status_http(exc: BaseException) -> Optional[int]:
+    if isinstance(exc, ErrorReintentable):
+        return exc.status
+    respuesta = getattr(exc, "http_response", None) or getattr(exc, "response", None)
+    status = getattr(respuesta, "status_code", None)
+    return int(status) if isinstance(status, int) else None
+
+
+def retry_after_de(exc: BaseException) -> Optional[float]:
+    if isinstance(exc, ErrorReintentable) and exc.retry_after is not None:
+        return exc.retry_after
+    respuesta = getattr(exc, "http_response", None) or getattr(exc, "response", None)
+    headers = getattr(respuesta, "headers", None)
+    if not headers:
+        return None
+    try:
+        return parse_retry_after(headers.get("Retry-After"))
+    except Exception:
+        return None
+
+
+def es_reintentable(exc: Optional[BaseException]) -> bool:
+    if exc is None:
+        return False
+    if isinstance(exc, ErrorReintentable):
+        return True
+    if isinstance(
+        exc,
+        (
+            fb_exceptions.ResourceExhaustedError,
+            fb_exceptions.UnavailableError,
+            fb_exceptions.InternalError,
+            fb_exceptions.DeadlineExceededError,
+        ),
+    ):
+        return True
+    return _status_http(exc) in CODIGOS_REINTENTABLES
+
+
+class TokenBucket:
+    """Limitador token-bucket compartido entre hilos."""
+
+    def __init__(self, tasa: float, capacidad: float) -> None:
+        self.tasa = float(tasa)
+        self.capacidad = float(capacidad)
+        self._tokens = float(capacidad)
+        self._ultimo = time.monotonic()
+        self._bloqueado_hasta = 0.0
+        self._lock = threading.Lock()
+
+    def _reponer(self, ahora: float) -> None:
+        self._tokens = min(self.capacidad, self._tokens + (ahora - self._ultimo) * self.tasa)
+        self._ultimo = ahora
+
+    def bloquear(self, segundos: float) -> None:
+        """Detiene a todos los emisores `segundos` (p.ej. tras un 429 con Retry-After)."""
+        with self._lock:
+            self._bloqueado_hasta = max(self._bloqueado_hasta, time.monotonic() + segundos)
+
+    def adquirir(self, n: float = 1, cancelar: Optional[threading.Event] = None) -> bool:
+        """Espera hasta disponer de `n` tokens. Devuelve False si se canceló la espera."""
+        n = min(float(n), self.capacidad)
+        while True:
+            with self._lock:
+                ahora = time.monotonic()
+                self._reponer(ahora)
+                if ahora < self._bloqueado_hasta:
+                    espera = self._bloqueado_hasta - ahora
+                elif self._tokens >= n:
+                    self._tokens -= n
+                    return True
+                else:
+                    espera = (n - self._tokens) / self.tasa
+            if cancelar is not None:
+                if cancelar.wait(espera):
+                    return False
+            else:
+                time.sleep(espera)
+
+
+class RespuestaFallida:
+    """Respuesta con la forma de `messaging.SendResponse` para un envío que no llegó a FCM."""
+
+    def __init__(self, exc: Exception) -> None:
+        self.success = False
+        self.exception = exc
+        self.message_id = None
+
+
+class PushService:
+    """Pool acotado de emisores con limitador de tasa y reintentos 429/5xx."""
+
+    def __init__(
+        self,
+        max_workers: int = MAX_WORKERS,
+        mensajes_por_segundo: float = MENSAJES_POR_SEGUNDO,
+        rafaga: float = RAFAGA,
+        max_reintentos: int = MAX_REINTENTOS,
+    ) -> None:
+        self.max_workers = max_workers
+        self.max_reintentos = max_reintentos
+        self.limitador = TokenBucket(mensajes_por_segundo, rafaga)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="push")
+
+    def _espera(self, exc: BaseException, intento: int) -> float:
+        retry_after = retry_after_de(exc)
+        if retry_after is not None:
+            self.limitador.bloquear(retry_after)
+            return retry_after
+        return min(30.0, 0.5 * (2 ** (intento - 1))) * random.uniform(0.8, 1.2)
+
+    def llamar(self, fn: Callable[..., Any], *args: Any, coste: float = 1, **kwargs: Any) -> Any:
+        """Ejecuta `fn` en el hilo actual aplicando el limitador y reintentos con Retry-After."""
+        for intento in range(1, self.max_reintentos + 2):
+            self.limitador.adquirir(coste)
+            try:
+                return fn(*args, **kwargs)
+            except Exception as exc:
+                if not es_reintentable(exc) or intento > self.max_reintentos:
+                    raise
+                espera = self._espera(exc, intento)
+                logger.warning(
+                    "Envío push transitorio fallido (intento %s/%s), reintentando en %.2f s: %s",
+                    intento,
+                    self.max_reintentos + 1,
+                    espera,
+                    exc,
+                )
+                time.sleep(espera)
+
+    def send_each(self, mensajes: list, dry_run: bool = False) -> list:
+        """`messaging.send_each` limitado que reintenta sólo los mensajes con error transitorio.
+
+        Si falla la llamada de un reintento, el error se asigna sólo a los mensajes que
+        se reintentaban: los entregados en intentos anteriores conservan su respuesta.
+        """
+        respuestas: list = [None] * len(mensajes)
+        pendientes = list(range(len(mensajes)))
+        for intento in range(1, self.max_reintentos + 2):
+            lote = [mensajes[i] for i in pendientes]
+            if intento == 1:
+                resp = self.llamar(messaging.send_each, lote, dry_run=dry_run, coste=len(lote))
+            else:
+                try:
+                    resp = self.llamar(messaging.send_each, lote, dry_run=dry_run, coste=len(lote))
+                except Exception as exc:
+                    logger.exception("Reintento de %s mensajes push fallido", len(lote))
+                    for i in pendientes:
+                        respuestas[i] = RespuestaFallida(exc)
+                    break
+            reintentar: list[int] = []
+            espera = 0.0
+            for i, r in zip(pendientes, resp.responses):
+                respuestas[i] = r
+                if not r.success and es_reintentable(r.exception) and intento <= self.max_reintentos:
+                    reintentar.append(i)
+                    espera = max(espera, self._espera(r.exception, intento))
+            if not reintentar:
+                break
+            logger.warning(
+                "%s mensajes con error transitorio, reintentando en %.2f s", len(reintentar), espera
+            )
+            time.sleep(espera)
+            pendientes = reintentar
+        return respuestas
+
+    def submit(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Future:
+        nombre = getattr(fn, "__name__", "tarea")
+
+        def _runner() -> Any:
+            try:
+                return fn(*args, **kwargs)
+            except Exception:
+                logger.exception("Error en tarea push '%s'", nombre)
+                raise
+
+        return self._executor.submit(_runner)
+
+    def ejecutar_campania(
+        self,
+        tareas: Iterable[Callable[[], Any]],
+        *,
+        total: Optional[int] = None,
+        on_progreso: Optional[Callable[[dict], None]] = None,
+        cancelar: Optional[threading.Event] = None,
+        pausa: Optional[threading.Event] = None,
+    ) -> list:
+        """Ejecuta `tareas` en el pool con un máximo de tareas en vuelo.
+
+        Devuelve una lista alineada con `tareas` con el valor devuelto o la excepción
+        lanzada. `on_progreso` se invoca desde el hilo llamador con el avance y el
+        ritmo de la campaña; si la tarea devuelve un dict con `enviados`/`fallidos`/
+        `dedupe` se acumulan en el progreso. Mientras `pausa` esté activo no se lanzan
+        tareas nuevas (las que están en vuelo terminan) y el ritmo no cuenta ese tiempo.
+        """
+        tareas = list(tareas)
+        total = total if total is not None else len(tareas)
+        resultados: list = [None] * len(tareas)
+        progreso = {
+            "procesados": 0,
+            "total": total,
+            "enviados": 0,
+            "fallidos": 0,
+            "dedupe": 0,
+            "errores": 0,
+            "por_segundo": 0.0,
+            "transcurrido": 0.0,
+            "cancelado": False,
+            "pausado": False,
+        }
+        inicio = time.monotonic()
+        pausado_total = 0.0
+        en_vuelo: dict[Future, int] = {}
+        siguiente = 0
+        limite = self.max_workers * 2
+
+        def _notificar() -> None:
+            if on_progreso is not None:
+                try:
+                    on_progreso(dict(progreso))
+                except Exception:
+                    logger.exception("Error en callback de progreso de campaña")
+
+        while siguiente < len(tareas) or en_vuelo:
+            while siguiente < len(tareas) and len(en_vuelo) < limite:
+                if cancelar is not None and cancelar.is_set():
+                    progreso["cancelado"] = True
+                    siguiente = len(tareas)
+                    break
+                if pausa is not None and pausa.is_set():
+                    break
+                en_vuelo[self._executor.submit(tareas[siguiente])] = siguiente
+                siguiente += 1
+            if not en_vuelo:
+                if siguiente >= len(tareas):
+                    break
+                # En pausa y sin tareas en vuelo: esperar a que se reanude o se cancele.
+                progreso["pausado"] = True
+                _notificar()
+                t_pausa = time.monotonic()
+                while pausa is not None and pausa.is_set() and not (cancelar is not None and cancelar.is_set()):
+                    time.sleep(0.2)
+                pausado_total += time.monotonic() - t_pausa
+                progreso["pausado"] = False
+                _notificar()
+                continue
+            hechos, _ = wait(list(en_vuelo), return_when=FIRST_COMPLETED)
+            for fut in hechos:
+                idx = en_vuelo.pop(fut)
+                try:
+                    res = fut.result()
+                except Exception as exc:
+                    logger.exception("Tarea de campaña %s fallida", idx)
+                    res = exc
+                    progreso["errores"] += 1
+                resultados[idx] = res
+                if isinstance(res, dict):
+                    progreso["enviados"] += int(res.get("enviados", 0) or 0)
+                    progreso["fallidos"] += int(res.get("fallidos", 0) or 0)
+                    progreso["dedupe"] += int(res.get("dedupe", 0) or 0)
+                progreso["procesados"] += int(res.get("procesados", 1)) if isinstance(res, dict) else 1
+            transcurrido = time.monotonic() - inicio
+            activo = transcurrido - pausado_total
+            progreso["transcurrido"] = transcurrido
+            progreso["por_segundo"] = progreso["procesados"] / activo if activo > 0 else 0.0
+            _notificar()
+
+        logger.info(
+            "Campaña push: %s/%s procesados en %.1f s (%.1f/s), enviados=%s fallidos=%s errores=%s",
+            progreso["procesados"],
+            total,
+            progreso["transcurrido"],
+            progreso["por_segundo"],
+            progreso["enviados"],
+            progreso["fallidos"],
+            progreso["errores"],
+        )
+        return resultados
+
+    def cerrar(self) -> None:
+        self._executor.shutdown(wait=True)
+
+
+_servicio: Optional[PushService] = None
+_servicio_lock = threading.Lock()
+
+
+def get_push_service() -> PushService:
+    """Servicio de envío push compartido por todas las pantallas."""
+    global _servicio
+    if _servicio is None:
+        with _servicio_lock:
+            if _servicio is None:
+                _servicio = PushService()
+    return _servicio
@@ -0,0 +1,135 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+NOTI_DB = "notificados.sqlite3"  # desduplicador por MensajeID
+NOTI_JSON_LEGACY = "notificados.json"  # formato anterior, se migra una sola vez
+RETENCION_DIAS = 90
+
+
+def abrir_sqlite(ruta: str) -> sqlite3.Connection:
+    """Abre una conexión SQLite compartible entre hilos (el llamador serializa con un lock)."""
+    conn = sqlite3.connect(ruta, timeout=30.0, check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+def _leer_ids_json(ruta: str) -> list[str]:
+    with open(ruta, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        ids = data.get("ids", [])
+    elif isinstance(data, list):
+        ids = data
+    else:
+        ids = []
+    return [str(i) for i in ids if i]
+
+
+class RegistroNotificados:
+    """Conjunto persistente de MensajeID notificados con altas y consultas O(1)."""
+
+    def __init__(self, ruta: str = NOTI_DB, ruta_legacy: Optional[str] = NOTI_JSON_LEGACY) -> None:
+        self.ruta = ruta
+        self._lock = threading.Lock()
+        self._conn = abrir_sqlite(ruta)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS notificados ("
+            " mensaje_id TEXT PRIMARY KEY,"
+            " notificado_en REAL NOT NULL"
+            ") WITHOUT ROWID"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_notificados_fecha ON notificados(notificado_en)"
+        )
+        if ruta_legacy:
+            self._migrar_json(ruta_legacy)
+
+    def _migrar_json(self, ruta_legacy: str) -> None:
+        if not os.path.exists(ruta_legacy):
+            return
+        try:
+            ids = _leer_ids_json(ruta_legacy)
+        except Exception:
+            logger.exception("No se pudo leer %s para migrarlo", ruta_legacy)
+            return
+        self.agregar_varios(ids)
+        try:
+            os.replace(ruta_legacy, ruta_legacy + ".migrado")
+        except OSError:
+            logger.exception("No se pudo renombrar %s tras la migración", ruta_legacy)
+        logger.info("Migrados %s MensajeID desde %s a %s", len(ids), ruta_legacy, self.ruta)
+
+    def contiene(self, mensaje_id: str) -> bool:
+        if not mensaje_id:
+            return False
+        with self._lock:
+            fila = self._conn.execute(
+                "SELECT 1 FROM notificados WHERE mensaje_id = ?", (str(mensaje_id),)
+            ).fetchone()
+        return fila is not None
+
+    def agregar(self, mensaje_id: str) -> None:
+        if not mensaje_id:
+            return
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO notificados (mensaje_id, notificado_en) VALUES (?, ?)",
+                (str(mensaje_id), time.time()),
+            )
+
+    def agregar_varios(self, ids: Iterable[str]) -> None:
+        ahora = time.time()
+        filas = [(str(i), ahora) for i in ids if i]
+        if not filas:
+            return
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO notificados (mensaje_id, notificado_en) VALUES (?, ?)",
+                    filas,
+                )
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def purgar(self, max_dias: float = RETENCION_DIAS) -> int:
+        """Elimina los MensajeID más antiguos que `max_dias`; devuelve cuántos se borraron."""
+        limite = time.time() - max_dias * 86400
+        with self._lock:
+            cur = self._conn.execute("DELETE FROM notificados WHERE notificado_en < ?", (limite,))
+        return cur.rowcount or 0
+
+    def total(self) -> int:
+        with self._lock:
+            return int(self._conn.execute("SELECT COUNT(*) FROM notificados").fetchone()[0])
+
+
+_registro: Optional[RegistroNotificados] = None
+_registro_lock = threading.Lock()
+
+
+def get_registro_notificados() -> RegistroNotificados:
+    """Instancia compartida por todo el proceso (push, revisión de pendientes...)."""
+    global _registro
+    if _registro is None:
+        with _registro_lock:
+            if _registro is None:
+                registro = RegistroNotificados()
+                try:
+                    purgados = registro.purgar()
+                    if purgados:
+                        logger.info("Purgados %s MensajeID con más de %s días", purgados, RETENCION_DIAS)
+                except Exception:
+                    logger.exception("No se pudieron purgar MensajeID antiguos")
+                _registro = registro
+    return _registro
@@ -0,0 +1,121 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+COLECCION_USUARIOS = "UsuariosAutorizados"
+TAM_LOTE_NOMBRES = 300  # refs por llamada a get_all
+TTL_NOMBRES = 600.0  # segundos
+MAX_NOMBRES = 5000
+
+
+class ResolutorNombres:
+    """Resuelve uid -> Nombre de UsuariosAutorizados con caché LRU acotada y caducidad.
+
+    Los uids que faltan en la caché se leen juntos con `get_all` en lotes de
+    `tam_lote`, pidiendo sólo el campo Nombre. Los uids sin documento o sin Nombre
+    también se cachean (como None) para no volver a pedirlos hasta que caduquen.
+    """
+
+    def __init__(
+        self,
+        db,
+        *,
+        coleccion: str = COLECCION_USUARIOS,
+        tam_lote: int = TAM_LOTE_NOMBRES,
+        ttl: float = TTL_NOMBRES,
+        max_entradas: int = MAX_NOMBRES,
+    ) -> None:
+        self.db = db
+        self.coleccion = coleccion
+        self.tam_lote = max(1, tam_lote)
+        self.ttl = ttl
+        self.max_entradas = max(1, max_entradas)
+        self._cache: "OrderedDict[str, tuple[Optional[str], float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.lecturas = 0
+        self.llamadas = 0
+
+    def _guardar(self, uid: str, nombre: Optional[str], ahora: float) -> None:
+        self._cache[uid] = (nombre, ahora + self.ttl)
+        self._cache.move_to_end(uid)
+        while len(self._cache) > self.max_entradas:
+            self._cache.popitem(last=False)
+
+    def resolver(self, uids: Iterable[str]) -> dict[str, Optional[str]]:
+        """{uid: Nombre o None} para todos los uids pedidos (vacíos excluidos)."""
+        pedidos = [str(u) for u in dict.fromkeys(uids) if u]
+        ahora = time.monotonic()
+        resultado: dict[str, Optional[str]] = {}
+        faltan: list[str] = []
+        with self._lock:
+            for uid in pedidos:
+                entrada = self._cache.get(uid)
+                if entrada is not None and entrada[1] > ahora:
+                    self._cache.move_to_end(uid)
+                    resultado[uid] = entrada[0]
+                    self.aciertos += 1
+                else:
+                    faltan.append(uid)
+
+        col = self.db.collection(self.coleccion)
+        for i in range(0, len(faltan), self.tam_lote):
+            lote = faltan[i:i + self.tam_lote]
+            leidos: dict[str, Optional[str]] = dict.fromkeys(lote)
+            try:
+                for snap in self.db.get_all([col.document(uid) for uid in lote], field_paths=["Nombre"]):
+                    if getattr(snap, "exists", False):
+                        leidos[snap.id] = (snap.to_dict() or {}).get("Nombre") or None
+            except Exception:
+                # Sin cachear: se reintentará en la próxima consulta.
+                logger.exception("No se pudieron leer %s nombres de %s", len(lote), self.coleccion)
+                resultado.update(leidos)
+                continue
+            resultado.update(leidos)
+            with self._lock:
+                self.llamadas += 1
+                self.lecturas += len(lote)
+                ahora = time.monotonic()
+                for uid, nombre in leidos.items():
+                    self._guardar(uid, nombre, ahora)
+        return resultado
+
+    def nombre(self, uid: str, defecto: str = "Falta") -> str:
+        if not uid:
+            return defecto
+        return self.resolver([uid]).get(str(uid)) or defecto
+
+    def invalidar(self, uid: Optional[str] = None) -> None:
+        """Olvida un uid (p.ej. tras editar su Nombre) o, sin argumento, toda la caché."""
+        with self._lock:
+            if uid is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(str(uid), None)
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            return {
+                "entradas": len(self._cache),
+                "aciertos": self.aciertos,
+                "lecturas": self.lecturas,
+                "llamadas": self.llamadas,
+            }
+
+
+_resolutor: Optional[ResolutorNombres] = None
+_resolutor_lock = threading.Lock()
+
+
+def get_resolutor_nombres(db) -> ResolutorNombres:
+    """Resolutor compartido por todas las pantallas."""
+    global _resolutor
+    if _resolutor is None:
+        with _resolutor_lock:
+            if _resolutor is None:
+                _resolutor = ResolutorNombres(db)
+    return _resolutor
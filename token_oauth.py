@@ -0,0 +1,102 @@
+import datetime
+import logging
+import threading
+import time
+from typing import Optional
+
+from google.auth.transport.requests import Request
+from google.oauth2 import service_account
+
+logger = logging.getLogger(__name__)
+
+SCOPES_FCM = ["https://www.googleapis.com/auth/firebase.messaging"]
+MARGEN_RENOVACION = 300.0  # se renueva 5 min antes de caducar
+VIGENCIA_POR_DEFECTO = 3000.0  # si las credenciales no informan caducidad
+
+
+class ProveedorTokenOAuth:
+    """Cachea el access token de la cuenta de servicio y lo renueva antes de caducar.
+
+    Sólo un hilo renueva a la vez; el resto espera y reutiliza el token nuevo.
+    """
+
+    def __init__(self, ruta_credenciales: str, scopes: Optional[list[str]] = None, margen: float = MARGEN_RENOVACION) -> None:
+        self.ruta_credenciales = ruta_credenciales
+        self.scopes = list(scopes or SCOPES_FCM)
+        self.margen = margen
+        self.aciertos = 0
+        self.fallos = 0
+        self._creds = None
+        self._token: Optional[str] = None
+        self._caduca_en = 0.0
+        self._lock = threading.Lock()
+        self._lock_stats = threading.Lock()
+
+    def _vigente(self) -> bool:
+        return bool(self._token) and time.time() < self._caduca_en - self.margen
+
+    def _contar(self, acierto: bool) -> None:
+        with self._lock_stats:
+            if acierto:
+                self.aciertos += 1
+            else:
+                self.fallos += 1
+
+    def obtener(self) -> str:
+        if self._vigente():
+            self._contar(True)
+            return self._token  # type: ignore[return-value]
+        with self._lock:
+            if self._vigente():
+                self._contar(True)
+                return self._token  # type: ignore[return-value]
+            self._contar(False)
+            if self._creds is None:
+                self._creds = service_account.Credentials.from_service_account_file(
+                    self.ruta_credenciales, scopes=self.scopes
+                )
+            t0 = time.perf_counter()
+            self._creds.refresh(Request())
+            expiry = getattr(self._creds, "expiry", None)
+            if isinstance(expiry, datetime.datetime):
+                if expiry.tzinfo is None:
+                    expiry = expiry.replace(tzinfo=datetime.timezone.utc)
+                self._caduca_en = expiry.timestamp()
+            else:
+                self._caduca_en = time.time() + VIGENCIA_POR_DEFECTO
+            self._token = self._creds.token
+            logger.info(
+                "Token OAuth renovado en %.0f ms (aciertos=%s, fallos=%s)",
+                (time.perf_counter() - t0) * 1000,
+                self.aciertos,
+                self.fallos,
+            )
+            return self._token
+
+    def invalidar(self) -> None:
+        """Fuerza la renovación en la próxima llamada (p.ej. tras un 401)."""
+        with self._lock:
+            self._token = None
+            self._caduca_en = 0.0
+
+    def estadisticas(self) -> dict:
+        with self._lock_stats:
+            return {
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "caduca_en": self._caduca_en,
+            }
+
+
+_proveedores: dict[str, ProveedorTokenOAuth] = {}
+_proveedores_lock = threading.Lock()
+
+
+def get_proveedor_token(ruta_credenciales: str) -> ProveedorTokenOAuth:
+    """Proveedor compartido por proceso para un fichero de credenciales."""
+    with _proveedores_lock:
+        proveedor = _proveedores.get(ruta_credenciales)
+        if proveedor is None:
+            proveedor = ProveedorTokenOAuth(ruta_credenciales)
+            _proveedores[ruta_credenciales] = proveedor
+        return proveedor
@@ -1,8 +1,24 @@
 import datetime
-from typing import Optional
+import logging
+import threading
+from functools import partial
+from typing import Any, Callable, Iterable, Optional
 
 from google.cloud import firestore
 
+logger = logging.getLogger(__name__)
+
+TAM_GET_ALL_REENVIO = 300
+PATCH_REENVIO = {
+    "estado": "Pendiente",
+    "respuesta": None,
+    "respuestaEn": None,
+    "pushEstado": None,
+    "pushEnviados": 0,
+    "pushFallidos": 0,
+    "pushError": None,
+}
+
 
 def reenviar_mensaje(db: firestore.Client, mensaje_id: str, force: bool = True):
     """Reenvía un mensaje existente restableciendo su estado de negocio."""
@@ -13,27 +29,15 @@ def reenviar_mensaje(db: firestore.Client, mensaje_id: str, force: bool = True):
         raise ValueError(f"Mensaje no existe: {mensaje_id}")
     data = snap.to_dict() or {}
 
-    patch = {
-        "estado": "Pendiente",
-        "respuesta": None,
-        "respuestaEn": None,
-        "pushEstado": None,
-        "pushEnviados": 0,
-        "pushFallidos": 0,
-        "pushError": None,
-    }
-    doc_ref.update(patch)
-    data.update(patch)
+    doc_ref.update(PATCH_REENVIO)
+    data.update(PATCH_REENVIO)
 
     uid = str(data.get("uid", ""))
-    user = {}
-    if uid:
-        user_snap = db.collection("UsuariosAutorizados").document(uid).get()
-        if getattr(user_snap, "exists", False):
-            user = user_snap.to_dict() or {}
-
+    from directorio_tokens import get_directorio_tokens
     from notificaciones_push import enviar_push_por_mensaje
 
+    user = get_directorio_tokens(db).obtener(uid) or {}
+
     return enviar_push_por_mensaje(
         db,
         mensaje_id,
@@ -44,6 +48,93 @@ def reenviar_mensaje(db: firestore.Client, mensaje_id: str, force: bool = True):
     )
 
 
+def reenviar_mensajes(
+    db: firestore.Client,
+    mensaje_ids: Iterable[str],
+    force: bool = True,
+    *,
+    on_resultado: Optional[Callable[[str, Any], None]] = None,
+    on_progreso: Optional[Callable[[dict], None]] = None,
+    cancelar: Optional[threading.Event] = None,
+) -> dict[str, Any]:
+    """Reenvía varios mensajes: lectura con `get_all`, reseteo en WriteBatch,
+    usuarios precargados y envíos en paralelo en el pool de `push_service`.
+
+    Devuelve {mensaje_id: resultado o excepción}. `on_resultado(mensaje_id, resultado)`
+    se llama en cuanto termina cada mensaje (desde el hilo que lo envió).
+    """
+    from directorio_tokens import get_directorio_tokens
+    from escritor_lotes import MAX_OPS_LOTE, EscritorLotes
+    from notificaciones_push import enviar_push_por_mensaje
+    from push_service import get_push_service
+
+    ids = [str(i) for i in dict.fromkeys(mensaje_ids) if i]
+    col = db.collection("Mensajes")
+    resultados: dict[str, Any] = {}
+
+    def _resultado(mensaje_id: str, resultado: Any) -> Any:
+        resultados[mensaje_id] = resultado
+        if on_resultado is not None:
+            try:
+                on_resultado(mensaje_id, resultado)
+            except Exception:
+                logger.exception("Error en callback de resultado de reenvío")
+        return resultado
+
+    datos: dict[str, dict] = {}
+    for i in range(0, len(ids), TAM_GET_ALL_REENVIO):
+        refs = [col.document(mensaje_id) for mensaje_id in ids[i:i + TAM_GET_ALL_REENVIO]]
+        for snap in db.get_all(refs):
+            if getattr(snap, "exists", False):
+                datos[snap.id] = snap.to_dict() or {}
+    for mensaje_id in ids:
+        if mensaje_id not in datos:
+            _resultado(mensaje_id, ValueError(f"Mensaje no existe: {mensaje_id}"))
+
+    with EscritorLotes(db, tam_lote=MAX_OPS_LOTE, intervalo=None, nombre="reenviar_mensajes") as escritor:
+        for mensaje_id in datos:
+            escritor.update(col.document(mensaje_id), PATCH_REENVIO)
+    for path, detalle in escritor.fallos:
+        mensaje_id = str(path).rsplit("/", 1)[-1]
+        if datos.pop(mensaje_id, None) is not None:
+            _resultado(mensaje_id, RuntimeError(f"No se pudo restablecer {mensaje_id}: {detalle}"))
+    for data in datos.values():
+        data.update(PATCH_REENVIO)
+
+    usuarios = get_directorio_tokens(db).obtener_varios(str(d.get("uid", "")) for d in datos.values())
+
+    def _enviar(mensaje_id: str):
+        data = datos[mensaje_id]
+        try:
+            resultado = enviar_push_por_mensaje(
+                db,
+                mensaje_id,
+                data,
+                usuarios.get(str(data.get("uid", ""))) or {},
+                actualizar_estado=True,
+                force=force,
+            )
+        except Exception as exc:
+            _resultado(mensaje_id, exc)
+            raise
+        return _resultado(mensaje_id, resultado)
+
+    orden = list(datos)
+    get_push_service().ejecutar_campania(
+        [partial(_enviar, mensaje_id) for mensaje_id in orden],
+        on_progreso=on_progreso,
+        cancelar=cancelar,
+    )
+    logger.info(
+        "Reenvío de %s mensajes: %s restablecidos en %s lotes, %s usuarios precargados",
+        len(ids),
+        len(orden),
+        escritor.lotes,
+        len(usuarios),
+    )
+    return resultados
+
+
 def build_mensaje_id(uid: str, dt: Optional[datetime.datetime] = None) -> str:
     """Construye un ID de mensaje en formato UID_YYYY-MM-DDTHH:MM:SS.mmmmmm."""
     if dt is None: